@@ -3,12 +3,21 @@ CampusConnect v2.0 – ISBM College of Engineering, Pune
 Python Flask Full-Stack | Clean UI | Role-Based | QR Attendance | Timetable
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_from_directory
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-import sqlite3, os, json, uuid, hashlib
-from datetime import datetime, date, timedelta
+from flask import Flask, Request, render_template, request, redirect, url_for, flash, session, jsonify, abort, g, Response, stream_with_context
+from flask import before_render_template, template_rendered
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from werkzeug.utils import secure_filename, send_file
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+from markupsafe import Markup, escape
+from PIL import Image, ImageOps
+import click
+import sqlite3, atexit, os, re, io, csv, json, uuid, hashlib, itertools, threading, queue, time, tempfile, mimetypes, base64, bisect, zipfile, random, signal, gzip, posixpath, hmac
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, date, timedelta, timezone
 from functools import wraps
+from collections import OrderedDict
 
 app = Flask(__name__)
 app.secret_key = 'isbm-cc-v2-secret-2025'
@@ -18,14 +27,133 @@ app.config['MAX_CONTENT_LENGTH'] = 20 * 1024 * 1024
 DB_PATH = os.path.join(os.path.dirname(__file__), 'instance', 'cc.db')
 ALLOWED = {'png','jpg','jpeg','gif','webp'}
 
+app.config.update(
+    DATABASE=DB_PATH,
+    DB_POOL_SIZE=8,              # idle connections kept between requests
+    DB_BUSY_TIMEOUT=5000,        # ms a writer waits on a lock before "database is locked"
+    DB_JOURNAL_MODE='WAL',
+    DB_SYNCHRONOUS='NORMAL',
+    DB_MMAP_SIZE=64 * 1024 * 1024,
+    METRICS_ENABLED=True,         # time requests, templates and every SQL statement for /metrics
+    METRICS_TOKEN=None,           # bearer token Prometheus sends to /metrics; unset = admins only (and loopback, see below)
+    METRICS_LOOPBACK=False,       # let token-less loopback clients scrape; only safe when no proxy on this host forwards to the app
+    METRICS_DIR=None,             # shared dir where each worker snapshots its metrics (serve() picks a temp dir)
+    METRICS_FLUSH=5,              # s between a worker's snapshots
+    METRICS_MAX_QUERIES=500,      # distinct statement fingerprints tracked; the rest count as 'other'
+    SLOW_QUERY_MS=None,           # log statements slower than this many ms (execute + fetch); None = off
+    # `python run.py --serve` (see serve()); the flags there override these.
+    SERVER_WORKERS=os.cpu_count() or 2,  # processes; each has its own DB pool, caches and writer thread
+    SERVER_THREADS=16,            # concurrent connections per worker; keep DB_POOL_SIZE near it so threads reuse connections
+    SERVER_TIMEOUT=15,            # s an idle keep-alive connection (or a stalled read) holds a worker thread
+    SERVER_ACCESS_LOG=False,      # per-request log lines on stderr (the dev server always logs)
+    ATTENDANCE_STREAM_RESYNC=15,  # s between DB catch-ups on an idle live attendance stream
+    ACTIVE_SESSION_TTL=5,         # s an active attendance session row stays cached by token
+    USER_CACHE_TTL=30,            # s a users row stays in the process-wide cache (0 disables it)
+    USER_CACHE_SIZE=1024,         # max user rows kept per process (LRU)
+    PAGE_SIZE=24,                 # rows per page / infinite-scroll batch on the list pages
+    IMPORT_WORKERS=1,             # background bulk-import jobs run at once per process
+    IMPORT_HASH_WORKERS=os.cpu_count() or 2,  # processes hashing imported passwords
+    IMPORT_CHUNK_SIZE=500,        # rows validated and inserted per transaction
+    IMPORT_MAX_ERRORS=1000,       # per-row errors kept in a job's report
+    ATTENDANCE_ALERT_PCT=75,      # % below which a student shows on the low-attendance list
+    ATTENDANCE_ALERT_LIMIT=200,   # max students listed there
+    EXPORT_FETCH_SIZE=1000,       # rows pulled per fetchmany() while streaming a report export
+    PUBLIC_CACHE_TTL=60,          # s the landing page, /api/stats and /departments aggregates are reused
+    FRAGMENT_CACHE_SIZE=512,      # rendered fragments kept per process (LRU; 0 disables the fragment cache)
+    FRAGMENT_CACHE_TTL=60,        # s a fragment lives even if its tables do not change (bounds counters such as reg_count)
+    WRITE_BATCH_SIZE=64,          # max statements group-committed in one transaction
+    WRITE_BATCH_WAIT_MS=2,        # how long the writer waits to fill a batch
+    LIKE_FLUSH_INTERVAL=1.0,      # s memory likes are buffered before one batched write (0 = write through)
+    LIKE_FLUSH_MAX=500,           # pending (memory, user) pairs that trigger an early flush
+    LIKE_BULK_MAX=100,            # photos accepted by one /api/memories/likes request
+    IMAGE_VARIANTS={'thumb': 320, 'medium': 1024, 'full': 2048},  # name -> longest side in px
+    IMAGE_QUALITY=82,
+    IMAGE_WORKERS=2,              # background resize threads per process
+    UPLOAD_WORKERS=4,             # threads hashing/moving the files of one bulk upload
+    UPLOAD_CHUNK_SIZE=4 * 1024 * 1024,   # client chunk size for resumable uploads
+    MAX_UPLOAD_FILE_SIZE=100 * 1024 * 1024,
+    SCHEDULER_ENABLED=True,       # run the jobs below on a background thread in each worker (off under TESTING)
+    SCHEDULER_TICK=15,            # s between checks for due jobs (jittered +-50%)
+    SCHEDULER_LEASE=600,          # s a claimed job stays leased to one worker if it never reports back
+    SCHEDULE={'expire-sessions': 60, 'event-status': 900, 'prune-uploads': 6 * 3600, 'optimize': 6 * 3600},  # job -> s between runs (0 disables)
+    UPLOAD_ORPHAN_GRACE=24 * 3600,  # s before an unclaimed upload part or unreferenced blob is pruned
+    MEDIA_URL='/media/',          # prefix upload_url() renders; served by media() below
+    MEDIA_MAX_AGE=3600,           # s browsers may cache uploads whose name is not content-hashed
+    # Hand file bodies to the front proxy instead of streaming them from a worker:
+    #   'x-accel'   nginx: location /_uploads/ { internal; alias <repo>/static/uploads/; }
+    #   'x-sendfile' Apache mod_xsendfile / lighttpd (absolute path in X-Sendfile)
+    MEDIA_SENDFILE=None,
+    MEDIA_ACCEL_PREFIX='/_uploads/',
+    ASSET_DIR=os.path.join(os.path.dirname(__file__), 'static', 'dist'),  # `flask build-assets` output, served under /assets/
+    GZIP_ENABLED=True,            # compress HTML and JSON responses for clients that accept gzip
+    GZIP_MIN_SIZE=1024,           # bytes below which a body is sent as is
+    GZIP_LEVEL=6,
+    GZIP_MIMETYPES=('text/html', 'application/json'),
+)
+
 # ── DB ────────────────────────────────────────────────────────────────────────
-def get_db():
-    c = sqlite3.connect(DB_PATH)
+def connect_db(path=None):
+    """Open a connection with the configured pragmas applied once."""
+    cfg = app.config
+    c = sqlite3.connect(path or cfg['DATABASE'], timeout=cfg['DB_BUSY_TIMEOUT'] / 1000, check_same_thread=False,
+                        factory=ProfiledConnection if cfg['METRICS_ENABLED'] else sqlite3.Connection)
     c.row_factory = sqlite3.Row
+    c.execute(f"PRAGMA journal_mode={cfg['DB_JOURNAL_MODE']}")
+    c.execute(f"PRAGMA busy_timeout={int(cfg['DB_BUSY_TIMEOUT'])}")
+    c.execute(f"PRAGMA synchronous={cfg['DB_SYNCHRONOUS']}")
+    c.execute(f"PRAGMA mmap_size={int(cfg['DB_MMAP_SIZE'])}")
     return c
 
+class ConnectionPool:
+    """Bounded LIFO pool of idle connections shared across requests."""
+    def __init__(self):
+        self._idle = []; self._lock = threading.Lock(); self._path = None
+        self.hits = 0; self.misses = 0; self.discarded = 0
+        # A forked worker must never reuse its parent's sqlite handles; just forget them.
+        if hasattr(os, 'register_at_fork'): os.register_at_fork(after_in_child=lambda: setattr(self, '_idle', []))
+
+    def acquire(self):
+        path = app.config['DATABASE']
+        with self._lock:
+            if path != self._path:  # DATABASE changed (tests, CLI) – drop stale connections
+                for c in self._idle: c.close()
+                self._idle = []; self._path = path
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            self.misses += 1
+        return connect_db(path)
+
+    def release(self, conn):
+        if conn.in_transaction: conn.rollback()
+        with self._lock:
+            if len(self._idle) < app.config['DB_POOL_SIZE']:
+                self._idle.append(conn); return
+            self.discarded += 1
+        conn.close()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'size': app.config['DB_POOL_SIZE'], 'idle': len(self._idle), 'hits': self.hits,
+                    'misses': self.misses, 'discarded': self.discarded,
+                    'hit_ratio': round(self.hits / total, 4) if total else 0.0}
+
+db_pool = ConnectionPool()
+
+def get_db():
+    """Connection bound to the current app context; returned to the pool on teardown."""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None: db_pool.release(conn)
+
 def init_db():
-    conn = get_db(); c = conn.cursor()
+    conn = connect_db(); c = conn.cursor()
     c.executescript('''
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -233,11 +361,1139 @@ def init_db():
             ('Computer Engineering','TE','5','Monday',2,'Cloud Computing',2,'Dr. Rajesh Kumar','CS-201','10:00','11:00',2),
         ]
         c.executemany("INSERT INTO timetable (department,year,semester,day,period,subject,teacher_id,teacher_name,room,time_from,time_to,created_by) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", tt)
-    conn.commit(); conn.close()
+    conn.commit()
+    migrate_db(conn)
+    conn.close()
+
+# Recomputes every denormalized counter from its source rows. Run by migration 2
+# and by `flask --app app repair-counters` if the counters ever drift.
+REPAIR_COUNTERS_SQL = '''
+    UPDATE events SET reg_count=(SELECT COUNT(*) FROM event_registrations WHERE event_id=events.id);
+    UPDATE attendance_sessions SET present_count=(SELECT COUNT(*) FROM attendance_records WHERE session_id=attendance_sessions.id);
+    UPDATE attendance_sessions SET total_students=(SELECT COUNT(*) FROM users u WHERE u.role='student'
+        AND u.department=attendance_sessions.department AND u.year=attendance_sessions.year);
+    DELETE FROM attendance_totals;
+    INSERT INTO attendance_totals (student_id, teacher_id, present)
+        SELECT ar.student_id, COALESCE(s.teacher_id,0), COUNT(*) FROM attendance_records ar
+        JOIN attendance_sessions s ON ar.session_id=s.id GROUP BY ar.student_id, COALESCE(s.teacher_id,0);
+    UPDATE memories SET likes=(SELECT COUNT(*) FROM memory_likes WHERE memory_id=memories.id);
+'''
+
+# Rebuilds attendance_rollup (migration 12) from closed sessions. A session is
+# held for its class roster plus anyone who marked it from outside the class.
+ROLLUP_REBUILD_SQL = '''
+    DELETE FROM attendance_rollup;
+    INSERT INTO attendance_rollup (department, year, subject, month, student_id, present, held)
+        SELECT COALESCE(s.department,''), COALESCE(s.year,''), COALESCE(s.subject,''), substr(COALESCE(s.date, s.created_at),1,7),
+               m.student_id, COUNT(ar.id), COUNT(*)
+        FROM (SELECT s.id AS sid, u.id AS student_id FROM attendance_sessions s
+                  JOIN users u ON u.role='student' AND u.department=s.department AND u.year=s.year WHERE s.is_active=0
+              UNION SELECT ar.session_id, ar.student_id FROM attendance_records ar
+                  JOIN attendance_sessions s ON s.id=ar.session_id WHERE s.is_active=0) m
+        JOIN attendance_sessions s ON s.id=m.sid
+        LEFT JOIN attendance_records ar ON ar.session_id=m.sid AND ar.student_id=m.student_id
+        GROUP BY 1, 2, 3, 4, 5;
+'''
+
+# Columns that may hold a blob path (see the Blob store section).
+BLOB_REFS = [('memories', 'image_path'), ('events', 'banner_image'), ('achievements', 'certificate_image'), ('users', 'profile_pic')]
+
+# Full-text indexed columns per table (see the Search section).
+SEARCH_INDEXES = {
+    'events': ('title', 'description', 'venue', 'tags'),
+    'notices': ('title', 'content', 'category'),
+    'memories': ('title', 'description', 'album'),
+    'achievements': ('title', 'description', 'achievement_type', 'student_name'),
+}
+
+def fts_index_sql(t, cols):
+    """External-content FTS5 table over ``t`` plus the triggers that keep it in sync."""
+    c = ', '.join(cols); new = ', '.join(f'NEW.{x}' for x in cols); old = ', '.join(f'OLD.{x}' for x in cols)
+    return f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {t}_fts USING fts5({c}, content='{t}', content_rowid='id', prefix='2 3',
+        tokenize='porter unicode61 remove_diacritics 2');
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_fts_ins AFTER INSERT ON {t} BEGIN
+        INSERT INTO {t}_fts(rowid, {c}) VALUES (NEW.id, {new});
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_fts_del AFTER DELETE ON {t} BEGIN
+        INSERT INTO {t}_fts({t}_fts, rowid, {c}) VALUES ('delete', OLD.id, {old});
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_fts_upd AFTER UPDATE OF {c} ON {t} BEGIN
+        INSERT INTO {t}_fts({t}_fts, rowid, {c}) VALUES ('delete', OLD.id, {old});
+        INSERT INTO {t}_fts(rowid, {c}) VALUES (NEW.id, {new});
+    END;
+    INSERT INTO {t}_fts({t}_fts) VALUES ('rebuild');'''
+
+# Schema migrations, applied in order and tracked through PRAGMA user_version.
+MIGRATIONS = [
+    (1, '''
+    CREATE INDEX IF NOT EXISTS idx_users_role_dept ON users(role, department, year, full_name);
+    CREATE INDEX IF NOT EXISTS idx_users_dept_year ON users(department, year, role);
+    CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at);
+    CREATE INDEX IF NOT EXISTS idx_tt_class ON timetable(department, year, day, period);
+    CREATE INDEX IF NOT EXISTS idx_tt_teacher ON timetable(teacher_id, day, period);
+    CREATE INDEX IF NOT EXISTS idx_tt_manage ON timetable(department, year, day, period, teacher_id);
+    CREATE INDEX IF NOT EXISTS idx_as_teacher ON attendance_sessions(teacher_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_as_teacher_date ON attendance_sessions(teacher_id, date);
+    CREATE INDEX IF NOT EXISTS idx_as_class ON attendance_sessions(department, year, is_active);
+    CREATE INDEX IF NOT EXISTS idx_ar_student ON attendance_records(student_id, marked_at, session_id);
+    CREATE INDEX IF NOT EXISTS idx_ar_session ON attendance_records(session_id, marked_at);
+    CREATE INDEX IF NOT EXISTS idx_events_status ON events(status, event_date);
+    CREATE INDEX IF NOT EXISTS idx_events_date ON events(event_date);
+    CREATE INDEX IF NOT EXISTS idx_events_organizer ON events(organizer_id, event_date);
+    CREATE INDEX IF NOT EXISTS idx_er_user ON event_registrations(user_id, event_id);
+    CREATE INDEX IF NOT EXISTS idx_mem_created ON memories(created_at);
+    CREATE INDEX IF NOT EXISTS idx_mem_event ON memories(event_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_mem_album ON memories(album, created_at);
+    CREATE INDEX IF NOT EXISTS idx_mem_uploader ON memories(uploader_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_ml_user ON memory_likes(user_id, memory_id);
+    CREATE INDEX IF NOT EXISTS idx_notices_feed ON notices(is_important, created_at);
+    CREATE INDEX IF NOT EXISTS idx_notices_audience ON notices(department, year, is_important, created_at);
+    CREATE INDEX IF NOT EXISTS idx_notices_cat ON notices(category, is_important, created_at);
+    CREATE INDEX IF NOT EXISTS idx_ach_student ON achievements(student_id, date);
+    CREATE INDEX IF NOT EXISTS idx_ach_approved ON achievements(approved, department, date);
+    '''),
+    (2, '''
+    ALTER TABLE events ADD COLUMN reg_count INTEGER DEFAULT 0;
+    CREATE TABLE IF NOT EXISTS attendance_totals (
+        student_id INTEGER NOT NULL,
+        teacher_id INTEGER NOT NULL,
+        present INTEGER DEFAULT 0,
+        PRIMARY KEY (student_id, teacher_id)
+    );
+    CREATE TRIGGER IF NOT EXISTS trg_er_ins AFTER INSERT ON event_registrations BEGIN
+        UPDATE events SET reg_count=reg_count+1 WHERE id=NEW.event_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_er_del AFTER DELETE ON event_registrations BEGIN
+        UPDATE events SET reg_count=reg_count-1 WHERE id=OLD.event_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_ar_ins AFTER INSERT ON attendance_records BEGIN
+        UPDATE attendance_sessions SET present_count=present_count+1 WHERE id=NEW.session_id;
+        INSERT INTO attendance_totals (student_id, teacher_id, present)
+            SELECT NEW.student_id, COALESCE(teacher_id,0), 1 FROM attendance_sessions WHERE id=NEW.session_id
+            ON CONFLICT(student_id, teacher_id) DO UPDATE SET present=present+1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_ar_del AFTER DELETE ON attendance_records BEGIN
+        UPDATE attendance_sessions SET present_count=present_count-1 WHERE id=OLD.session_id;
+        UPDATE attendance_totals SET present=present-1 WHERE student_id=OLD.student_id
+            AND teacher_id=(SELECT COALESCE(teacher_id,0) FROM attendance_sessions WHERE id=OLD.session_id);
+    END;
+    ''' + REPAIR_COUNTERS_SQL),
+    (3, '''
+    ALTER TABLE memories ADD COLUMN variants TEXT;
+    ALTER TABLE events ADD COLUMN banner_variants TEXT;
+    '''),
+    (4, '''
+    ALTER TABLE memories ADD COLUMN sha256 TEXT;
+    '''),
+    (5, '''
+    CREATE TABLE IF NOT EXISTS blobs (
+        sha256 TEXT PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        size INTEGER,
+        refs INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT (datetime('now'))
+    );
+    ''' + ''.join(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_blob_ins AFTER INSERT ON {t} WHEN NEW.{c} LIKE 'blobs/%' BEGIN
+        UPDATE blobs SET refs=refs+1 WHERE path=NEW.{c};
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_blob_del AFTER DELETE ON {t} WHEN OLD.{c} LIKE 'blobs/%' BEGIN
+        UPDATE blobs SET refs=refs-1 WHERE path=OLD.{c};
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_blob_upd AFTER UPDATE OF {c} ON {t} WHEN OLD.{c} IS NOT NEW.{c} BEGIN
+        UPDATE blobs SET refs=refs-1 WHERE path=OLD.{c};
+        UPDATE blobs SET refs=refs+1 WHERE path=NEW.{c};
+    END;''' for t, c in BLOB_REFS)),
+    (6, '''
+    CREATE INDEX IF NOT EXISTS idx_events_dept ON events(department);
+    '''),
+    (7, '''
+    CREATE INDEX IF NOT EXISTS idx_users_role_name ON users(role, full_name);
+    '''),
+    (8, ''.join(fts_index_sql(t, cols) for t, cols in SEARCH_INDEXES.items())),
+    (9, '''
+    CREATE TABLE IF NOT EXISTS cache_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0);
+    INSERT OR IGNORE INTO cache_versions (name) VALUES ('timetable');
+    CREATE TRIGGER IF NOT EXISTS trg_tt_ver_ins AFTER INSERT ON timetable BEGIN
+        UPDATE cache_versions SET version=version+1 WHERE name='timetable';
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_tt_ver_del AFTER DELETE ON timetable BEGIN
+        UPDATE cache_versions SET version=version+1 WHERE name='timetable';
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_tt_ver_upd AFTER UPDATE ON timetable BEGIN
+        UPDATE cache_versions SET version=version+1 WHERE name='timetable';
+    END;
+    '''),
+    (10, '''
+    CREATE TABLE IF NOT EXISTS import_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        filename TEXT,
+        status TEXT DEFAULT 'queued',
+        total INTEGER DEFAULT 0,
+        inserted INTEGER DEFAULT 0,
+        skipped INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        errors TEXT,
+        created_by INTEGER REFERENCES users(id),
+        created_at TEXT DEFAULT (datetime('now')),
+        finished_at TEXT
+    );
+    '''),
+    (11, '''
+    CREATE INDEX IF NOT EXISTS idx_as_subject ON attendance_sessions(department, year, subject, date);
+    '''),
+    # Per student x subject x month attendance. Sessions count towards held (and
+    # their marks towards present) once closed, so present never runs ahead of held;
+    # marks added to an already closed session (imports) are credited as they land.
+    (12, '''
+    CREATE TABLE IF NOT EXISTS attendance_rollup (
+        department TEXT NOT NULL,
+        year TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        month TEXT NOT NULL,
+        student_id INTEGER NOT NULL,
+        present INTEGER NOT NULL DEFAULT 0,
+        held INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (department, year, subject, month, student_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_rollup_student ON attendance_rollup(student_id, subject);
+    CREATE TRIGGER IF NOT EXISTS trg_as_close AFTER UPDATE OF is_active ON attendance_sessions
+    WHEN OLD.is_active=1 AND NEW.is_active=0 BEGIN
+        INSERT INTO attendance_rollup (department, year, subject, month, student_id, present, held)
+            SELECT COALESCE(NEW.department,''), COALESCE(NEW.year,''), COALESCE(NEW.subject,''), substr(COALESCE(NEW.date, NEW.created_at),1,7), id, 0, 1
+            FROM users WHERE role='student' AND department=NEW.department AND year=NEW.year
+                AND id NOT IN (SELECT student_id FROM attendance_records WHERE session_id=NEW.id)
+            ON CONFLICT DO UPDATE SET held=held+1;
+        INSERT INTO attendance_rollup (department, year, subject, month, student_id, present, held)
+            SELECT COALESCE(NEW.department,''), COALESCE(NEW.year,''), COALESCE(NEW.subject,''), substr(COALESCE(NEW.date, NEW.created_at),1,7), student_id, 1, 1
+            FROM attendance_records WHERE session_id=NEW.id
+            ON CONFLICT DO UPDATE SET present=present+1, held=held+1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_as_ins_closed AFTER INSERT ON attendance_sessions WHEN NEW.is_active=0 BEGIN
+        INSERT INTO attendance_rollup (department, year, subject, month, student_id, present, held)
+            SELECT COALESCE(NEW.department,''), COALESCE(NEW.year,''), COALESCE(NEW.subject,''), substr(COALESCE(NEW.date, NEW.created_at),1,7), id, 0, 1
+            FROM users WHERE role='student' AND department=NEW.department AND year=NEW.year
+            ON CONFLICT DO UPDATE SET held=held+1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_ar_rollup_ins AFTER INSERT ON attendance_records BEGIN
+        INSERT INTO attendance_rollup (department, year, subject, month, student_id, present, held)
+            SELECT COALESCE(s.department,''), COALESCE(s.year,''), COALESCE(s.subject,''), substr(COALESCE(s.date, s.created_at),1,7), NEW.student_id, 1,
+                   NOT EXISTS (SELECT 1 FROM users u WHERE u.id=NEW.student_id AND u.role='student' AND u.department=s.department AND u.year=s.year)
+            FROM attendance_sessions s WHERE s.id=NEW.session_id AND s.is_active=0
+            ON CONFLICT DO UPDATE SET present=present+1, held=held+excluded.held;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_ar_rollup_del AFTER DELETE ON attendance_records BEGIN
+        UPDATE attendance_rollup SET present=present-1 WHERE student_id=OLD.student_id AND (department, year, subject, month) =
+            (SELECT COALESCE(department,''), COALESCE(year,''), COALESCE(subject,''), substr(COALESCE(date, created_at),1,7)
+             FROM attendance_sessions WHERE id=OLD.session_id AND is_active=0);
+    END;
+    ''' + ROLLUP_REBUILD_SQL),
+    (13, '''
+    CREATE TABLE IF NOT EXISTS scheduler_jobs (
+        name TEXT PRIMARY KEY,
+        last_run REAL NOT NULL DEFAULT 0,
+        lease_owner TEXT,
+        lease_until REAL NOT NULL DEFAULT 0,
+        runs INTEGER NOT NULL DEFAULT 0,
+        last_status TEXT,
+        last_result TEXT,
+        last_duration REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_as_open ON attendance_sessions(expires_at) WHERE is_active=1;
+    '''),
+    # Versions for the fragment cache; events ignore reg_count/banner_variants, which change on every registration or resize.
+    (14, "INSERT OR IGNORE INTO cache_versions (name) VALUES ('notices'), ('events');" + ''.join(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_ver_ins AFTER INSERT ON {t} BEGIN
+        UPDATE cache_versions SET version=version+1 WHERE name='{t}';
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_ver_del AFTER DELETE ON {t} BEGIN
+        UPDATE cache_versions SET version=version+1 WHERE name='{t}';
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_ver_upd AFTER UPDATE{cols} ON {t} BEGIN
+        UPDATE cache_versions SET version=version+1 WHERE name='{t}';
+    END;''' for t, cols in [('notices', ''), ('events', ' OF title, description, department, event_type, venue, event_date, event_time, '
+                                                         'reg_deadline, max_participants, status, banner_image, tags')])),
+]
+
+def migrate_db(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for v, sql in MIGRATIONS:
+        if v <= version: continue
+        conn.executescript(f"BEGIN; {sql} PRAGMA user_version={v}; COMMIT;")
+    conn.execute("PRAGMA optimize")
+
+# Per-teacher attendance totals and registration counts are trigger-maintained (migration 2).
+TEACHER_ATT_JOIN = "LEFT JOIN attendance_totals t ON t.student_id=u.id AND t.teacher_id=?"
+UPCOMING_EVENTS_SQL = "SELECT *, reg_count as rc FROM events WHERE status='upcoming' ORDER BY event_date LIMIT 6"
+
+# ── Metrics ───────────────────────────────────────────────────────────────────
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SQL_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_fingerprints = {}
+
+def sql_fingerprint(sql):
+    """Statement text with literals as ? and whitespace collapsed, so each query shape is one series."""
+    fp = _fingerprints.get(sql)
+    if fp is None:
+        fp = SQL_IN_LIST.sub('(?, ...)', SQL_LITERAL.sub('?', ' '.join(sql.split())))
+        if len(_fingerprints) < 4096: _fingerprints[sql] = fp
+    return fp
+
+class Metrics:
+    """Per-process request and query statistics, rendered in Prometheus text format by /metrics.
+
+    Histograms are [count per LATENCY_BUCKETS bucket..., +Inf count, sum]. With
+    METRICS_DIR set (serve() sets one up for its workers) each process snapshots
+    itself there every METRICS_FLUSH seconds and /metrics adds up all the files,
+    so a scrape can lag the other workers by up to that long.
+    """
+    def __init__(self):
+        self._lock = threading.Lock(); self.local = threading.local()
+        self.routes = {}; self.queries = {}; self._pid = None
+
+    def query(self, fp, seconds, count=1):
+        with self._lock:
+            if fp not in self.queries and len(self.queries) >= app.config['METRICS_MAX_QUERIES']: fp = 'other'
+            q = self.queries.setdefault(fp, [0, 0.0]); q[0] += count; q[1] += seconds
+        req = getattr(self.local, 'req', None)
+        if req is not None: req[0] += seconds; req[1] += count
+
+    def request(self, route, method, status, phases, queries):
+        with self._lock:
+            r = self.routes.get((route, method))
+            if r is None:
+                r = self.routes[(route, method)] = {'status': {}, 'queries': 0, **{p: [0] * (len(LATENCY_BUCKETS) + 2) for p in phases}}
+            r['status'][str(status)] = r['status'].get(str(status), 0) + 1; r['queries'] += queries
+            for p, v in phases.items():
+                h = r[p]; h[bisect.bisect_left(LATENCY_BUCKETS, v)] += 1; h[-1] += v
+
+    def snapshot(self):
+        with self._lock:
+            return {'routes': [[k[0], k[1], json.loads(json.dumps(v))] for k, v in self.routes.items()],
+                    'queries': {k: list(v) for k, v in self.queries.items()}}
+
+    def start_flusher(self):
+        """Snapshot this process every METRICS_FLUSH seconds on a daemon thread (once per pid)."""
+        if not app.config['METRICS_DIR'] or self._pid == os.getpid(): return
+        with self._lock:
+            if self._pid == os.getpid(): return
+            self._pid = os.getpid()
+        def run():
+            while True:
+                time.sleep(app.config['METRICS_FLUSH'])
+                try: self.flush()
+                except OSError as e: app.logger.warning("metrics flush failed: %s", e)
+        threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+
+    def flush(self):
+        d = app.config['METRICS_DIR']; os.makedirs(d, exist_ok=True)
+        path = os.path.join(d, f'metrics-{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as fh: json.dump(self.snapshot(), fh)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        """Snapshots of every process (this one live), merged."""
+        snaps = [self.snapshot()]
+        if app.config['METRICS_DIR']:
+            self.flush(); snaps = []
+            for e in os.scandir(app.config['METRICS_DIR']):
+                if e.name.endswith('.json'):
+                    try:
+                        with open(e.path) as fh: snaps.append(json.load(fh))
+                    except (OSError, ValueError): pass  # a worker mid-replace; its next flush is picked up
+        routes, queries = {}, {}
+        for s in snaps:
+            for route, method, r in s['routes']:
+                m = routes.setdefault((route, method), {'status': {}, 'queries': 0})
+                for code, n in r.pop('status').items(): m['status'][code] = m['status'].get(code, 0) + n
+                m['queries'] += r.pop('queries')
+                for p, h in r.items(): m[p] = [a + b for a, b in zip(m[p], h)] if p in m else h
+            for fp, (n, t) in s['queries'].items():
+                q = queries.setdefault(fp, [0, 0.0]); q[0] += n; q[1] += t
+        return routes, queries
+
+    def render(self):
+        esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        routes, queries = self.collect(); out = []
+        def family(name, kind, help): out.append(f'# HELP {name} {help}\n# TYPE {name} {kind}')
+        family('cc_http_requests_total', 'counter', 'HTTP requests by route, method and status.')
+        for (route, method), r in sorted(routes.items()):
+            for code, n in sorted(r['status'].items()):
+                out.append(f'cc_http_requests_total{{route="{esc(route)}",method="{method}",status="{code}"}} {n}')
+        family('cc_http_request_duration_seconds', 'histogram', 'Request latency; phase is total, sql (time in queries) or render (templates, excluding their queries).')
+        for (route, method), r in sorted(routes.items()):
+            for phase in ('total', 'sql', 'render'):
+                h = r[phase]; labels = f'route="{esc(route)}",method="{method}",phase="{phase}"'; acc = 0
+                for le, n in zip((*LATENCY_BUCKETS, '+Inf'), h[:-1]):
+                    acc += n; out.append(f'cc_http_request_duration_seconds_bucket{{{labels},le="{le}"}} {acc}')
+                out.append(f'cc_http_request_duration_seconds_sum{{{labels}}} {h[-1]:.6f}')
+                out.append(f'cc_http_request_duration_seconds_count{{{labels}}} {acc}')
+        family('cc_http_request_queries_total', 'counter', 'SQL statements executed while serving each route.')
+        for (route, method), r in sorted(routes.items()):
+            out.append(f'cc_http_request_queries_total{{route="{esc(route)}",method="{method}"}} {r["queries"]}')
+        family('cc_sql_queries_total', 'counter', 'Executions per statement fingerprint.')
+        for fp, (n, _) in sorted(queries.items()): out.append(f'cc_sql_queries_total{{query="{esc(fp)}"}} {n}')
+        family('cc_sql_query_seconds_total', 'counter', 'Time spent executing and fetching per statement fingerprint.')
+        for fp, (_, t) in sorted(queries.items()): out.append(f'cc_sql_query_seconds_total{{query="{esc(fp)}"}} {t:.6f}')
+        # Process-local gauges of the in-memory pools and caches (the scraped worker's view).
+        pool, cache, frag = db_pool.stats(), public_cache.stats(), fragment_cache.stats()
+        for name, v, help in [('cc_db_pool_hits_total', pool['hits'], 'Connections reused from the pool.'),
+                              ('cc_db_pool_misses_total', pool['misses'], 'Connections opened because the pool was empty.'),
+                              ('cc_public_cache_hits_total', cache['hits'], 'Public aggregate cache hits.'),
+                              ('cc_public_cache_misses_total', cache['misses'], 'Public aggregate cache misses.'),
+                              ('cc_fragment_cache_hits_total', frag['hits'], 'Rendered fragment cache hits.'),
+                              ('cc_fragment_cache_misses_total', frag['misses'], 'Rendered fragment cache misses.'),
+                              ('cc_write_batches_total', write_batcher.batches, 'Group commits by the attendance writer.'),
+                              ('cc_write_statements_total', write_batcher.statements, 'Statements group-committed by the attendance writer.')]:
+            family(name, 'counter', help); out.append(f'{name} {v}')
+        return '\n'.join(out) + '\n'
+
+metrics = Metrics()
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that charges execute and fetch time to the statement's fingerprint and the current request."""
+    _fp = None; _spent = 0.0; _logged = False
+
+    def _charge(self, t0, count=0):
+        dt = time.perf_counter() - t0; metrics.query(self._fp, dt, count); self._spent += dt
+        slow = app.config['SLOW_QUERY_MS']
+        if slow is not None and self._spent * 1000 >= slow and not self._logged:
+            self._logged = True
+            app.logger.warning("slow query %.1f ms on %s: %s", self._spent * 1000, getattr(metrics.local, 'route', '-'), self._fp)
+
+    def execute(self, sql, params=()):
+        self._fp = sql_fingerprint(sql); self._spent = 0.0; self._logged = False; t0 = time.perf_counter()
+        try: return super().execute(sql, params)
+        finally: self._charge(t0, 1)
+
+    def executemany(self, sql, seq):
+        self._fp = sql_fingerprint(sql); self._spent = 0.0; self._logged = False; t0 = time.perf_counter()
+        try: return super().executemany(sql, seq)
+        finally: self._charge(t0, 1)
+
+    def executescript(self, script):
+        self._fp = 'script: ' + sql_fingerprint(script)[:120]; self._spent = 0.0; self._logged = False; t0 = time.perf_counter()
+        try: return super().executescript(script)
+        finally: self._charge(t0, 1)
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try: return super().__next__()
+        finally: self._charge(t0)
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        try: return super().fetchone()
+        finally: self._charge(t0)
+
+    def fetchmany(self, *args):
+        t0 = time.perf_counter()
+        try: return super().fetchmany(*args)
+        finally: self._charge(t0)
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        try: return super().fetchall()
+        finally: self._charge(t0)
+
+class ProfiledConnection(sqlite3.Connection):
+    """connect_db()'s connection class while METRICS_ENABLED; every statement goes through a ProfiledCursor."""
+    def cursor(self, factory=ProfiledCursor): return super().cursor(factory)
+    def execute(self, sql, params=()): return self.cursor().execute(sql, params)
+    def executemany(self, sql, seq): return self.cursor().executemany(sql, seq)
+    def executescript(self, script): return self.cursor().executescript(script)
+
+@app.before_request
+def start_request_timer():
+    if not app.config['METRICS_ENABLED']: return
+    g._t0 = time.perf_counter(); g._render = 0.0
+    metrics.local.req = [0.0, 0]; metrics.local.route = request.path
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    if '_t0' in g: g._render_t0 = (time.perf_counter(), metrics.local.req[0])
+
+@template_rendered.connect_via(app)
+def stop_render_timer(sender, template, context, **extra):
+    start = g.pop('_render_t0', None)
+    if start:  # queries run from inside the template count as sql, not render
+        g._render += time.perf_counter() - start[0] - (metrics.local.req[0] - start[1])
+
+@app.after_request
+def record_request_timing(resp):
+    t0 = g.pop('_t0', None)
+    if t0 is not None:
+        sql, n = metrics.local.req; metrics.local.req = None
+        metrics.request(request.url_rule.rule if request.url_rule else '<unmatched>', request.method, resp.status_code,
+                        {'total': time.perf_counter() - t0, 'sql': sql, 'render': g._render}, n)
+        metrics.start_flusher()
+    return resp
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target: bearer METRICS_TOKEN if set, otherwise admins (and loopback with METRICS_LOOPBACK).
+
+    Behind a same-host proxy every request comes from loopback, so that is not
+    trusted by default, nor ever for a request carrying forwarding headers.
+    """
+    token = app.config['METRICS_TOKEN']
+    if token: allowed = hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        forwarded = any(h in request.headers for h in ('Forwarded', 'X-Forwarded-For', 'X-Real-IP'))
+        allowed = session.get('role') == 'admin' or (app.config['METRICS_LOOPBACK'] and not forwarded and request.remote_addr in ('127.0.0.1', '::1'))
+    if not allowed: abort(403)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ── Group-commit writer ───────────────────────────────────────────────────────
+class WriteBatcher:
+    """Single writer thread that group-commits statements submitted concurrently.
+
+    submit() blocks until the statement's transaction has committed and returns
+    its (rowcount, lastrowid). Each statement runs under its own savepoint, so
+    one failure does not roll back the rest of the batch.
+    """
+    def __init__(self):
+        self._q = queue.Queue(); self._lock = threading.Lock(); self._pid = None
+        self.batches = 0; self.statements = 0
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid(): return
+        with self._lock:
+            if self._pid != os.getpid():  # first use, or first use after a fork
+                threading.Thread(target=self._run, name='write-batcher', daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, sql, params=()):
+        self._ensure_thread()
+        fut = Future(); self._q.put((sql, params, fut))
+        return fut.result()
+
+    def _run(self):
+        conn = path = None
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + app.config['WRITE_BATCH_WAIT_MS'] / 1000
+            while len(batch) < app.config['WRITE_BATCH_SIZE']:
+                try: batch.append(self._q.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty: break
+            if path != app.config['DATABASE']:
+                if conn: conn.close()
+                path = app.config['DATABASE']; conn = connect_db(path); conn.isolation_level = None
+            results = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for sql, params, fut in batch:
+                    conn.execute("SAVEPOINT w")
+                    try:
+                        cur = conn.execute(sql, params); results.append((fut, (cur.rowcount, cur.lastrowid)))
+                    except sqlite3.Error as e:
+                        conn.execute("ROLLBACK TO w"); results.append((fut, e))
+                    conn.execute("RELEASE w")
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if conn.in_transaction: conn.execute("ROLLBACK")
+                results = [(fut, e) for _, _, fut in batch]
+            self.batches += 1; self.statements += len(batch)
+            for fut, res in results:
+                fut.set_exception(res) if isinstance(res, Exception) else fut.set_result(res)
+
+write_batcher = WriteBatcher()
+
+# ── Like buffer ───────────────────────────────────────────────────────────────
+class LikeBuffer:
+    """Coalesces memory likes in memory and writes them in periodic batched transactions.
+
+    set() records the state a user asked for and answers at once with an
+    optimistic count. A flusher thread (one per process) writes the latest
+    target of every touched (memory, user) pair each LIKE_FLUSH_INTERVAL
+    seconds, or sooner once LIKE_FLUSH_MAX pairs are pending, and recounts
+    memories.likes for those photos, so any number of clicks on one pair costs
+    one write. Targets rather than flips make a retried request harmless, and a
+    like and unlike handled by two workers end as whichever flushed last
+    instead of both inverting the same stored state. Other worker processes see
+    the new counts when the flush commits.
+    """
+    def __init__(self):
+        self._lock = threading.Lock(); self._flush_lock = threading.Lock(); self._wake = threading.Event(); self._pid = None
+        self.pending = {}   # (memory_id, user_id) -> [liked target, liked in the database]
+        self.flushing = {}  # the batch being written; its pairs read as stored until it commits
+        self.delta = {}     # memory_id -> likes not yet committed by this process
+        self.flushes = 0; self.toggles = 0
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() or not app.config['LIKE_FLUSH_INTERVAL']: return
+        with self._lock:
+            if self._pid == os.getpid(): return
+            self._pid = os.getpid()
+        def run():
+            while True:
+                self._wake.wait(app.config['LIKE_FLUSH_INTERVAL']); self._wake.clear()
+                try: self.flush()
+                except sqlite3.Error as e: app.logger.warning("like flush failed, retrying: %s", e)
+        threading.Thread(target=run, name='like-flush', daemon=True).start()
+
+    def set(self, conn, uid, states):
+        """Apply {mid: liked} for uid (None flips the current state); {mid: (liked, likes)} for the photos that exist."""
+        self._ensure_thread()
+        ids = sorted(states); ph = ','.join('?' * len(ids)); out = {}
+        with self._lock:  # reads and buffer agree: a flush commits under the same lock
+            likes = {r[0]: r[1] for r in conn.execute(f"SELECT id, likes FROM memories WHERE id IN ({ph})", ids)}
+            stored = {r[0] for r in conn.execute(f"SELECT memory_id FROM memory_likes WHERE user_id=? AND memory_id IN ({ph})", [uid, *ids])}
+            for mid, want in states.items():
+                if mid not in likes: continue
+                p = self.pending.get((mid, uid))
+                if p is None:
+                    base = self.flushing[(mid, uid)][0] if (mid, uid) in self.flushing else mid in stored
+                    p = self.pending[(mid, uid)] = [base, base]
+                want = not p[0] if want is None else bool(want)
+                if want != p[0]: self._shift(mid, 1 if want else -1)
+                p[0] = out[mid] = want
+            self.toggles += len(out); full = len(self.pending) >= app.config['LIKE_FLUSH_MAX']
+            out = {mid: (liked, likes[mid] + self.delta.get(mid, 0)) for mid, liked in out.items()}
+        if not app.config['LIKE_FLUSH_INTERVAL']: self.flush()
+        elif full: self._wake.set()
+        return out
+
+    def _shift(self, mid, n):
+        d = self.delta.pop(mid, 0) + n
+        if d: self.delta[mid] = d
+
+    def overlay(self, uid, ids, liked):
+        """(liked ids, {id: likes not yet committed}) for a page of memories, with uid's buffered likes applied."""
+        with self._lock:
+            if not self.pending and not self.flushing: return liked, {}
+            liked = set(liked)
+            for mid in ids:
+                p = self.pending.get((mid, uid)) or self.flushing.get((mid, uid))
+                if p: (liked.add if p[0] else liked.discard)(mid)
+            return liked, {mid: self.delta[mid] for mid in ids if self.delta.get(mid)}
+
+    def flush(self):
+        """Write every pending pair and recount the touched photos; returns the pairs written."""
+        with self._flush_lock:  # one batch in flight per process
+            with self._lock:
+                if not self.pending: return 0
+                batch = self.flushing = self.pending; self.pending = {}
+            return self._write(batch)
+
+    def _write(self, batch):
+        # Pairs whose target matches what this process read are written too: another worker may have changed them since.
+        rows = [(mid, uid, now) for (mid, uid), (now, was) in batch.items()]
+        conn = None
+        try:
+            conn = connect_db()
+            conn.executemany("INSERT OR IGNORE INTO memory_likes (memory_id,user_id) VALUES (?,?)", [(m, u) for m, u, now in rows if now])
+            conn.executemany("DELETE FROM memory_likes WHERE memory_id=? AND user_id=?", [(m, u) for m, u, now in rows if not now])
+            conn.executemany("UPDATE memories SET likes=(SELECT COUNT(*) FROM memory_likes WHERE memory_id=memories.id) WHERE id=?",
+                             [(m,) for m in sorted({m for m, _, _ in rows})])
+            with self._lock:
+                conn.commit(); self.flushing = {}; self.flushes += 1
+                for (mid, _), (now, was) in batch.items():
+                    if now != was: self._shift(mid, -1 if now else 1)
+        except sqlite3.Error:
+            if conn: conn.rollback()
+            with self._lock:  # hand the batch back; pairs set again meanwhile keep their newer target
+                for key, v in batch.items():
+                    if key in self.pending: self.pending[key][1] = v[1]
+                    else: self.pending[key] = v
+                self.flushing = {}
+            raise
+        finally:
+            if conn: conn.close()
+        return len(rows)
+
+    def close(self):
+        """Final flush at shutdown; a failure is logged, the buffered likes are lost."""
+        try: self.flush()
+        except sqlite3.Error as e: app.logger.error("dropping %d buffered likes: %s", len(self.pending), e)
+
+like_buffer = LikeBuffer()
+atexit.register(like_buffer.close)
+
+_pools = {}; _pools_lock = threading.Lock()
+
+def worker_pool(name):
+    """Per-process thread pool sized by app.config['<NAME>_WORKERS'], recreated after a fork."""
+    key = (name, os.getpid())
+    if key not in _pools:
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = ThreadPoolExecutor(app.config[f'{name.upper()}_WORKERS'], thread_name_prefix=name)
+    return _pools[key]
+
+# ── Live attendance pub/sub ───────────────────────────────────────────────────
+class AttendanceBroker:
+    """In-process wake-up signals for live attendance viewers, keyed by session_token.
+
+    A publish only tells this process's subscribers that something changed;
+    the DB is the source of truth. On every wake-up (and every resync interval
+    when idle) the stream reads the records after its cursor, so marks committed
+    by any worker are sent, in id order, exactly once.
+    """
+    def __init__(self):
+        self._subs = {}; self._lock = threading.Lock()
+
+    def subscribe(self, token):
+        q = queue.Queue(maxsize=256)
+        with self._lock: self._subs.setdefault(token, set()).add(q)
+        return q
+
+    def unsubscribe(self, token, q):
+        with self._lock:
+            subs = self._subs.get(token, set()); subs.discard(q)
+            if not subs: self._subs.pop(token, None)
+
+    def publish(self, token, event):
+        with self._lock: subs = list(self._subs.get(token, ()))
+        for q in subs:
+            try: q.put_nowait(event)
+            except queue.Full: pass  # slow viewer: it already has wake-ups queued, and each reads everything past its cursor
+
+    def viewers(self):
+        with self._lock: return {t: len(s) for t, s in self._subs.items()}
+
+attendance_broker = AttendanceBroker()
+
+def sse(event, data, eid=None):
+    return (f"id: {eid}\n" if eid is not None else '') + f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+_active_sessions = {}  # session_token -> (cached_until, row); invalidated by close/expiry
+
+def active_session(token):
+    """Active attendance session by token, cached for ACTIVE_SESSION_TTL seconds."""
+    hit = _active_sessions.get(token)
+    if hit and hit[0] > time.monotonic(): return hit[1]
+    row = get_db().execute("SELECT id, subject, expires_at FROM attendance_sessions WHERE session_token=? AND is_active=1", (token,)).fetchone()
+    if row is None: _active_sessions.pop(token, None); return None
+    if len(_active_sessions) > 1024:
+        now = time.monotonic()
+        for t in [t for t, (until, _) in list(_active_sessions.items()) if until <= now]: _active_sessions.pop(t, None)
+    row = dict(row); _active_sessions[token] = (time.monotonic() + app.config['ACTIVE_SESSION_TTL'], row)
+    return row
+
+def attendance_since(conn, token, after):
+    """Session state and the records marked after cursor ``after`` (a record id)."""
+    sess = conn.execute("SELECT id, present_count, is_active, expires_at FROM attendance_sessions WHERE session_token=?", (token,)).fetchone()
+    if not sess: return None, []
+    rows = conn.execute("SELECT id, student_name, roll_number, year, marked_at FROM attendance_records WHERE session_id=? AND id>? ORDER BY id",
+                        (sess['id'], after)).fetchall()
+    return sess, [dict(r) for r in rows]
+
+# ── Keyset pagination ─────────────────────────────────────────────────────────
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(s):
+    """The key list of a cursor, or None for anything that is not a list of SQLite-bindable scalars (it is user input)."""
+    try: v = json.loads(base64.urlsafe_b64decode(s + '=' * (-len(s) % 4)))
+    except (ValueError, TypeError): return None
+    ok = lambda x: isinstance(x, (str, float)) or (isinstance(x, int) and not isinstance(x, bool) and -1 << 63 <= x < 1 << 63)
+    return v if isinstance(v, list) and all(map(ok, v)) else None
+
+def keyset_page(conn, sql, params, keys, desc=True):
+    """One PAGE_SIZE page of ``sql`` (a query ending in its WHERE clause) ordered by ``keys``.
+
+    keys are (expression, result column) pairs whose last entry is unique; the
+    ``after`` request arg carries the previous page's last key. Returns (rows, next cursor).
+    """
+    limit = app.config['PAGE_SIZE']; params = list(params)
+    after = decode_cursor(request.args.get('after', ''))
+    if after and len(after) == len(keys):
+        sql += f" AND ({', '.join(k for k, _ in keys)}) {'<' if desc else '>'} ({', '.join('?' * len(keys))})"; params += after
+    sql += " ORDER BY " + ', '.join(f"{k} {'DESC' if desc else 'ASC'}" for k, _ in keys) + " LIMIT ?"
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    if len(rows) <= limit: return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1][c] for _, c in keys])
+
+def next_page_url(endpoint, cursor, **values):
+    return url_for(endpoint, **{**request.args.to_dict(), **values, 'after': cursor}) if cursor else None
+
+@app.template_global()
+def load_more(cursor, api, into):
+    """Infinite-scroll sentinel fetching ``api`` into ``into``; a plain "Load more" link without JS."""
+    if not cursor: return ''
+    return Markup(f'<div class="load-more text-center mt-3" data-src="{escape(next_page_url(api, cursor))}" data-into="{escape(into)}">'
+                  f'<a href="{escape(next_page_url(request.endpoint, cursor, **request.view_args))}" class="btn btn-ghost btn-sm">Load more</a></div>')
+
+def page_json(template, cursor, api, **ctx):
+    return jsonify(html=render_template(template, **ctx), next=next_page_url(api, cursor))
 
 def allowed_file(f):
     return '.' in f and f.rsplit('.',1)[1].lower() in ALLOWED
 
+# ── Upload ingest ─────────────────────────────────────────────────────────────
+class UploadRequest(Request):
+    """Spools multipart file parts straight to UPLOAD_FOLDER/.incoming.
+
+    Parts are never held in memory, and being on the same filesystem they can
+    be renamed into place instead of copied. Unclaimed parts are removed on teardown.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.NamedTemporaryFile('w+b', dir=incoming_dir(), prefix='part_', delete=False)
+
+app.request_class = UploadRequest
+
+def incoming_dir():
+    d = os.path.join(UPLOAD_FOLDER, '.incoming'); os.makedirs(d, exist_ok=True)
+    return d
+
+@app.teardown_request
+def discard_spooled_uploads(exc):
+    if 'files' not in request.__dict__: return  # body never parsed, nothing spooled
+    for _, f in request.files.items(multi=True):
+        name = getattr(f.stream, 'name', None)
+        if isinstance(name, str) and os.path.exists(name):
+            f.stream.close(); os.unlink(name)
+
+# ── Blob store ────────────────────────────────────────────────────────────────
+# Uploads are stored once per content under UPLOAD_FOLDER/blobs/<aa>/<bb>/<sha256><ext>.
+# blobs.refs counts the memories/events/achievements/users rows pointing at each
+# path (trigger-maintained, migration 5); gc-blobs removes the unreferenced ones.
+BLOB_DIR = 'blobs'
+FORMAT_EXT = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_DIR + '/')
+
+def upload_path(folder, name):
+    """Filesystem path of a stored upload; pre-blob uploads live in their per-type folder."""
+    return os.path.join(UPLOAD_FOLDER, name) if is_blob(name) else os.path.join(UPLOAD_FOLDER, folder, name)
+
+@app.template_global()
+def upload_url(folder, name):
+    return app.config['MEDIA_URL'] + (name if is_blob(name) else f'{folder}/{name}')
+
+def save_image(im, path, fmt, **kw):
+    """Encode ``im`` to a temp file and rename it over ``path``, so readers never see a partial image."""
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    try: im.save(tmp, fmt, **kw); os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp): os.unlink(tmp)
+
+def strip_metadata(im, path):
+    """Rewrite a spooled upload without EXIF/XMP (GPS position, camera serials), orientation baked in.
+
+    An upright JPEG keeps its quantisation tables, so it loses no quality; the
+    ICC profile is kept so colours do not shift.
+    """
+    kw = {'icc_profile': im.info['icc_profile']} if im.info.get('icc_profile') else {}
+    if im.format == 'JPEG' and im.getexif().get(0x0112, 1) == 1: out = im; kw['quality'] = 'keep'
+    else: out = ImageOps.exif_transpose(im); kw.update({'quality': 95} if im.format != 'PNG' else {})
+    save_image(out, path, im.format, **kw)
+
+def ingest_blob(src, filename):
+    """Strip image metadata from a spooled file, hash it and move it into the blob store (or drop it if already stored).
+
+    Stripping happens first so a blob's name is always the hash of the bytes
+    served under it; nothing under blobs/ is rewritten afterwards. The extension
+    comes from the sniffed image format so equal content always maps to one
+    path. Returns (sha256, path, size).
+    """
+    try:
+        with Image.open(src) as im:
+            ext = FORMAT_EXT.get(im.format)
+            if (im.format in ('JPEG', 'PNG', 'WEBP') and not getattr(im, 'is_animated', False)
+                    and (im.getexif() or any(k in im.info for k in ('xmp', 'XML:com.adobe.xmp', 'comment')))):
+                strip_metadata(im, src)
+    except (OSError, Image.DecompressionBombError):
+        ext = None
+    h = hashlib.sha256()
+    with open(src, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''): h.update(chunk)
+    digest = h.hexdigest()
+    ext = ext or os.path.splitext(filename)[1].lower()
+    rel = f"{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+    dest = os.path.join(UPLOAD_FOLDER, rel); size = os.path.getsize(src)
+    if os.path.exists(dest):
+        os.unlink(src); os.utime(dest)  # fresh mtime keeps gc-blobs' grace period from collecting it
+    else:
+        os.makedirs(os.path.dirname(dest), exist_ok=True); os.replace(src, dest)
+    return digest, rel, size
+
+def register_blobs(conn, blobs):
+    """Record (sha256, path, size) rows; call in the transaction that inserts the referencing rows."""
+    conn.executemany("INSERT OR IGNORE INTO blobs (sha256, path, size) VALUES (?,?,?)", blobs)
+
+def save_upload(f, conn):
+    """Store a spooled FileStorage as a blob and return the path to keep on the referencing row."""
+    f.stream.close()
+    digest, rel, size = ingest_blob(f.stream.name, f.filename)
+    register_blobs(conn, [(digest, rel, size)])
+    return rel
+
+def collect_blobs(conn, grace=3600, dry_run=False):
+    """Recount blob references, then delete blobs (and their variants) unreferenced for ``grace`` seconds.
+
+    Files under blobs/ with no row at all are removed too. Returns (blobs, bytes) removed.
+    """
+    cutoff = time.time() - grace
+    union = ' UNION ALL '.join(f"SELECT {c} AS p FROM {t}" for t, c in BLOB_REFS)
+    conn.executescript(f'''
+        BEGIN;
+        CREATE TEMP TABLE blob_refs AS SELECT p AS path, COUNT(*) AS n FROM ({union}) WHERE p LIKE '{BLOB_DIR}/%' GROUP BY p;
+        CREATE INDEX temp.idx_blob_refs ON blob_refs(path);
+        UPDATE blobs SET refs=COALESCE((SELECT n FROM blob_refs WHERE path=blobs.path), 0);
+        DROP TABLE blob_refs;
+        COMMIT;''')
+    live = {os.path.splitext(r['path'])[0] for r in conn.execute("SELECT path FROM blobs WHERE refs > 0")}
+    gone = []; freed = 0
+    for root, _, files in os.walk(os.path.join(UPLOAD_FOLDER, BLOB_DIR)):
+        for fn in files:
+            full = os.path.join(root, fn)
+            rel = os.path.relpath(full, UPLOAD_FOLDER).replace(os.sep, '/')
+            stem = re.sub(r'(_[a-z]+)?\.\w+$', '', rel)  # variants share their source blob's stem
+            if stem in live or os.path.getmtime(full) > cutoff: continue
+            freed += os.path.getsize(full)
+            if stem == os.path.splitext(rel)[0]: gone.append(rel)
+            if not dry_run: os.unlink(full)
+    if not dry_run and gone:
+        conn.executemany("DELETE FROM blobs WHERE path=? AND refs <= 0", [(p,) for p in gone]); conn.commit()
+    return len(gone), freed
+
+# ── Image variants ────────────────────────────────────────────────────────────
+def make_variants(folder, fname):
+    """Resize an upload into IMAGE_VARIANTS in its own format plus WebP, without EXIF.
+
+    Returns {name: [width, path, webp_path]} with paths relative to the folder.
+    Variants that already exist (a deduplicated blob) are reused, not rewritten:
+    other rows serve them as immutable. New ones are renamed into place whole.
+    Animated GIFs are left as-is and return None.
+    """
+    src = upload_path(folder, fname)
+    stem, ext = os.path.splitext(fname); ext = ext.lower()
+    # Blob variants sit next to their blob and are shared by every row using it
+    vdir = '' if is_blob(fname) else 'v/'
+    os.makedirs(os.path.dirname(upload_path(folder, f"{vdir}{stem}")), exist_ok=True)
+    q = app.config['IMAGE_QUALITY']; out = {}
+    with Image.open(src) as im:
+        if getattr(im, 'is_animated', False): return None
+        keep_alpha = ext in ('.png', '.webp', '.gif') and im.mode in ('RGBA', 'LA', 'P')
+        fmt, vext = ('PNG', '.png') if keep_alpha else ('JPEG', '.jpg')
+        upright = None
+        for name, size in app.config['IMAGE_VARIANTS'].items():
+            path, webp = f"{vdir}{stem}_{name}{vext}", f"{vdir}{stem}_{name}.webp"
+            if os.path.exists(upload_path(folder, path)) and os.path.exists(upload_path(folder, webp)):
+                with Image.open(upload_path(folder, path)) as done: out[name] = [done.width, path, webp]
+                continue
+            if upright is None:  # decode only when something is missing; bake orientation in before the metadata is dropped
+                upright = ImageOps.exif_transpose(im).convert('RGBA' if keep_alpha else 'RGB')
+            v = upright.copy(); v.thumbnail((size, size), Image.LANCZOS)
+            save_image(v, upload_path(folder, path), fmt, quality=q, optimize=True)
+            save_image(v, upload_path(folder, webp), 'WEBP', quality=q, method=4)
+            out[name] = [v.width, path, webp]
+    return out
+
+def _process_image(folder, fname, update_sql, row_id):
+    try:
+        variants = make_variants(folder, fname)
+    except (OSError, Image.DecompressionBombError) as e:
+        app.logger.warning("image variants failed for %s/%s: %s", folder, fname, e); return
+    if variants: write_batcher.submit(update_sql, (json.dumps(variants), row_id))
+
+def queue_variants(folder, fname, update_sql, row_id):
+    """Generate variants on the background pool; the row's variants column is filled in when done."""
+    return worker_pool('image').submit(_process_image, folder, fname, update_sql, row_id)
+
+MEMORY_VARIANTS_SQL = "UPDATE memories SET variants=? WHERE id=?"
+BANNER_VARIANTS_SQL = "UPDATE events SET banner_variants=? WHERE id=?"
+
+@app.template_global()
+def variant_url(folder, path, variants=None, name='full'):
+    v = json.loads(variants) if variants else {}
+    return upload_url(folder, v[name][1] if name in v else path)
+
+@app.template_global()
+def picture(folder, path, variants=None, sizes='100vw', **attrs):
+    """<img> with a WebP <source> and srcset over the stored variants; plain <img> until they exist."""
+    attrs = ''.join(f' {k.rstrip("_")}="{escape(v)}"' for k, v in attrs.items() if v is not None)
+    v = json.loads(variants) if variants else None
+    if not v: return Markup(f'<img src="{escape(upload_url(folder, path))}"{attrs}>')
+    by_width = sorted({w: (p, wp) for w, p, wp in v.values()}.items())
+    srcset = lambda i: escape(', '.join(f"{upload_url(folder, pair[i])} {w}w" for w, pair in by_width))
+    src = upload_url(folder, v.get('medium', v[next(iter(v))])[1])
+    return Markup(f'<picture style="display:contents"><source type="image/webp" srcset="{srcset(1)}" sizes="{escape(sizes)}">'
+                  f'<img src="{escape(src)}" srcset="{srcset(0)}" sizes="{escape(sizes)}"{attrs}></picture>')
+
+# ── Media ─────────────────────────────────────────────────────────────────────
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def is_hidden(path):
+    """True for a path with a dot segment, such as the .incoming spool of partial uploads and import files."""
+    return any(part.startswith('.') for part in path.split('/'))
+
+@app.before_request
+def hide_dot_paths():
+    # UPLOAD_FOLDER lives under static/; a front proxy serving static/ itself needs the same rule (nginx: location ~ /\. { return 404; })
+    if request.endpoint == 'static' and is_hidden((request.view_args or {}).get('filename', '')): abort(404)
+
+def send_media(rel, download_name=None):
+    """Conditional (ETag / If-None-Match / Range) response for a file under UPLOAD_FOLDER.
+
+    Blob paths and their variants are named after the content hash, so they get
+    that hash as a strong ETag and a year-long immutable Cache-Control; other
+    uploads get Werkzeug's mtime/size ETag and MEDIA_MAX_AGE.
+    """
+    full = safe_join(UPLOAD_FOLDER, rel)
+    if not full or is_hidden(rel) or not os.path.isfile(full): abort(404)
+    immutable = is_blob(rel)
+    etag = os.path.splitext(os.path.basename(rel))[0] if immutable else True
+    max_age = IMMUTABLE_MAX_AGE if immutable else app.config['MEDIA_MAX_AGE']
+    mode = app.config['MEDIA_SENDFILE']
+    if mode == 'x-accel':
+        st = os.stat(full)
+        rv = app.response_class(mimetype=mimetypes.guess_type(full)[0] or 'application/octet-stream')
+        rv.headers['X-Accel-Redirect'] = app.config['MEDIA_ACCEL_PREFIX'] + rel
+        rv.set_etag(etag if immutable else f"{st.st_mtime}-{st.st_size}")
+        rv.last_modified = int(st.st_mtime)
+        if download_name: rv.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    else:
+        rv = send_file(full, request.environ, as_attachment=bool(download_name), download_name=download_name,
+                       conditional=False, etag=etag, max_age=max_age, use_x_sendfile=mode == 'x-sendfile',
+                       response_class=app.response_class)
+    rv.cache_control.public = True; rv.cache_control.max_age = max_age
+    rv.cache_control.immutable = immutable
+    if not mode: rv.accept_ranges = 'bytes'
+    # With a sendfile hand-off the proxy reads the file and answers Range requests itself.
+    return rv.make_conditional(request.environ, accept_ranges=not mode, complete_length=None if mode else os.path.getsize(full))
+
+@app.route('/media/<path:name>')
+def media(name):
+    return send_media(name)
+
+# ── Static assets ─────────────────────────────────────────────────────────────
+# Logical name -> source: a pinned CDN URL (vendored by `flask build-assets`) or a file under static/.
+ASSETS = {
+    'bootstrap.css': 'https://cdnjs.cloudflare.com/ajax/libs/bootstrap/5.3.2/css/bootstrap.min.css',
+    'bootstrap.js': 'https://cdnjs.cloudflare.com/ajax/libs/bootstrap/5.3.2/js/bootstrap.bundle.min.js',
+    'fontawesome.css': 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.0/css/all.min.css',
+    'qrcode.js': 'https://cdnjs.cloudflare.com/ajax/libs/qrcodejs/1.0.0/qrcode.min.js',
+    'app.css': 'css/app.css',
+    'app.js': 'js/app.js',
+}
+PRECOMPRESS = {'.css', '.js', '.svg', '.ttf', '.eot', '.json', '.map'}  # woff/woff2 and images are compressed already
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}  # in order of preference
+CSS_URL = re.compile(r"""url\((['"]?)(?![a-z]+:|/|#)([^'")?#]+)([^'")]*)\1\)""")
+_asset_manifest = None
+
+def asset_manifest():
+    """The last build's manifest, read once per process ({} until `flask build-assets` has run)."""
+    global _asset_manifest
+    if _asset_manifest is None:
+        try:
+            with open(os.path.join(app.config['ASSET_DIR'], 'manifest.json')) as fh: _asset_manifest = json.load(fh)
+        except (OSError, ValueError): _asset_manifest = {}
+    return _asset_manifest
+
+@app.template_global()
+def asset_url(name):
+    """Fingerprinted /assets/ URL of a built asset, else its CDN URL or plain static file.
+
+    In debug mode our own bundles always come from static/, so edits show without a rebuild.
+    """
+    src = ASSETS[name]; local = '://' not in src
+    built = asset_manifest().get('assets', {}).get(name)
+    if built and not (local and app.debug): return url_for('asset', filename=built)
+    return url_for('static', filename=src) if local else src
+
+def fetch_asset(src, mirror=None):
+    """Bytes of an asset source: a path under static/, a same-named file in mirror, or a download."""
+    if '://' not in src: path = os.path.join(app.static_folder, src)
+    elif mirror: path = os.path.join(mirror, posixpath.basename(urlsplit(src).path))
+    else:
+        with urllib.request.urlopen(src, timeout=30) as r: return r.read()
+    with open(path, 'rb') as fh: return fh.read()
+
+def build_assets(mirror=None):
+    """Vendor, fingerprint and precompress ASSETS into ASSET_DIR and return the new manifest.
+
+    Every file is named after its content hash; stylesheets have their url()
+    references (Font Awesome's webfonts) fetched too and rewritten to the
+    fingerprinted names. Compressible files get .gz and, with the brotli module
+    installed, .br siblings. Files of the previous build are kept so pages
+    rendered before a deploy still load; anything older is pruned.
+    """
+    try: import brotli
+    except ImportError: brotli = None
+    out = app.config['ASSET_DIR']; os.makedirs(out, exist_ok=True)
+    files = []
+
+    def put(path, data):
+        if os.path.exists(path): return
+        tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp, 'wb') as fh: fh.write(data)
+        os.replace(tmp, path)
+
+    def emit(name, data):
+        stem, ext = os.path.splitext(name)
+        fname = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'; path = os.path.join(out, fname)
+        put(path, data); files.append(fname)
+        if ext in PRECOMPRESS:
+            packed = {'.gz': gzip.compress(data, 9, mtime=0)}
+            if brotli: packed['.br'] = brotli.compress(data, quality=11)
+            for suffix, body in packed.items():
+                if len(body) < len(data): put(path + suffix, body); files.append(fname + suffix)
+        return fname
+
+    manifest = {'assets': {}, 'files': files}
+    for name, src in ASSETS.items():
+        data = fetch_asset(src, mirror)
+        if name.endswith('.css'):
+            deps = {}
+            def rewrite(m, src=src):
+                ref = m.group(2)
+                if ref not in deps:
+                    dep = urljoin(src, ref) if '://' in src else posixpath.normpath(posixpath.join(posixpath.dirname(src), ref))
+                    deps[ref] = emit(posixpath.basename(ref), fetch_asset(dep, mirror))
+                return f'url({deps[ref]}{m.group(3)})'  # built next to the stylesheet
+            data = CSS_URL.sub(rewrite, data.decode()).encode()
+        manifest['assets'][name] = emit(name, data)
+
+    global _asset_manifest
+    keep = set(files) | set(asset_manifest().get('files', [])) | {'manifest.json'}
+    tmp = os.path.join(out, f'manifest.{uuid.uuid4().hex}.tmp')
+    with open(tmp, 'w') as fh: json.dump(manifest, fh, indent=1)
+    os.replace(tmp, os.path.join(out, 'manifest.json'))
+    for f in os.listdir(out):
+        if f not in keep: os.remove(os.path.join(out, f))
+    _asset_manifest = manifest
+    return manifest
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """A built asset, precompressed when the client accepts br or gzip.
+
+    Names carry the content hash, so responses are cached for a year. Behind
+    nginx, `location /assets/ { alias static/dist/; gzip_static on; }` serves
+    the same files without a worker.
+    """
+    path = safe_join(app.config['ASSET_DIR'], filename)
+    if not path or filename == 'manifest.json' or filename.endswith(('.gz', '.br')) or not os.path.isfile(path): abort(404)
+    coding = next((c for c, suffix in ENCODINGS.items() if request.accept_encodings[c] and os.path.isfile(path + suffix)), None)
+    rv = send_file(path + ENCODINGS[coding] if coding else path, request.environ, max_age=IMMUTABLE_MAX_AGE,
+                   mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream', response_class=app.response_class)
+    if coding: rv.content_encoding = coding
+    rv.vary.add('Accept-Encoding'); rv.cache_control.public = True; rv.cache_control.immutable = True
+    return rv
+
+@app.after_request
+def compress_response(resp):
+    """gzip HTML and JSON bodies of GZIP_MIN_SIZE or more; streamed and file responses pass through."""
+    cfg = app.config
+    if (not cfg['GZIP_ENABLED'] or resp.mimetype not in cfg['GZIP_MIMETYPES'] or resp.is_streamed or resp.direct_passthrough
+            or resp.content_encoding or not 200 <= resp.status_code < 300 or 'Content-Range' in resp.headers): return resp
+    data = resp.get_data()
+    if len(data) < cfg['GZIP_MIN_SIZE']: return resp
+    resp.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']: return resp
+    resp.set_data(gzip.compress(data, cfg['GZIP_LEVEL'])); resp.content_encoding = 'gzip'
+    if resp.headers.get('ETag'):  # the compressed bytes differ from what a strong ETag names
+        tag, weak = resp.get_etag(); resp.set_etag(tag, weak=True)
+    return resp
+
 # ── Auth ──────────────────────────────────────────────────────────────────────
 def login_required(f):
     @wraps(f)
@@ -260,33 +1516,239 @@ def role_required(*roles):
         return d
     return dec
 
+_user_cache = OrderedDict()  # user id -> (cached_until, row), least recently used first
+_user_cache_lock = threading.Lock()
+
+def load_user(uid):
+    """users row by id, from a short-TTL per-process LRU.
+
+    Other worker processes see a change once USER_CACHE_TTL has passed;
+    this one sees it immediately through invalidate_user().
+    """
+    ttl = app.config['USER_CACHE_TTL']
+    with _user_cache_lock:
+        hit = _user_cache.get(uid)
+        if hit and hit[0] > time.monotonic(): _user_cache.move_to_end(uid); return hit[1]
+    row = get_db().execute("SELECT * FROM users WHERE id=?", (uid,)).fetchone()
+    if row is not None and ttl > 0:
+        with _user_cache_lock:
+            _user_cache[uid] = (time.monotonic() + ttl, row); _user_cache.move_to_end(uid)
+            while len(_user_cache) > app.config['USER_CACHE_SIZE']: _user_cache.popitem(last=False)
+    return row
+
+def invalidate_user(uid):
+    with _user_cache_lock: _user_cache.pop(uid, None)
+    if g.get('current_user') is not None and g.current_user['id'] == uid: g.pop('current_user')
+
 def get_current_user():
-    if 'user_id' in session:
-        conn = get_db()
-        u = conn.execute("SELECT * FROM users WHERE id=?", (session['user_id'],)).fetchone()
-        conn.close()
-        return u
-    return None
+    """The logged-in user's row, loaded at most once per request."""
+    if 'user_id' not in session: return None
+    if g.get('current_user') is None: g.current_user = load_user(session['user_id'])
+    return g.current_user
 
 @app.context_processor
 def inject():
     return dict(current_user=get_current_user(), now=datetime.now())
 
+# ── Public aggregates ─────────────────────────────────────────────────────────
+class AggregateCache:
+    """Per-process TTL cache for the public landing-page aggregates.
+
+    Writers drop the keys they affect with invalidate(); the TTL bounds how long
+    other worker processes (and counters such as likes) can lag behind.
+    """
+    def __init__(self):
+        self._data = {}; self._lock = threading.Lock()
+        self.hits = 0; self.misses = 0; self.invalidations = 0
+
+    def get(self, key, load):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit and hit[0] > time.monotonic(): self.hits += 1; return hit[1]
+            self.misses += 1
+        value = load()
+        with self._lock: self._data[key] = (time.monotonic() + app.config['PUBLIC_CACHE_TTL'], value)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for k in keys: self._data.pop(k, None)
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'keys': sorted(self._data), 'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations,
+                    'hit_ratio': round(self.hits / total, 4) if total else 0.0}
+
+public_cache = AggregateCache()
+
+def site_counts():
+    def load():
+        return dict(get_db().execute("""SELECT (SELECT COUNT(*) FROM users WHERE role='student') AS students,
+            (SELECT COUNT(*) FROM events) AS events, (SELECT COUNT(*) FROM memories) AS memories,
+            (SELECT COUNT(*) FROM departments) AS departments""").fetchone())
+    return public_cache.get('counts', load)
+
+def department_stats():
+    """Departments with their student and event counts (events for 'All' count towards every department)."""
+    return public_cache.get('departments', lambda: get_db().execute("""
+        SELECT departments.*, COALESCE(s.n, 0) AS students, COALESCE(e.n, 0) + (SELECT COUNT(*) FROM events WHERE department='All') AS events
+        FROM departments
+        LEFT JOIN (SELECT department, COUNT(*) AS n FROM users WHERE role='student' GROUP BY department) s ON s.department=departments.name
+        LEFT JOIN (SELECT department, COUNT(*) AS n FROM events GROUP BY department) e ON e.department=departments.name""").fetchall())
+
+# ── Timetable cache ───────────────────────────────────────────────────────────
+def hhmm(s):
+    """'HH:MM' -> minutes since midnight, or None."""
+    m = re.match(r'^(\d{1,2}):(\d{2})', s or '')
+    return int(m.group(1)) * 60 + int(m.group(2)) if m else None
+
+def term(semester):
+    """0 or 1 for the half of the academic year a semester runs in (odd / even), None if unknown."""
+    s = str(semester or '').strip()
+    return int(s) % 2 if s.isdigit() else None
+
+class TimetableCache:
+    """Compiled day x period grids plus a room/teacher interval index, per process.
+
+    Everything is dropped when cache_versions['timetable'] moves (bumped by
+    triggers on every timetable write, migration 9), so workers never serve a
+    stale grid; checking costs one primary-key read per request.
+    """
+    def __init__(self):
+        self._lock = threading.Lock(); self.version = None
+        self._grids = {}; self._busy = None
+
+    def _sync(self, conn):
+        v = conn.execute("SELECT version FROM cache_versions WHERE name='timetable'").fetchone()[0]
+        with self._lock:
+            if v != self.version: self.version = v; self._grids = {}; self._busy = None
+        return v
+
+    def invalidate(self):
+        with self._lock: self.version = None; self._grids = {}; self._busy = None
+
+    def grid(self, conn, dept=None, year=None, semester=None, teacher_id=None):
+        """{day: {period: row}} for a class (dept, year[, semester]) or for one teacher."""
+        v = self._sync(conn)
+        key = ('teacher', teacher_id) if teacher_id else ('class', dept, year, semester or '')
+        with self._lock: hit = self._grids.get(key)
+        if hit is not None: return hit
+        if teacher_id: rows = conn.execute("SELECT * FROM timetable WHERE teacher_id=? ORDER BY day, period", (teacher_id,))
+        elif semester: rows = conn.execute("SELECT * FROM timetable WHERE department=? AND year=? AND semester=? ORDER BY day, period", (dept, year, semester))
+        else: rows = conn.execute("SELECT * FROM timetable WHERE department=? AND year=? ORDER BY day, period", (dept, year))
+        grid = {}
+        for r in rows: grid.setdefault(r['day'], {})[r['period']] = dict(r)
+        with self._lock:
+            if self.version == v: self._grids[key] = grid
+        return grid
+
+    def _index(self, conn):
+        """(day, 'room'|'teacher', value, term) -> [(start, end, period, row)] sorted by start; untimed rows use -1."""
+        self._sync(conn)
+        with self._lock:
+            if self._busy is not None: return self._busy
+        busy = {}
+        for r in conn.execute("SELECT id, department, year, semester, day, period, subject, teacher_id, teacher_name, room, time_from, time_to FROM timetable"):
+            self.add(busy, dict(r), insort=False)
+        for lst in busy.values(): lst.sort(key=lambda x: (x[0], x[1], x[2]))
+        with self._lock: self._busy = busy
+        return busy
+
+    @staticmethod
+    def add(busy, row, insort=True):
+        """Index ``row`` in ``busy`` (the shared index, or a bulk import's overlay of rows it has not committed)."""
+        start, end = hhmm(row['time_from']), hhmm(row['time_to'])
+        slot = (start, end) if start is not None and end is not None and end > start else (-1, -1)
+        for kind, val in (('room', (row['room'] or '').strip().lower()), ('teacher', str(row['teacher_id'] or ''))):
+            if not val: continue
+            lst = busy.setdefault((row['day'], kind, val, term(row['semester'])), [])
+            if insort: bisect.insort(lst, (*slot, row['period'], row), key=lambda x: (x[0], x[1], x[2]))
+            else: lst.append((*slot, row['period'], row))
+
+    @staticmethod
+    def find(busy, day, period, start, end, room=None, teacher_id=None, semester=None):
+        """clash() against a given index."""
+        timed = start is not None and end is not None
+        t = term(semester); terms = (t, None) if t is not None else (0, 1, None)  # no semester: could run in either term
+        for kind, val in (('room', (room or '').strip().lower()), ('teacher', str(teacher_id or ''))):
+            if not val: continue
+            for lst in filter(None, (busy.get((day, kind, val, tm)) for tm in terms)):
+                hi = bisect.bisect_left(lst, end, key=lambda x: x[0]) if timed else len(lst)
+                for s, e, p, r in lst[:hi]:
+                    if (e > start) if s >= 0 and timed else p == period: return kind, r
+        return None
+
+    def clash(self, conn, day, period, start, end, room=None, teacher_id=None, semester=None):
+        """First existing entry that double-books ``room`` or ``teacher_id`` as (kind, row), else None.
+
+        Overlap is by time when both entries have a time range, otherwise by period.
+        Only entries of the same term clash: odd semesters run in one half of the
+        academic year and even ones in the other.
+        """
+        return self.find(self._index(conn), day, period, start, end, room, teacher_id, semester)
+
+timetable_cache = TimetableCache()
+
+# ── Fragment cache ────────────────────────────────────────────────────────────
+class FragmentCache:
+    """Rendered template fragments (or the rows behind them) shared by everyone who would see the same markup.
+
+    Keys are (fragment, role, department, year, query args, extra) plus the
+    cache_versions of the tables the fragment reads. Triggers bump those on every
+    notices, events and timetable write (migrations 9 and 14), so after
+    create_notice, create_event or manage_timetable each worker misses on its
+    next request; reading the versions costs one query per request. Fragments
+    must not use current_user or flashed messages: pass what they need.
+    """
+    def __init__(self):
+        self._data = OrderedDict(); self._lock = threading.Lock()
+        self.hits = 0; self.misses = 0
+
+    def versions(self):
+        if '_cache_versions' not in g:
+            g._cache_versions = {r[0]: r[1] for r in get_db().execute("SELECT name, version FROM cache_versions")}
+        return g._cache_versions
+
+    def get(self, name, deps, load, *extra):
+        """load() for this viewer's (role, department, year) and request args, or its cached result."""
+        if not app.config['FRAGMENT_CACHE_SIZE']: return load()
+        v = self.versions()
+        key = (name, session.get('role'), session.get('department'), session.get('year'), tuple(sorted(request.args.items(multi=True))),
+               extra, tuple(v.get(d) for d in deps))
+        with self._lock:
+            hit = self._data.get(key)
+            if hit and hit[0] > time.monotonic(): self._data.move_to_end(key); self.hits += 1; return hit[1]
+            self.misses += 1
+        value = load()
+        with self._lock:
+            self._data[key] = (time.monotonic() + app.config['FRAGMENT_CACHE_TTL'], value); self._data.move_to_end(key)
+            while len(self._data) > app.config['FRAGMENT_CACHE_SIZE']: self._data.popitem(last=False)
+        return value
+
+    def render(self, name, deps, template, load, *extra):
+        """Markup of ``template`` rendered with the context load() returns."""
+        return self.get(name, deps, lambda: Markup(render_template(template, **load())), *extra)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'entries': len(self._data), 'hits': self.hits, 'misses': self.misses, 'hit_ratio': round(self.hits / total, 4) if total else 0.0}
+
+fragment_cache = FragmentCache()
+
 # ── Public Routes ─────────────────────────────────────────────────────────────
 @app.route('/')
 def index():
-    conn = get_db()
-    events = conn.execute("SELECT e.*, (SELECT COUNT(*) FROM event_registrations WHERE event_id=e.id) as rc FROM events e WHERE status='upcoming' ORDER BY event_date LIMIT 6").fetchall()
-    notices = conn.execute("SELECT * FROM notices ORDER BY is_important DESC, created_at DESC LIMIT 5").fetchall()
-    memories = conn.execute("SELECT * FROM memories ORDER BY created_at DESC LIMIT 8").fetchall()
-    stats = {
-        'students': conn.execute("SELECT COUNT(*) FROM users WHERE role='student'").fetchone()[0] or 2400,
-        'events': conn.execute("SELECT COUNT(*) FROM events").fetchone()[0],
-        'departments': conn.execute("SELECT COUNT(*) FROM departments").fetchone()[0],
-        'memories': conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0],
-    }
-    depts = conn.execute("SELECT * FROM departments").fetchall()
-    conn.close()
+    def load():
+        conn = get_db()
+        return (conn.execute(UPCOMING_EVENTS_SQL).fetchall(),
+                conn.execute("SELECT * FROM notices ORDER BY is_important DESC, created_at DESC LIMIT 5").fetchall(),
+                conn.execute("SELECT * FROM memories ORDER BY created_at DESC LIMIT 8").fetchall())
+    events, notices, memories = public_cache.get('home', load)
+    stats = dict(site_counts()); stats['students'] = stats['students'] or 2400
+    depts = department_stats()
     return render_template('index.html', events=events, notices=notices, memories=memories, stats=stats, depts=depts)
 
 # ── Auth Routes ───────────────────────────────────────────────────────────────
@@ -298,9 +1760,8 @@ def login():
         pw = request.form.get('password','')
         conn = get_db()
         u = conn.execute("SELECT * FROM users WHERE email=? AND is_active=1", (email,)).fetchone()
-        conn.close()
         if u and check_password_hash(u['password'], pw):
-            session.update({'user_id':u['id'],'username':u['username'],'role':u['role'],'full_name':u['full_name'],'department':u['department'],'year':u['year']})
+            session.update({'user_id':u['id'],'username':u['username'],'role':u['role'],'full_name':u['full_name'],'department':u['department'],'year':u['year'],'roll_number':u['roll_number']})
             flash(f'Welcome back, {u["full_name"]}! 👋','success')
             return redirect(url_for('dashboard'))
         flash('Invalid email or password.','danger')
@@ -311,7 +1772,6 @@ def register():
     if 'user_id' in session: return redirect(url_for('dashboard'))
     conn = get_db()
     depts = conn.execute("SELECT * FROM departments").fetchall()
-    conn.close()
     if request.method == 'POST':
         data = {k: request.form.get(k,'').strip() for k in ['full_name','username','email','password','confirm','department','year','semester','roll_number','phone','role']}
         if data['password'] != data['confirm']:
@@ -322,17 +1782,16 @@ def register():
             return render_template('auth/register.html', depts=depts)
         # Only allow student role on public register; teacher/organizer/admin via admin
         role = 'student' if data['role'] not in ('student',) else data['role']
-        conn = get_db()
         if conn.execute("SELECT id FROM users WHERE email=? OR username=?",(data['email'],data['username'])).fetchone():
-            conn.close(); flash('Email or username already exists.','danger')
+            flash('Email or username already exists.','danger')
             return render_template('auth/register.html', depts=depts)
         try:
             conn.execute("INSERT INTO users (username,email,password,full_name,role,department,year,semester,roll_number,phone) VALUES (?,?,?,?,?,?,?,?,?,?)",
                 (data['username'],data['email'],generate_password_hash(data['password']),data['full_name'],'student',data['department'],data['year'],data['semester'],data['roll_number'],data['phone']))
-            conn.commit(); conn.close()
+            conn.commit(); public_cache.invalidate('counts', 'departments')
             flash('Registration successful! Please login.','success')
             return redirect(url_for('login'))
-        except: conn.close(); flash('Registration failed.','danger')
+        except: flash('Registration failed.','danger')
     return render_template('auth/register.html', depts=depts)
 
 @app.route('/logout')
@@ -351,28 +1810,31 @@ def dashboard():
     # Role-specific data
     if role == 'student':
         my_events = conn.execute("SELECT e.* FROM events e JOIN event_registrations r ON e.id=r.event_id WHERE r.user_id=? ORDER BY e.event_date DESC LIMIT 5", (uid,)).fetchall()
-        # Notices visible to this student (dept match or 'All', year match or 'All')
-        notices = conn.execute("SELECT * FROM notices WHERE (department='All' OR department=?) AND (year='All' OR year=?) ORDER BY is_important DESC, created_at DESC LIMIT 5", (dept, year)).fetchall()
+        # Notices visible to this student (dept match or 'All', year match or 'All'), shared by the whole class
+        notices = fragment_cache.render('dashboard-notices', ('notices',), 'dashboard/_notices.html', lambda: {'notices': conn.execute(
+            "SELECT * FROM notices WHERE (department='All' OR department=?) AND (year='All' OR year=?) ORDER BY is_important DESC, created_at DESC LIMIT 5", (dept, year)).fetchall()})
         # My attendance
-        my_att = conn.execute("SELECT COUNT(*) FROM attendance_records WHERE student_id=?", (uid,)).fetchone()[0]
-        upcoming = conn.execute("SELECT COUNT(*) FROM events WHERE status='upcoming'").fetchone()[0]
-        today_tt = conn.execute("SELECT * FROM timetable WHERE department=? AND year=? AND day=? ORDER BY period", (dept, year, datetime.now().strftime('%A'))).fetchall()
+        my_att = conn.execute("SELECT COALESCE(SUM(present),0) FROM attendance_totals WHERE student_id=?", (uid,)).fetchone()[0]
+        upcoming = fragment_cache.get('upcoming-count', ('events',), lambda: conn.execute("SELECT COUNT(*) FROM events WHERE status='upcoming'").fetchone()[0])
+        day = datetime.now().strftime('%A')
+        today_tt = fragment_cache.render('dashboard-today', ('timetable',), 'dashboard/_today.html',
+                                         lambda: {'day': day, 'today_tt': list(timetable_cache.grid(conn, dept, year).get(day, {}).values())}, day)
         stats = {'my_events': len(list(my_events)), 'upcoming': upcoming, 'attendance': my_att, 'achievements': conn.execute("SELECT COUNT(*) FROM achievements WHERE student_id=?", (uid,)).fetchone()[0]}
         return render_template('dashboard/student.html', my_events=my_events, notices=notices, today_tt=today_tt, stats=stats)
 
     elif role == 'teacher':
         # Teacher sees their sessions and student attendance
         sessions = conn.execute("SELECT * FROM attendance_sessions WHERE teacher_id=? ORDER BY created_at DESC LIMIT 10", (uid,)).fetchall()
-        my_students = conn.execute("SELECT u.*, (SELECT COUNT(*) FROM attendance_records ar JOIN attendance_sessions s ON ar.session_id=s.id WHERE ar.student_id=u.id AND s.teacher_id=?) as att_count FROM users u WHERE u.role='student' AND u.department=? ORDER BY u.full_name", (uid, dept)).fetchall()
+        my_students = conn.execute(f"SELECT u.*, COALESCE(t.present,0) as att_count FROM users u {TEACHER_ATT_JOIN} WHERE u.role='student' AND u.department=? ORDER BY u.full_name", (uid, dept)).fetchall()
         recent_att = conn.execute("SELECT ar.*, s.subject, s.date FROM attendance_records ar JOIN attendance_sessions s ON ar.session_id=s.id WHERE s.teacher_id=? ORDER BY ar.marked_at DESC LIMIT 20", (uid,)).fetchall()
         stats = {'my_sessions': len(list(sessions)), 'total_students': len(list(my_students)), 'today_sessions': conn.execute("SELECT COUNT(*) FROM attendance_sessions WHERE teacher_id=? AND date=?", (uid, date.today().isoformat())).fetchone()[0]}
         return render_template('dashboard/teacher.html', sessions=sessions, my_students=my_students, recent_att=recent_att, stats=stats)
 
     elif role == 'organizer':
-        my_events = conn.execute("SELECT e.*, (SELECT COUNT(*) FROM event_registrations WHERE event_id=e.id) as rc FROM events e WHERE e.organizer_id=? ORDER BY e.event_date DESC", (uid,)).fetchall()
-        upcoming_events = conn.execute("SELECT e.*, (SELECT COUNT(*) FROM event_registrations WHERE event_id=e.id) as rc FROM events e WHERE status='upcoming' ORDER BY event_date LIMIT 6").fetchall()
+        my_events = conn.execute("SELECT *, reg_count as rc FROM events WHERE organizer_id=? ORDER BY event_date DESC", (uid,)).fetchall()
+        upcoming_events = fragment_cache.get('upcoming-events', ('events',), lambda: conn.execute(UPCOMING_EVENTS_SQL).fetchall())
         recent_memories = conn.execute("SELECT * FROM memories WHERE uploader_id=? ORDER BY created_at DESC LIMIT 6", (uid,)).fetchall()
-        stats = {'my_events': len(list(my_events)), 'total_regs': conn.execute("SELECT COUNT(*) FROM event_registrations WHERE event_id IN (SELECT id FROM events WHERE organizer_id=?)", (uid,)).fetchone()[0], 'memories': len(list(recent_memories))}
+        stats = {'my_events': len(list(my_events)), 'total_regs': sum(e['rc'] for e in my_events), 'memories': len(list(recent_memories))}
         return render_template('dashboard/organizer.html', my_events=my_events, upcoming_events=upcoming_events, recent_memories=recent_memories, stats=stats)
 
     elif role == 'admin':
@@ -387,7 +1849,6 @@ def dashboard():
         recent_users = conn.execute("SELECT * FROM users ORDER BY created_at DESC LIMIT 8").fetchall()
         return render_template('dashboard/admin.html', stats=stats, recent_users=recent_users)
 
-    conn.close()
     return redirect(url_for('index'))
 
 # ── Timetable ─────────────────────────────────────────────────────────────────
@@ -400,27 +1861,26 @@ def timetable():
 
     if role == 'student':
         dept = session.get('department',''); year = session.get('year','')
-        tt = conn.execute("SELECT * FROM timetable WHERE department=? AND year=? ORDER BY day, period", (dept, year)).fetchall()
+        load = lambda: timetable_cache.grid(conn, dept, year)
         depts = None; years = None
     elif role == 'teacher':
-        dept = session.get('department','')
-        tt = conn.execute("SELECT * FROM timetable WHERE teacher_id=? ORDER BY day, period", (uid,)).fetchall()
+        dept = session.get('department',''); year = None
+        load = lambda: timetable_cache.grid(conn, teacher_id=uid)
         depts = None; years = None
     else:
         dept_f = request.args.get('dept','Computer Engineering')
         year_f = request.args.get('year','SE')
-        tt = conn.execute("SELECT * FROM timetable WHERE department=? AND year=? ORDER BY day, period", (dept_f, year_f)).fetchall()
+        load = lambda: timetable_cache.grid(conn, dept_f, year_f, request.args.get('semester'))
         depts = conn.execute("SELECT * FROM departments").fetchall()
         years = ['FE','SE','TE','BE']
         dept = dept_f; year = year_f
 
-    # Organize by day
-    schedule = {d: {} for d in days}
-    for row in tt:
-        schedule[row['day']][row['period']] = row
-
-    conn.close()
-    return render_template('timetable/view.html', schedule=schedule, days=days, dept=dept, year=year,
+    # The grid is shared by a class (or one teacher); the page around it carries the per-user parts.
+    def context():
+        grid = load()
+        return {'schedule': {d: grid.get(d, {}) for d in days}, 'days': days, 'dept': dept, 'year': year}
+    grid = fragment_cache.render('timetable', ('timetable',), 'timetable/_grid.html', context, uid if role == 'teacher' else None)
+    return render_template('timetable/view.html', grid=grid, dept=dept, year=year,
                            depts=depts, years=years if role in ('admin','organizer') else None)
 
 @app.route('/timetable/manage', methods=['GET','POST'])
@@ -434,23 +1894,34 @@ def manage_timetable():
     if request.method == 'POST':
         action = request.form.get('action')
         if action == 'add':
+            f = request.form; start, end = hhmm(f['time_from']), hhmm(f['time_to'])
+            if (start is None) != (end is None):
+                flash('Give both a start and an end time, or neither.','danger'); return redirect(url_for('manage_timetable'))
+            if start is not None and end <= start:
+                flash('End time must be after start time.','danger'); return redirect(url_for('manage_timetable'))
+            conn.execute("BEGIN IMMEDIATE")  # no other worker can book between the check and the insert
+            hit = timetable_cache.clash(conn, f['day'], int(f['period']), start, end, f['room'], f['teacher_id'], f['semester'])
+            if hit:
+                conn.rollback(); kind, r = hit
+                who = f"Room {r['room']}" if kind == 'room' else (r['teacher_name'] or 'This teacher')
+                when = f"{r['time_from']}–{r['time_to']}" if r['time_from'] else f"period {r['period']}"
+                flash(f"{who} is already booked on {r['day']} {when} ({r['subject']}, {r['department']} {r['year']}).",'danger')
+                return redirect(url_for('manage_timetable'))
             conn.execute("INSERT INTO timetable (department,year,semester,day,period,subject,teacher_id,teacher_name,room,time_from,time_to,created_by) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
                 (request.form['department'], request.form['year'], request.form['semester'],
                  request.form['day'], request.form['period'], request.form['subject'],
                  request.form['teacher_id'], request.form['teacher_name'],
                  request.form['room'], request.form['time_from'], request.form['time_to'],
                  session['user_id']))
-            conn.commit()
+            conn.commit(); timetable_cache.invalidate()
             flash('Timetable entry added!','success')
         elif action == 'delete':
             conn.execute("DELETE FROM timetable WHERE id=?", (request.form['tt_id'],))
-            conn.commit()
+            conn.commit(); timetable_cache.invalidate()
             flash('Entry deleted.','info')
-        conn.close()
         return redirect(url_for('manage_timetable'))
 
     tt_all = conn.execute("SELECT t.*, u.full_name as teacher FROM timetable t LEFT JOIN users u ON t.teacher_id=u.id ORDER BY t.department, t.year, t.day, t.period").fetchall()
-    conn.close()
     return render_template('timetable/manage.html', depts=depts, teachers=teachers, tt_all=tt_all)
 
 # ── QR Attendance ─────────────────────────────────────────────────────────────
@@ -461,23 +1932,23 @@ def attendance():
     uid = session['user_id']; role = session['role']
 
     if role == 'teacher' or role == 'admin':
-        sessions_list = conn.execute("""SELECT s.*, 
-            (SELECT COUNT(*) FROM attendance_records WHERE session_id=s.id) as present_count
-            FROM attendance_sessions s WHERE s.teacher_id=? ORDER BY s.created_at DESC LIMIT 20""", (uid,)).fetchall()
+        sessions_list = conn.execute("SELECT * FROM attendance_sessions WHERE teacher_id=? ORDER BY created_at DESC LIMIT 20", (uid,)).fetchall()
         # Students in teacher's dept
         dept = session.get('department','')
-        students = conn.execute("SELECT u.*, (SELECT COUNT(*) FROM attendance_records ar JOIN attendance_sessions s2 ON ar.session_id=s2.id WHERE ar.student_id=u.id AND s2.teacher_id=?) as att_count FROM users u WHERE u.role='student' AND u.department=? ORDER BY u.year, u.roll_number", (uid, dept)).fetchall()
-        conn.close()
+        students = conn.execute(f"SELECT u.*, COALESCE(t.present,0) as att_count FROM users u {TEACHER_ATT_JOIN} WHERE u.role='student' AND u.department=? ORDER BY u.year, u.roll_number", (uid, dept)).fetchall()
         return render_template('attendance/teacher.html', sessions=sessions_list, students=students)
     else:
         # Student: view their own attendance only
-        dept = session.get('department',''); year = session.get('year','')
+        # Totals come from the rollup, so the log only needs the latest marks
         my_records = conn.execute("""SELECT ar.*, s.subject, s.date, s.time_from, s.department
             FROM attendance_records ar JOIN attendance_sessions s ON ar.session_id=s.id
-            WHERE ar.student_id=? ORDER BY ar.marked_at DESC""", (uid,)).fetchall()
-        total_sessions = conn.execute("SELECT COUNT(*) FROM attendance_sessions WHERE department=? AND year=? AND is_active=0", (dept, year)).fetchone()[0]
-        conn.close()
-        return render_template('attendance/student.html', my_records=my_records, total_sessions=total_sessions)
+            WHERE ar.student_id=? ORDER BY ar.marked_at DESC LIMIT 50""", (uid,)).fetchall()
+        by_subject = conn.execute("""SELECT subject, SUM(present) AS present, SUM(held) AS held,
+            ROUND(100.0 * SUM(present) / NULLIF(SUM(held), 0), 1) AS pct FROM attendance_rollup
+            WHERE student_id=? GROUP BY subject ORDER BY subject""", (uid,)).fetchall()
+        return render_template('attendance/student.html', my_records=my_records, by_subject=by_subject,
+                               attended=sum(r['present'] for r in by_subject), total_sessions=sum(r['held'] for r in by_subject),
+                               alert_pct=app.config['ATTENDANCE_ALERT_PCT'])
 
 @app.route('/attendance/create', methods=['GET','POST'])
 @login_required
@@ -491,17 +1962,15 @@ def create_attendance_session():
         dept = request.form.get('department', session.get('department',''))
         year = request.form.get('year','')
         expires = (datetime.now() + timedelta(minutes=int(request.form.get('duration', 15)))).isoformat()
-        conn.execute("""INSERT INTO attendance_sessions (teacher_id, department, year, subject, room, session_token, qr_data, date, time_from, expires_at)
-            VALUES (?,?,?,?,?,?,?,?,?,?)""",
+        conn.execute("""INSERT INTO attendance_sessions (teacher_id, department, year, subject, room, session_token, qr_data, date, time_from, expires_at, total_students)
+            VALUES (?,?,?,?,?,?,?,?,?,?,(SELECT COUNT(*) FROM users WHERE department=? AND year=? AND role='student'))""",
             (session['user_id'], dept, year, request.form['subject'], request.form.get('room',''),
-             token, qr_data, date.today().isoformat(), datetime.now().strftime('%H:%M'), expires))
+             token, qr_data, date.today().isoformat(), datetime.now().strftime('%H:%M'), expires, dept, year))
         conn.commit()
         sess_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
-        conn.close()
         flash(f'Attendance session created! Token: {token}','success')
         return redirect(url_for('attendance_session', session_id=sess_id))
     depts = conn.execute("SELECT * FROM departments").fetchall()
-    conn.close()
     return render_template('attendance/create.html', depts=depts)
 
 @app.route('/attendance/session/<int:session_id>')
@@ -515,39 +1984,31 @@ def attendance_session(session_id):
         return redirect(url_for('attendance'))
     records = conn.execute("""SELECT ar.*, u.roll_number, u.year FROM attendance_records ar
         JOIN users u ON ar.student_id=u.id WHERE ar.session_id=? ORDER BY ar.marked_at""", (session_id,)).fetchall()
-    present_count = len(records)
-    total_students = conn.execute("SELECT COUNT(*) FROM users WHERE department=? AND year=? AND role='student'",
-                                  (sess['department'], sess['year'])).fetchone()[0]
-    conn.close()
     return render_template('attendance/session.html', sess=sess, records=records,
-                           present_count=present_count, total_students=total_students)
+                           present_count=sess['present_count'], total_students=sess['total_students'])
 
 @app.route('/attendance/mark/<token>', methods=['GET','POST'])
 @login_required
 def mark_attendance(token):
-    conn = get_db()
-    sess = conn.execute("SELECT * FROM attendance_sessions WHERE session_token=? AND is_active=1", (token,)).fetchone()
+    sess = active_session(token)
     if not sess:
-        conn.close()
         return render_template('attendance/mark_result.html', success=False, msg='Session expired or invalid.')
     # Check expiry
     if sess['expires_at'] and datetime.fromisoformat(sess['expires_at']) < datetime.now():
+        conn = get_db()
         conn.execute("UPDATE attendance_sessions SET is_active=0 WHERE id=?", (sess['id'],))
-        conn.commit(); conn.close()
+        conn.commit(); _active_sessions.pop(token, None)
         return render_template('attendance/mark_result.html', success=False, msg='QR code has expired. Ask teacher for new one.')
-    # Check already marked
-    existing = conn.execute("SELECT id FROM attendance_records WHERE session_id=? AND student_id=?", (sess['id'], session['user_id'])).fetchone()
-    if existing:
-        conn.close()
+    # UNIQUE(session_id, student_id) rejects duplicates; the role filter rejects non-students
+    marked_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    inserted, rid = write_batcher.submit("""INSERT OR IGNORE INTO attendance_records (session_id, student_id, student_name, roll_number, department, year, marked_at)
+        SELECT ?, id, full_name, roll_number, department, year, ? FROM users WHERE id=? AND role='student'""", (sess['id'], marked_at, session['user_id']))
+    if not inserted:
+        u = get_current_user()
+        if not u or u['role'] != 'student':
+            return render_template('attendance/mark_result.html', success=False, msg='Only students can mark attendance.')
         return render_template('attendance/mark_result.html', success=True, msg='Attendance already marked for this session!', already=True)
-    # Verify student is in correct dept/year
-    u = conn.execute("SELECT * FROM users WHERE id=?", (session['user_id'],)).fetchone()
-    if u['role'] != 'student':
-        conn.close()
-        return render_template('attendance/mark_result.html', success=False, msg='Only students can mark attendance.')
-    conn.execute("INSERT INTO attendance_records (session_id, student_id, student_name, roll_number, department, year) VALUES (?,?,?,?,?,?)",
-                 (sess['id'], session['user_id'], u['full_name'], u['roll_number'], u['department'], u['year']))
-    conn.commit(); conn.close()
+    attendance_broker.publish(token, {'id': rid})  # wakes live viewers; they read the record itself from the DB
     return render_template('attendance/mark_result.html', success=True, msg=f'✅ Attendance marked for {sess["subject"]}!', subject=sess['subject'])
 
 @app.route('/attendance/session/<int:session_id>/close', methods=['POST'])
@@ -555,37 +2016,229 @@ def mark_attendance(token):
 @role_required('teacher','admin')
 def close_session(session_id):
     conn = get_db()
+    sess = conn.execute("SELECT session_token FROM attendance_sessions WHERE id=? AND teacher_id=?", (session_id, session['user_id'])).fetchone()
     conn.execute("UPDATE attendance_sessions SET is_active=0 WHERE id=? AND teacher_id=?", (session_id, session['user_id']))
-    conn.commit(); conn.close()
+    conn.commit()
+    if sess:
+        _active_sessions.pop(sess['session_token'], None)
+        attendance_broker.publish(sess['session_token'], {'closed': True})
     flash('Session closed.','info')
     return redirect(url_for('attendance_session', session_id=session_id))
 
+# ── Attendance export ─────────────────────────────────────────────────────────
+def fetch_stream(conn, sql, params=()):
+    """Yield the rows of a query fetchmany() at a time, so an export holds one batch in memory."""
+    cur = conn.execute(sql, params); size = app.config['EXPORT_FETCH_SIZE']
+    try:
+        while batch := cur.fetchmany(size): yield from batch
+    finally: cur.close()
+
+FORMULA_START = ('=', '+', '-', '@', '\t', '\r')
+
+def csv_cell(v):
+    """Quote text a spreadsheet would run as a formula (names and subjects are user input); numbers pass through."""
+    return "'" + v if isinstance(v, str) and v.startswith(FORMULA_START) else v
+
+def csv_stream(header, rows):
+    """CSV text in ~64 KB chunks; the BOM makes Excel read the UTF-8 names correctly."""
+    buf = io.StringIO(); w = csv.writer(buf)
+    buf.write('\ufeff'); w.writerow(header)
+    yield buf.getvalue(); buf.seek(0); buf.truncate()
+    for r in rows:
+        w.writerow([csv_cell(v) for v in r])
+        if buf.tell() > 65536: yield buf.getvalue(); buf.seek(0); buf.truncate()
+    yield buf.getvalue()
+
+class _ZipSink:
+    """Write-only file object for zipfile: collects output until the generator hands it on.
+
+    Having no seek() makes ZipFile write data descriptors instead of patching
+    local headers, which is what lets the workbook go out while it is written.
+    """
+    def __init__(self): self.parts = []; self.size = 0
+    def write(self, b): self.parts.append(bytes(b)); self.size += len(b); return len(b)
+    def flush(self): pass
+    def take(self):
+        out = b''.join(self.parts); self.parts.clear(); self.size = 0; return out
+
+XLSX_NS = 'http://schemas.openxmlformats.org/'
+XLSX_PARTS = {
+    '[Content_Types].xml': f'<Types xmlns="{XLSX_NS}package/2006/content-types"><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/><Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/></Types>',
+    '_rels/.rels': f'<Relationships xmlns="{XLSX_NS}package/2006/relationships"><Relationship Id="rId1" Type="{XLSX_NS}officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>',
+    'xl/workbook.xml': f'<workbook xmlns="{XLSX_NS}spreadsheetml/2006/main" xmlns:r="{XLSX_NS}officeDocument/2006/relationships"><sheets><sheet name="{{sheet}}" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels': f'<Relationships xmlns="{XLSX_NS}package/2006/relationships"><Relationship Id="rId1" Type="{XLSX_NS}officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/></Relationships>',
+}
+XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def xlsx_cell(v):
+    if isinstance(v, (int, float)) and not isinstance(v, bool): return f'<c><v>{v}</v></c>'
+    if v is None or v == '': return '<c/>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(XML_ILLEGAL.sub("", str(v)))}</t></is></c>'
+
+def xlsx_stream(header, rows, sheet='Report'):
+    """A single-sheet workbook of inline-string cells, zipped and yielded as it is written.
+
+    Hand-rolled rather than openpyxl, whose writer has to finish the whole file
+    before the first byte can be sent.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, xml in XLSX_PARTS.items():
+            zf.writestr(name, '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' + xml.replace('{sheet}', str(escape(sheet[:31]))))
+        yield sink.take()
+        with zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as fh:
+            fh.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{XLSX_NS}spreadsheetml/2006/main"><sheetData>'.encode())
+            for r in itertools.chain([header], rows):
+                fh.write(('<row>' + ''.join(map(xlsx_cell, r)) + '</row>').encode())
+                if sink.size > 65536: yield sink.take()
+            fh.write(b'</sheetData></worksheet>')
+    yield sink.take()
+
+EXPORT_FORMATS = {'csv': ('text/csv', csv_stream),
+                  'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', xlsx_stream)}
+
+def export_response(fmt, name, header, rows):
+    if fmt not in EXPORT_FORMATS: abort(404)
+    mimetype, writer = EXPORT_FORMATS[fmt]
+    rv = Response(stream_with_context(writer(header, rows, name) if fmt == 'xlsx' else writer(header, rows)), mimetype=mimetype)
+    rv.headers.set('Content-Disposition', 'attachment', filename=f'{name}.{fmt}')
+    rv.headers['X-Accel-Buffering'] = 'no'  # let nginx pass chunks through as they are produced
+    return rv
+
+def export_filters(alias='s'):
+    """WHERE clause + params for the report query string; teachers only ever see their own sessions."""
+    where, params = [], []
+    teacher = session['user_id'] if session['role'] != 'admin' else request.args.get('teacher', type=int)
+    if teacher: where.append(f'{alias}.teacher_id=?'); params.append(teacher)
+    for arg, col in (('department', 'department'), ('year', 'year'), ('subject', 'subject')):
+        if request.args.get(arg): where.append(f'{alias}.{col}=?'); params.append(request.args[arg])
+    if request.args.get('from'): where.append(f'{alias}.date>=?'); params.append(request.args['from'])
+    if request.args.get('to'): where.append(f'{alias}.date<=?'); params.append(request.args['to'])
+    return ' AND '.join(where) or '1', params
+
+@app.route('/attendance/session/<int:session_id>/export.<fmt>')
+@login_required
+@role_required('teacher','admin')
+def export_session(session_id, fmt):
+    """Class roster for one session with Present/Absent, including anyone marked from outside the class."""
+    conn = get_db()
+    sess = conn.execute("SELECT * FROM attendance_sessions WHERE id=?", (session_id,)).fetchone()
+    if not sess or (session['role'] != 'admin' and sess['teacher_id'] != session['user_id']): abort(404)
+    rows = fetch_stream(conn, """
+        SELECT u.roll_number, u.full_name, u.department, u.year, CASE WHEN ar.id IS NULL THEN 'Absent' ELSE 'Present' END, ar.marked_at, ar.method
+        FROM users u LEFT JOIN attendance_records ar ON ar.session_id=? AND ar.student_id=u.id
+        WHERE u.role='student' AND u.department=? AND u.year=?
+        UNION ALL
+        SELECT ar.roll_number, ar.student_name, ar.department, ar.year, 'Present', ar.marked_at, ar.method
+        FROM attendance_records ar LEFT JOIN users u ON u.id=ar.student_id
+        WHERE ar.session_id=? AND (u.id IS NULL OR u.role!='student' OR u.department IS NOT ? OR u.year IS NOT ?)""",
+        (session_id, sess['department'], sess['year'], session_id, sess['department'], sess['year']))
+    name = secure_filename(f"attendance-{sess['subject']}-{sess['date']}-{session_id}") or f'attendance-{session_id}'
+    return export_response(fmt, name, ['Roll Number', 'Name', 'Department', 'Year', 'Status', 'Marked At', 'Method'], rows)
+
+@app.route('/attendance/export/subjects.<fmt>')
+@login_required
+@role_required('teacher','admin')
+def export_subjects(fmt):
+    """Per subject and class: sessions held and the average attendance percentage."""
+    where, params = export_filters()
+    rows = fetch_stream(get_db(), f"""
+        SELECT s.department, s.year, s.subject, COUNT(*), SUM(s.present_count), SUM(s.total_students),
+               ROUND(100.0 * SUM(s.present_count) / NULLIF(SUM(s.total_students), 0), 1)
+        FROM attendance_sessions s WHERE {where}
+        GROUP BY s.department, s.year, s.subject ORDER BY s.department, s.year, s.subject""", params)
+    return export_response(fmt, f'attendance-subjects-{date.today().isoformat()}',
+                           ['Department', 'Year', 'Subject', 'Sessions', 'Present', 'Expected', 'Attendance %'], rows)
+
+@app.route('/attendance/export/students.<fmt>')
+@login_required
+@role_required('teacher','admin')
+def export_students(fmt):
+    """Per student and subject: sessions attended / held.  ?below=75 keeps only the defaulters."""
+    where, params = export_filters()
+    below = request.args.get('below', type=float)
+    # Students are walked in index order and each (student, subject) cell counted by a
+    # correlated lookup, so rows leave as soon as they are computed instead of after a global sort.
+    sql = f"""
+        WITH held AS MATERIALIZED (SELECT s.department, s.year, s.subject, COUNT(*) AS n
+                                   FROM attendance_sessions s WHERE {where} GROUP BY s.department, s.year, s.subject)
+        SELECT u.roll_number, u.full_name, u.department, u.year, held.subject,
+               (SELECT COUNT(*) FROM attendance_records ar JOIN attendance_sessions s ON s.id=ar.session_id
+                WHERE ar.student_id=u.id AND s.department=held.department AND s.year=held.year AND s.subject=held.subject AND {where}) AS attended,
+               held.n AS held
+        FROM users u JOIN held ON held.department=u.department AND held.year=u.year
+        WHERE u.role='student' ORDER BY u.department, u.year, u.full_name, u.id, held.subject"""
+    sql = f"SELECT *, ROUND(100.0 * attended / held, 1) FROM ({sql})"; params = params + params
+    if below is not None: sql += " WHERE 100.0 * attended / held < ?"; params.append(below)
+    rows = fetch_stream(get_db(), sql, params)
+    name = f"attendance-{'defaulters' if below is not None else 'students'}-{date.today().isoformat()}"
+    return export_response(fmt, name, ['Roll Number', 'Name', 'Department', 'Year', 'Subject', 'Attended', 'Held', 'Attendance %'], rows)
+
+# ── Attendance analytics ──────────────────────────────────────────────────────
+def rollup_filters():
+    """WHERE clause + params over attendance_rollup (alias r); teachers are held to their own department."""
+    dept = session.get('department', '') if session['role'] != 'admin' else request.args.get('department', '')
+    where, params = [], []
+    for col, v in (('department', dept), ('year', request.args.get('year')), ('subject', request.args.get('subject'))):
+        if v: where.append(f'r.{col}=?'); params.append(v)
+    if request.args.get('from'): where.append('r.month>=?'); params.append(request.args['from'][:7])
+    if request.args.get('to'): where.append('r.month<=?'); params.append(request.args['to'][:7])
+    return ' AND '.join(where) or '1', params
+
+@app.route('/attendance/analytics')
+@login_required
+@role_required('teacher','admin')
+def attendance_analytics():
+    """Class/subject percentages, the monthly trend and the low-attendance list, all read from attendance_rollup."""
+    conn = get_db(); where, params = rollup_filters()
+    threshold = request.args.get('below', app.config['ATTENDANCE_ALERT_PCT'], type=float)
+    pct = "ROUND(100.0 * SUM(r.present) / NULLIF(SUM(r.held), 0), 1)"
+    subjects = conn.execute(f"""SELECT r.department, r.year, r.subject, SUM(r.present) AS present, SUM(r.held) AS held,
+        COUNT(DISTINCT r.student_id) AS students, {pct} AS pct FROM attendance_rollup r WHERE {where}
+        GROUP BY r.department, r.year, r.subject""", params).fetchall()
+    months = conn.execute(f"""SELECT r.month, SUM(r.present) AS present, SUM(r.held) AS held, {pct} AS pct
+        FROM attendance_rollup r WHERE {where} GROUP BY r.month ORDER BY r.month""", params).fetchall()
+    # CROSS JOIN pins the rollup as the outer loop, so users are only probed for rows in scope
+    alerts = conn.execute(f"""SELECT r.student_id, u.full_name, u.roll_number, r.department, r.year, r.subject,
+        SUM(r.present) AS present, SUM(r.held) AS held, {pct} AS pct
+        FROM attendance_rollup r CROSS JOIN users u ON u.id=r.student_id WHERE {where}
+        GROUP BY r.department, r.year, r.subject, r.student_id HAVING 100.0 * SUM(r.present) < ? * SUM(r.held)
+        ORDER BY pct, u.full_name LIMIT ?""", params + [threshold, app.config['ATTENDANCE_ALERT_LIMIT']]).fetchall()
+    if request.args.get('format') == 'json':
+        return jsonify(threshold=threshold, subjects=[dict(r) for r in subjects], months=[dict(r) for r in months], alerts=[dict(r) for r in alerts])
+    depts = conn.execute("SELECT name FROM departments ORDER BY name").fetchall() if session['role'] == 'admin' else []
+    return render_template('attendance/analytics.html', subjects=subjects, months=months, alerts=alerts, threshold=threshold, depts=depts)
+
 # ── Notices ───────────────────────────────────────────────────────────────────
 @app.route('/notices')
 @login_required
 def notices():
-    conn = get_db()
-    role = session['role']; uid = session['user_id']
+    feed = fragment_cache.render('notices', ('notices',), '_notice_feed.html',
+                                 lambda: dict(zip(('notices', 'next_cursor'), notices_page()), role=session['role']))
+    return render_template('notices.html', feed=feed, cat_filter=request.args.get('cat',''))
+
+@app.route('/api/notices')
+@login_required
+def api_notices():
+    ns, nxt = notices_page()
+    return page_json('_notice_items.html', nxt, 'api_notices', notices=ns)
+
+def notices_page():
+    role = session['role']
     dept = session.get('department',''); year = session.get('year','')
     cat = request.args.get('cat','')
-
     if role == 'student':
         # Students only see notices addressed to them
         q = "SELECT * FROM notices WHERE (department='All' OR department=?) AND (year='All' OR year=?)"
         params = [dept, year]
-        if cat: q += " AND category=?"; params.append(cat)
-        q += " ORDER BY is_important DESC, created_at DESC"
-        ns = conn.execute(q, params).fetchall()
     else:
         # Teachers/organizers/admin see all notices they can manage
         q = "SELECT * FROM notices WHERE 1=1"
         params = []
-        if cat: q += " AND category=?"; params.append(cat)
-        q += " ORDER BY is_important DESC, created_at DESC"
-        ns = conn.execute(q, params).fetchall()
-
-    conn.close()
-    return render_template('notices.html', notices=ns, cat_filter=cat)
+    if cat: q += " AND category=?"; params.append(cat)
+    return keyset_page(get_db(), q, params, [('is_important', 'is_important'), ('created_at', 'created_at'), ('id', 'id')])
 
 @app.route('/notices/create', methods=['GET','POST'])
 @login_required
@@ -593,7 +2246,6 @@ def notices():
 def create_notice():
     conn = get_db()
     depts = conn.execute("SELECT * FROM departments").fetchall()
-    conn.close()
     if request.method == 'POST':
         title = request.form['title']
         content = request.form['content']
@@ -603,10 +2255,9 @@ def create_notice():
         important = 1 if request.form.get('is_important') else 0
         # Auto-generate WhatsApp message
         wa_msg = f"📢 *ISBM CampusConnect*\n*{title}*\n\n{content[:200]}\n\n_From: {session['full_name']} | {session['role'].title()}_\n_Dept: {dept} | Year: {year}_"
-        conn = get_db()
         conn.execute("INSERT INTO notices (title,content,category,author_id,author_name,author_role,department,year,is_important,whatsapp_message) VALUES (?,?,?,?,?,?,?,?,?,?)",
                      (title, content, cat, session['user_id'], session['full_name'], session['role'], dept, year, important, wa_msg))
-        conn.commit(); conn.close()
+        conn.commit(); public_cache.invalidate('home')
         flash('Notice posted! WhatsApp message generated.','success')
         return redirect(url_for('notices'))
     return render_template('create_notice.html', depts=depts)
@@ -614,19 +2265,26 @@ def create_notice():
 # ── Events ────────────────────────────────────────────────────────────────────
 @app.route('/events')
 def events():
-    conn = get_db()
+    page, nxt = events_page()
+    depts = get_db().execute("SELECT * FROM departments").fetchall()
+    a = request.args
+    return render_template('events/list.html', events=page, depts=depts, dept_filter=a.get('dept',''), type_filter=a.get('type',''),
+                           status_filter=a.get('status',''), search=a.get('q',''), next_cursor=nxt)
+
+@app.route('/api/events')
+def api_events():
+    page, nxt = events_page()
+    return page_json('events/_cards.html', nxt, 'api_events', events=page)
+
+def events_page():
     dept_f = request.args.get('dept',''); type_f = request.args.get('type',''); status_f = request.args.get('status',''); q = request.args.get('q','')
-    query = "SELECT e.*, (SELECT COUNT(*) FROM event_registrations WHERE event_id=e.id) as rc FROM events e WHERE 1=1"
+    query = "SELECT e.*, e.reg_count as rc FROM events e WHERE 1=1"
     params = []
     if dept_f: query += " AND (e.department=? OR e.department='All')"; params.append(dept_f)
     if type_f: query += " AND e.event_type=?"; params.append(type_f)
     if status_f: query += " AND e.status=?"; params.append(status_f)
-    if q: query += " AND (e.title LIKE ? OR e.description LIKE ?)"; params += [f'%{q}%',f'%{q}%']
-    query += " ORDER BY e.event_date DESC"
-    all_events = conn.execute(query, params).fetchall()
-    depts = conn.execute("SELECT * FROM departments").fetchall()
-    conn.close()
-    return render_template('events/list.html', events=all_events, depts=depts, dept_filter=dept_f, type_filter=type_f, status_filter=status_f, search=q)
+    if fts_query(q): query += " AND e.id IN (SELECT rowid FROM events_fts WHERE events_fts MATCH ?)"; params.append(fts_query(q))
+    return keyset_page(get_db(), query, params, [('e.event_date', 'event_date'), ('e.id', 'id')])
 
 @app.route('/events/<int:eid>')
 def event_detail(eid):
@@ -634,12 +2292,11 @@ def event_detail(eid):
     ev = conn.execute("SELECT * FROM events WHERE id=?", (eid,)).fetchone()
     if not ev: flash('Event not found.','danger'); return redirect(url_for('events'))
     regs = conn.execute("SELECT u.full_name, u.department, u.year, r.registered_at FROM event_registrations r JOIN users u ON r.user_id=u.id WHERE r.event_id=? LIMIT 30", (eid,)).fetchall()
-    rc = conn.execute("SELECT COUNT(*) FROM event_registrations WHERE event_id=?", (eid,)).fetchone()[0]
+    rc = ev['reg_count']
     is_reg = False
     if 'user_id' in session:
         is_reg = conn.execute("SELECT id FROM event_registrations WHERE event_id=? AND user_id=?", (eid, session['user_id'])).fetchone() is not None
     mems = conn.execute("SELECT * FROM memories WHERE event_id=? ORDER BY created_at DESC", (eid,)).fetchall()
-    conn.close()
     return render_template('events/detail.html', ev=ev, regs=regs, rc=rc, is_reg=is_reg, mems=mems)
 
 @app.route('/events/<int:eid>/register', methods=['POST'])
@@ -647,14 +2304,13 @@ def event_detail(eid):
 def register_event(eid):
     conn = get_db()
     ev = conn.execute("SELECT * FROM events WHERE id=?", (eid,)).fetchone()
-    if not ev: conn.close(); return redirect(url_for('events'))
+    if not ev: return redirect(url_for('events'))
     if conn.execute("SELECT id FROM event_registrations WHERE event_id=? AND user_id=?", (eid, session['user_id'])).fetchone():
-        conn.close(); flash('Already registered!','info'); return redirect(url_for('event_detail', eid=eid))
-    rc = conn.execute("SELECT COUNT(*) FROM event_registrations WHERE event_id=?", (eid,)).fetchone()[0]
-    if ev['max_participants'] and rc >= ev['max_participants']:
-        conn.close(); flash('Event is full!','danger'); return redirect(url_for('event_detail', eid=eid))
+        flash('Already registered!','info'); return redirect(url_for('event_detail', eid=eid))
+    if ev['max_participants'] and ev['reg_count'] >= ev['max_participants']:
+        flash('Event is full!','danger'); return redirect(url_for('event_detail', eid=eid))
     conn.execute("INSERT INTO event_registrations (event_id, user_id) VALUES (?,?)", (eid, session['user_id']))
-    conn.commit(); conn.close()
+    conn.commit()
     flash('Registered successfully! 🎉','success')
     return redirect(url_for('event_detail', eid=eid))
 
@@ -663,7 +2319,7 @@ def register_event(eid):
 def unregister_event(eid):
     conn = get_db()
     conn.execute("DELETE FROM event_registrations WHERE event_id=? AND user_id=?", (eid, session['user_id']))
-    conn.commit(); conn.close()
+    conn.commit()
     flash('Unregistered.','info')
     return redirect(url_for('event_detail', eid=eid))
 
@@ -673,21 +2329,19 @@ def unregister_event(eid):
 def create_event():
     conn = get_db()
     depts = conn.execute("SELECT * FROM departments").fetchall()
-    conn.close()
     if request.method == 'POST':
         banner = request.files.get('banner')
         bpath = None
         if banner and allowed_file(banner.filename):
-            fname = f"ev_{uuid.uuid4().hex}_{secure_filename(banner.filename)}"
-            banner.save(os.path.join(UPLOAD_FOLDER, 'events', fname)); bpath = fname
-        conn = get_db()
-        conn.execute("INSERT INTO events (title,description,department,event_type,venue,event_date,event_time,reg_deadline,max_participants,organizer_id,organizer_name,banner_image,tags) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            bpath = save_upload(banner, conn)
+        cur = conn.execute("INSERT INTO events (title,description,department,event_type,venue,event_date,event_time,reg_deadline,max_participants,organizer_id,organizer_name,banner_image,tags) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
             (request.form['title'], request.form['description'], request.form['department'],
              request.form['event_type'], request.form['venue'], request.form['event_date'],
              request.form.get('event_time',''), request.form.get('reg_deadline'),
              request.form.get('max_participants') or None,
              session['user_id'], session['full_name'], bpath, request.form.get('tags','')))
-        conn.commit(); conn.close()
+        conn.commit(); public_cache.invalidate('home', 'counts', 'departments')
+        if bpath: queue_variants('events', bpath, BANNER_VARIANTS_SQL, cur.lastrowid)
         flash('Event created!','success')
         return redirect(url_for('events'))
     return render_template('events/create.html', depts=depts)
@@ -695,92 +2349,152 @@ def create_event():
 # ── Memories ──────────────────────────────────────────────────────────────────
 @app.route('/memories')
 def memories():
+    conn = get_db()
+    mems, nxt, liked, like_delta = memories_page()
+    evs = conn.execute("SELECT id, title FROM events ORDER BY event_date DESC").fetchall()
+    albums = conn.execute("SELECT DISTINCT album FROM memories WHERE album IS NOT NULL").fetchall()
+    return render_template('memories/gallery.html', mems=mems, evs=evs, albums=albums, ef=request.args.get('event',''),
+                           af=request.args.get('album',''), liked=liked, like_delta=like_delta, next_cursor=nxt)
+
+@app.route('/api/memories')
+def api_memories():
+    mems, nxt, liked, like_delta = memories_page()
+    return page_json('memories/_cards.html', nxt, 'api_memories', mems=mems, liked=liked, like_delta=like_delta)
+
+def memories_page():
+    """One gallery page, which of its photos the current user has liked and the like counts still buffered."""
     conn = get_db()
     ef = request.args.get('event',''); af = request.args.get('album','')
     q = "SELECT m.*, e.title as event_title FROM memories m LEFT JOIN events e ON m.event_id=e.id WHERE 1=1"
     params = []
     if ef: q += " AND m.event_id=?"; params.append(ef)
     if af: q += " AND m.album=?"; params.append(af)
-    q += " ORDER BY m.created_at DESC"
-    mems = conn.execute(q, params).fetchall()
-    evs = conn.execute("SELECT id, title FROM events ORDER BY event_date DESC").fetchall()
-    albums = conn.execute("SELECT DISTINCT album FROM memories WHERE album IS NOT NULL").fetchall()
-    liked = set()
-    if 'user_id' in session:
-        liked = {r['memory_id'] for r in conn.execute("SELECT memory_id FROM memory_likes WHERE user_id=?", (session['user_id'],)).fetchall()}
-    conn.close()
-    return render_template('memories/gallery.html', mems=mems, evs=evs, albums=albums, ef=ef, af=af, liked=liked)
+    mems, nxt = keyset_page(conn, q, params, [('m.created_at', 'created_at'), ('m.id', 'id')])
+    ids = [m['id'] for m in mems]; liked = set()
+    if 'user_id' in session and mems:
+        liked = {r['memory_id'] for r in conn.execute(f"SELECT memory_id FROM memory_likes WHERE user_id=? AND memory_id IN ({','.join('?' * len(ids))})",
+                                                       [session['user_id'], *ids])}
+    liked, delta = like_buffer.overlay(session.get('user_id'), ids, liked)
+    return mems, nxt, liked, delta
 
 @app.route('/memories/upload', methods=['GET','POST'])
 @login_required
 @role_required('organizer','admin')
 def upload_memory():
-    conn = get_db(); evs = conn.execute("SELECT id, title FROM events ORDER BY event_date DESC").fetchall(); conn.close()
+    conn = get_db(); evs = conn.execute("SELECT id, title FROM events ORDER BY event_date DESC").fetchall()
     if request.method == 'POST':
-        files = request.files.getlist('photos'); cnt = 0
-        for f in files:
-            if f and allowed_file(f.filename):
-                fname = f"mem_{uuid.uuid4().hex}_{secure_filename(f.filename)}"
-                f.save(os.path.join(UPLOAD_FOLDER, 'memories', fname))
-                conn = get_db()
-                conn.execute("INSERT INTO memories (event_id,uploader_id,uploader_name,title,description,image_path,album) VALUES (?,?,?,?,?,?,?)",
-                    (request.form.get('event_id') or None, session['user_id'], session['full_name'],
-                     request.form.get('title',''), request.form.get('description',''), fname, request.form.get('album','')))
-                conn.commit(); conn.close(); cnt += 1
+        # Parts are already on disk (UploadRequest); hash and move them in parallel, then insert in one transaction
+        files = [f for f in request.files.getlist('photos') if f and allowed_file(f.filename)]
+        for f in files: f.stream.close()
+        blobs = list(worker_pool('upload').map(lambda f: ingest_blob(f.stream.name, f.filename), files))
+        meta = (request.form.get('event_id') or None, session['user_id'], session['full_name'],
+                request.form.get('title',''), request.form.get('description',''), request.form.get('album',''))
+        cnt = len(blobs)
+        if blobs:
+            register_blobs(conn, blobs)
+            conn.executemany("INSERT INTO memories (event_id,uploader_id,uploader_name,title,description,album,image_path,sha256) VALUES (?,?,?,?,?,?,?,?)",
+                             [meta + (path, digest) for digest, path, _ in blobs])
+            # Still inside the write transaction, so the newest rows are ours
+            saved = conn.execute("SELECT id, image_path FROM memories ORDER BY id DESC LIMIT ?", (cnt,)).fetchall()
+            conn.commit(); public_cache.invalidate('home', 'counts')
+            for r in saved: queue_variants('memories', r['image_path'], MEMORY_VARIANTS_SQL, r['id'])
         flash(f'{cnt} photo(s) uploaded!','success')
         return redirect(url_for('memories'))
-    return render_template('memories/upload.html', evs=evs)
+    return render_template('memories/upload.html', evs=evs, max_request=app.config['MAX_CONTENT_LENGTH'], chunk_size=app.config['UPLOAD_CHUNK_SIZE'])
+
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+@app.route('/memories/upload/chunk', methods=['GET','POST'])
+@login_required
+@role_required('organizer','admin')
+def upload_memory_chunk():
+    """Resumable single-file upload for albums larger than MAX_CONTENT_LENGTH.
+
+    GET ?upload_id= returns the bytes received so far. POST sends the raw body
+    as the chunk at ?offset= of a ?total= byte file; a mismatched offset gets
+    409 with the offset to resume from. The final chunk ingests the file and
+    inserts the memory row using the event_id/title/description/album args.
+    """
+    a = request.args; uid = a.get('upload_id', '')
+    if not UPLOAD_ID_RE.match(uid): return jsonify({'error': 'bad upload_id'}), 400
+    part = os.path.join(incoming_dir(), f'chunk_{session["user_id"]}_{uid}')
+    have = os.path.getsize(part) if os.path.exists(part) else 0
+    if request.method == 'GET': return jsonify({'offset': have})
+
+    total = a.get('total', type=int); offset = a.get('offset', type=int); filename = a.get('filename', '')
+    if not allowed_file(filename) or total is None or not 0 < total <= app.config['MAX_UPLOAD_FILE_SIZE']:
+        return jsonify({'error': 'invalid file'}), 400
+    if offset != have: return jsonify({'offset': have}), 409
+    with open(part, 'ab') as out:
+        for chunk in iter(lambda: request.stream.read(1 << 16), b''):
+            if out.tell() + len(chunk) > total:
+                out.truncate(offset); return jsonify({'error': 'chunk exceeds total'}), 400
+            out.write(chunk)
+        have = out.tell()
+    if have < total: return jsonify({'offset': have, 'done': False})
+
+    digest, fname, size = ingest_blob(part, filename)
+    conn = get_db()
+    register_blobs(conn, [(digest, fname, size)])
+    cur = conn.execute("INSERT INTO memories (event_id,uploader_id,uploader_name,title,description,album,image_path,sha256) VALUES (?,?,?,?,?,?,?,?)",
+        (a.get('event_id') or None, session['user_id'], session['full_name'], a.get('title',''), a.get('description',''),
+         a.get('album',''), fname, digest))
+    conn.commit(); public_cache.invalidate('home', 'counts')
+    queue_variants('memories', fname, MEMORY_VARIANTS_SQL, cur.lastrowid)
+    return jsonify({'offset': have, 'done': True, 'id': cur.lastrowid})
 
 @app.route('/memories/<int:mid>/like', methods=['POST'])
 @login_required
 def like_memory(mid):
-    conn = get_db()
-    ex = conn.execute("SELECT id FROM memory_likes WHERE memory_id=? AND user_id=?", (mid, session['user_id'])).fetchone()
-    if ex:
-        conn.execute("DELETE FROM memory_likes WHERE memory_id=? AND user_id=?", (mid, session['user_id']))
-        conn.execute("UPDATE memories SET likes=likes-1 WHERE id=?", (mid,)); liked = False
-    else:
-        conn.execute("INSERT INTO memory_likes (memory_id,user_id) VALUES (?,?)", (mid, session['user_id']))
-        conn.execute("UPDATE memories SET likes=likes+1 WHERE id=?", (mid,)); liked = True
-    conn.commit()
-    likes = conn.execute("SELECT likes FROM memories WHERE id=?", (mid,)).fetchone()[0]
-    conn.close()
+    res = like_buffer.set(get_db(), session['user_id'], {mid: None})
+    if mid not in res: abort(404)
+    liked, likes = res[mid]
     return jsonify({'liked': liked, 'likes': likes})
 
+@app.route('/api/memories/likes', methods=['POST'])
+@login_required
+def like_memories():
+    """Several likes in one request: {"likes": {"<memory id>": true|false}} -> final state of each photo.
+
+    The client sends the state it wants, not a toggle, so a retried request changes nothing.
+    """
+    states = (request.get_json(silent=True) or {}).get('likes')
+    if not isinstance(states, dict) or not all(k.isdigit() and isinstance(v, bool) for k, v in states.items()):
+        return jsonify(error='likes must map memory ids to true or false'), 400
+    if len(states) > app.config['LIKE_BULK_MAX']: return jsonify(error=f"at most {app.config['LIKE_BULK_MAX']} likes per request"), 400
+    res = like_buffer.set(get_db(), session['user_id'], {int(k): v for k, v in states.items()}) if states else {}
+    return jsonify(likes={mid: {'liked': liked, 'likes': likes} for mid, (liked, likes) in res.items()})
+
 @app.route('/memories/<int:mid>/download')
 def download_memory(mid):
-    conn = get_db(); m = conn.execute("SELECT * FROM memories WHERE id=?", (mid,)).fetchone(); conn.close()
+    conn = get_db(); m = conn.execute("SELECT * FROM memories WHERE id=?", (mid,)).fetchone()
     if not m: flash('Not found.','danger'); return redirect(url_for('memories'))
-    return send_from_directory(os.path.join(UPLOAD_FOLDER, 'memories'), m['image_path'], as_attachment=True)
+    path = m['image_path']
+    rel = path if is_blob(path) else f'memories/{path}'
+    return send_media(rel, f"memory_{mid}{os.path.splitext(path)[1]}" if is_blob(path) else path)
 
 # ── Profile ───────────────────────────────────────────────────────────────────
 @app.route('/profile')
 @login_required
 def profile():
-    conn = get_db()
-    u = conn.execute("SELECT * FROM users WHERE id=?", (session['user_id'],)).fetchone()
+    conn = get_db(); u = get_current_user()
     my_events = conn.execute("SELECT e.* FROM events e JOIN event_registrations r ON e.id=r.event_id WHERE r.user_id=?", (session['user_id'],)).fetchall()
     my_ach = conn.execute("SELECT * FROM achievements WHERE student_id=? ORDER BY date DESC", (session['user_id'],)).fetchall()
-    conn.close()
     return render_template('profile.html', u=u, my_events=my_events, my_ach=my_ach)
 
 @app.route('/profile/edit', methods=['GET','POST'])
 @login_required
 def edit_profile():
-    conn = get_db()
-    u = conn.execute("SELECT * FROM users WHERE id=?", (session['user_id'],)).fetchone()
+    conn = get_db(); u = get_current_user()
     depts = conn.execute("SELECT * FROM departments").fetchall()
-    conn.close()
     if request.method == 'POST':
         pp = request.files.get('profile_pic'); pname = u['profile_pic']
         if pp and allowed_file(pp.filename):
-            pname = f"pp_{session['user_id']}_{secure_filename(pp.filename)}"
-            pp.save(os.path.join(UPLOAD_FOLDER, 'profiles', pname))
-        conn = get_db()
+            pname = save_upload(pp, conn)
         conn.execute("UPDATE users SET full_name=?,phone=?,bio=?,department=?,year=?,profile_pic=? WHERE id=?",
                      (request.form['full_name'], request.form.get('phone',''), request.form.get('bio',''),
                       request.form.get('department',''), request.form.get('year',''), pname, session['user_id']))
-        conn.commit(); conn.close()
+        conn.commit(); invalidate_user(session['user_id'])
         session['full_name'] = request.form['full_name']
         flash('Profile updated!','success')
         return redirect(url_for('profile'))
@@ -791,10 +2505,18 @@ def edit_profile():
 @login_required
 @role_required('admin')
 def admin_users():
-    conn = get_db()
-    users = conn.execute("SELECT * FROM users ORDER BY role, full_name").fetchall()
-    conn.close()
-    return render_template('admin/users.html', users=users)
+    users, nxt = keyset_page(get_db(), "SELECT * FROM users WHERE 1=1", [], ADMIN_USER_KEYS, desc=False)
+    total = get_db().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    return render_template('admin/users.html', users=users, total=total, next_cursor=nxt)
+
+@app.route('/api/admin/users')
+@login_required
+@role_required('admin')
+def api_admin_users():
+    users, nxt = keyset_page(get_db(), "SELECT * FROM users WHERE 1=1", [], ADMIN_USER_KEYS, desc=False)
+    return page_json('admin/_user_rows.html', nxt, 'api_admin_users', users=users)
+
+ADMIN_USER_KEYS = [('role', 'role'), ('full_name', 'full_name'), ('id', 'id')]
 
 @app.route('/admin/users/<int:uid>/action', methods=['POST'])
 @login_required
@@ -807,7 +2529,7 @@ def admin_user_action(uid):
         if u: conn.execute("UPDATE users SET is_active=? WHERE id=?", (0 if u['is_active'] else 1, uid))
     elif action == 'role':
         conn.execute("UPDATE users SET role=? WHERE id=?", (request.form['role'], uid))
-    conn.commit(); conn.close()
+    conn.commit(); invalidate_user(uid); public_cache.invalidate('counts', 'departments')
     flash('User updated.','success')
     return redirect(url_for('admin_users'))
 
@@ -815,16 +2537,15 @@ def admin_user_action(uid):
 @login_required
 @role_required('admin')
 def admin_add_user():
-    conn = get_db(); depts = conn.execute("SELECT * FROM departments").fetchall(); conn.close()
+    conn = get_db(); depts = conn.execute("SELECT * FROM departments").fetchall()
     if request.method == 'POST':
-        conn = get_db()
-        conn.execute("INSERT INTO users (username,email,password,full_name,role,department,year,roll_number,phone) VALUES (?,?,?,?,?,?,?,?,?)",
+        cur = conn.execute("INSERT INTO users (username,email,password,full_name,role,department,year,roll_number,phone) VALUES (?,?,?,?,?,?,?,?,?)",
             (request.form['username'], request.form['email'],
              generate_password_hash(request.form['password']),
              request.form['full_name'], request.form['role'],
              request.form.get('department',''), request.form.get('year',''),
              request.form.get('roll_number',''), request.form.get('phone','')))
-        conn.commit(); conn.close()
+        conn.commit(); invalidate_user(cur.lastrowid); public_cache.invalidate('counts', 'departments')
         flash(f'{request.form["role"].title()} account created!','success')
         return redirect(url_for('admin_users'))
     return render_template('admin/add_user.html', depts=depts)
@@ -832,26 +2553,75 @@ def admin_add_user():
 # ── API ───────────────────────────────────────────────────────────────────────
 @app.route('/api/stats')
 def api_stats():
-    conn = get_db()
-    data = {k: conn.execute(q).fetchone()[0] for k,q in [
-        ('students',"SELECT COUNT(*) FROM users WHERE role='student'"),
-        ('events',"SELECT COUNT(*) FROM events"),
-        ('memories',"SELECT COUNT(*) FROM memories"),
-        ('departments',"SELECT COUNT(*) FROM departments"),
-    ]}
-    conn.close()
-    return jsonify(data)
+    return jsonify(site_counts())
+
+@app.route('/api/db/pool')
+@login_required
+@role_required('admin')
+def api_db_pool():
+    return jsonify(db_pool.stats())
+
+@app.route('/api/cache/stats')
+@login_required
+@role_required('admin')
+def api_cache_stats():
+    return jsonify(public_cache.stats())
 
 @app.route('/api/attendance/live/<token>')
 def api_attendance_live(token):
     conn = get_db()
     sess = conn.execute("SELECT * FROM attendance_sessions WHERE session_token=?", (token,)).fetchone()
-    if not sess: conn.close(); return jsonify({'error':'not found'}), 404
+    if not sess: return jsonify({'error':'not found'}), 404
     records = conn.execute("SELECT ar.student_name, ar.marked_at FROM attendance_records ar WHERE ar.session_id=? ORDER BY ar.marked_at DESC LIMIT 5", (sess['id'],)).fetchall()
-    count = conn.execute("SELECT COUNT(*) FROM attendance_records WHERE session_id=?", (sess['id'],)).fetchone()[0]
-    conn.close()
     expires = sess['expires_at']
-    return jsonify({'count': count, 'is_active': bool(sess['is_active']), 'expires_at': expires, 'recent': [dict(r) for r in records]})
+    return jsonify({'count': sess['present_count'], 'is_active': bool(sess['is_active']), 'expires_at': expires, 'recent': [dict(r) for r in records]})
+
+@app.route('/api/attendance/stream/<token>')
+@login_required
+@role_required('teacher','admin')
+def api_attendance_stream(token):
+    """Server-sent events: a ``state`` snapshot, then one ``mark`` per new record after the cursor."""
+    cursor = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+    sess, backlog = attendance_since(get_db(), token, cursor)
+    if not sess: return jsonify({'error':'not found'}), 404
+    resync = app.config['ATTENDANCE_STREAM_RESYNC']
+    q = attendance_broker.subscribe(token)
+
+    def expired(s):
+        return not s['is_active'] or (s['expires_at'] and datetime.fromisoformat(s['expires_at']) < datetime.now())
+
+    def stream(sess, rows, cursor):
+        count = sess['present_count']
+        try:
+            yield sse('state', {'count': count, 'is_active': not expired(sess)})
+            while True:
+                for i, r in enumerate(rows):
+                    if r['id'] <= cursor: continue
+                    cursor = r['id']
+                    yield sse('mark', dict(r, count=count - (len(rows) - 1 - i)), r['id'])
+                if expired(sess):
+                    yield sse('closed', {}); return
+                # Published events only wake the stream. The broker is per process, so marks committed by
+                # other workers (possibly with lower ids) arrive through the catch-up query, never past the cursor.
+                try: ev = q.get(timeout=resync); idle = False
+                except queue.Empty: ev = None; idle = True
+                closed = False
+                while ev is not None:  # coalesce a burst of marks into one query
+                    closed = closed or bool(ev.get('closed'))
+                    try: ev = q.get_nowait()
+                    except queue.Empty: ev = None
+                conn = db_pool.acquire()
+                try: sess, rows = attendance_since(conn, token, cursor)
+                finally: db_pool.release(conn)
+                if not sess: return
+                if closed: sess = dict(sess, is_active=0)
+                count = sess['present_count']
+                if idle: yield sse('state', {'count': count, 'is_active': not expired(sess)})  # doubles as the keep-alive
+        finally:
+            attendance_broker.unsubscribe(token, q)
+
+    return Response(stream(sess, backlog, cursor), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/achievements', methods=['GET'])
 def achievements():
@@ -863,39 +2633,592 @@ def achievements():
     q += " ORDER BY date DESC"
     achs = conn.execute(q, params).fetchall()
     depts = conn.execute("SELECT * FROM departments").fetchall()
-    conn.close()
     return render_template('achievements.html', achs=achs, depts=depts, dept_filter=df)
 
 @app.route('/achievements/add', methods=['GET','POST'])
 @login_required
 def add_achievement():
     if request.method == 'POST':
+        conn = get_db()
         cert = request.files.get('certificate'); cp = None
         if cert and allowed_file(cert.filename):
-            fn = f"cert_{uuid.uuid4().hex}_{secure_filename(cert.filename)}"
-            cert.save(os.path.join(UPLOAD_FOLDER, 'events', fn)); cp = fn
-        conn = get_db()
+            cp = save_upload(cert, conn)
         conn.execute("INSERT INTO achievements (student_id,student_name,title,description,achievement_type,date,certificate_image,department) VALUES (?,?,?,?,?,?,?,?)",
             (session['user_id'], session['full_name'], request.form['title'],
              request.form.get('description',''), request.form['achievement_type'],
              request.form.get('date',''), cp, request.form.get('department', session.get('department',''))))
-        conn.commit(); conn.close()
+        conn.commit()
         flash('Achievement submitted for approval!','success')
         return redirect(url_for('profile'))
     return render_template('add_achievement.html')
 
 @app.route('/departments')
 def departments():
+    depts = department_stats()
+    stats = {d['id']: {'students': d['students'], 'events': d['events']} for d in depts}
+    return render_template('departments.html', depts=depts, stats=stats)
+
+# ── Search ────────────────────────────────────────────────────────────────────
+# Per kind: ranked query over its FTS5 index (bm25 weights follow SEARCH_INDEXES
+# column order, title first) and the extra filter a role needs to see a row.
+HL = "highlight({t}_fts, 0, char(2), char(3)) AS title_hl, snippet({t}_fts, -1, char(2), char(3), '…', 16) AS snip"
+SEARCH_SQL = {
+    'events': "SELECT e.id, e.event_date AS date, e.event_type AS tag, " + HL.format(t='events') +
+              " FROM events_fts JOIN events e ON e.id=events_fts.rowid WHERE events_fts MATCH ?",
+    'notices': "SELECT n.id, n.created_at AS date, n.category AS tag, " + HL.format(t='notices') +
+               " FROM notices_fts JOIN notices n ON n.id=notices_fts.rowid WHERE notices_fts MATCH ?",
+    'memories': "SELECT m.id, m.created_at AS date, m.album AS tag, m.image_path, m.variants, " + HL.format(t='memories') +
+                " FROM memories_fts JOIN memories m ON m.id=memories_fts.rowid WHERE memories_fts MATCH ?",
+    'achievements': "SELECT a.id, a.date, a.department AS tag, " + HL.format(t='achievements') +
+                    " FROM achievements_fts JOIN achievements a ON a.id=achievements_fts.rowid WHERE achievements_fts MATCH ? AND a.approved=1",
+}
+SEARCH_RANK = {'events': 'bm25(events_fts, 10, 1, 2, 3)', 'notices': 'bm25(notices_fts, 10, 1, 2)',
+               'memories': 'bm25(memories_fts, 10, 1, 3)', 'achievements': 'bm25(achievements_fts, 10, 1, 2, 3)'}
+
+def fts_query(q):
+    """Free text -> FTS5 query: every word must match, each as a prefix. '' when nothing is searchable."""
+    return ' '.join(f'"{w}"*' for w in re.findall(r'\w+', q or '')[:8])
+
+def marked(s):
+    """Escape FTS highlight output, then turn its char(2)/char(3) markers into <mark>."""
+    return Markup(str(escape(s or '')).replace('\x02', '<mark>').replace('\x03', '</mark>'))
+
+def result_url(kind, r):
+    if kind == 'events': return url_for('event_detail', eid=r['id'])
+    if kind == 'notices': return url_for('notices', cat=r['tag']) + f"#notice-{r['id']}"
+    if kind == 'memories': return variant_url('memories', r['image_path'], r['variants'])
+    return url_for('achievements', dept=r['tag'])
+
+def search(q, kinds=None, limit=10):
+    """Best ``limit`` matches per kind as {kind: [{id, title, snippet, date, tag, url}]}, skipping kinds the user cannot see."""
+    match = fts_query(q)
+    if not match: return {}
+    conn = get_db(); out = {}
+    for kind in kinds or SEARCH_SQL:
+        if kind not in SEARCH_SQL: continue
+        sql, params = SEARCH_SQL[kind], [match]
+        if kind == 'notices':
+            if 'user_id' not in session: continue
+            if session.get('role') == 'student':
+                sql += " AND (n.department='All' OR n.department=?) AND (n.year='All' OR n.year=?)"
+                params += [session.get('department',''), session.get('year','')]
+        rows = conn.execute(f"{sql} ORDER BY {SEARCH_RANK[kind]} LIMIT ?", params + [limit]).fetchall()
+        out[kind] = [{'id': r['id'], 'title': marked(r['title_hl']), 'snippet': marked(r['snip']), 'date': r['date'],
+                      'tag': r['tag'], 'url': result_url(kind, r)} for r in rows]
+    return out
+
+@app.route('/search')
+def search_page():
+    q = request.args.get('q','').strip(); kind = request.args.get('type','')
+    results = search(q, [kind] if kind else None, limit=25 if kind else 8)
+    return render_template('search.html', q=q, kind=kind, results=results)
+
+@app.route('/api/search')
+def api_search():
+    kinds = [k for k in request.args.get('type','').split(',') if k] or None
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    results = search(request.args.get('q',''), kinds, limit)
+    return jsonify({k: [{**r, 'title': str(r['title']), 'snippet': str(r['snippet'])} for r in rows] for k, rows in results.items()})
+
+# ── Bulk import ───────────────────────────────────────────────────────────────
+YEARS = ('FE', 'SE', 'TE', 'BE')
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday')
+
+def read_table(path, filename):
+    """(columns, rows) for a CSV or XLSX file; rows yields (line, {column: text}) lazily, skipping blank lines.
+
+    Column names are normalised to snake_case ("Roll Number" -> roll_number).
+    """
+    norm = lambda h: re.sub(r'\W+', '_', str(h or '').strip().lower()).strip('_')
+    text = lambda v: '' if v is None else (str(int(v)) if isinstance(v, float) and v.is_integer() else str(v).strip())
+    if filename.lower().endswith('.xlsx'):
+        try: import openpyxl
+        except ImportError: raise ValueError('XLSX import needs openpyxl installed; upload a CSV instead.')
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        it = wb.active.iter_rows(values_only=True); head = [norm(h) for h in next(it, ())]
+        def rows():
+            try:
+                for i, r in enumerate(it, 2):
+                    if any(v not in (None, '') for v in r): yield i, {h: text(v) for h, v in zip(head, r) if h}
+            finally: wb.close()
+        return head, rows()
+    fh = open(path, newline='', encoding='utf-8-sig'); rd = csv.reader(fh); head = [norm(h) for h in next(rd, [])]
+    def rows():
+        with fh:
+            for r in rd:
+                if any(v.strip() for v in r): yield rd.line_num, {h: v.strip() for h, v in zip(head, r) if h}
+    return head, rows()
+
+class BulkImport:
+    """One import kind: required columns, per-row validation and the chunk insert.
+
+    check() turns a row into insert parameters or raises ValueError with the
+    message for the error report; write() runs inside the chunk's transaction.
+    """
+    required = ()
+    hashes = False  # True when check() leaves plain passwords for the process pool
+
+    def __init__(self, conn, default_password=None):
+        self.conn = conn; self.default_password = default_password
+        self.depts = {}
+        for d in conn.execute("SELECT name, code FROM departments"): self.depts[d['name'].lower()] = self.depts[d['code'].lower()] = d['name']
+
+    def dept(self, v):
+        if v.lower() not in self.depts: raise ValueError(f'unknown department {v!r}')
+        return self.depts[v.lower()]
+
+    def year(self, v):
+        if v.upper() not in YEARS: raise ValueError(f'year must be one of {", ".join(YEARS)}')
+        return v.upper()
+
+    def write(self, batch):
+        return self.conn.executemany(self.sql, batch).rowcount
+
+    def done(self): pass
+
+class StudentImport(BulkImport):
+    required = ('full_name', 'email', 'department', 'year')
+    hashes = True
+    sql = "INSERT INTO users (username,email,password,full_name,role,department,year,semester,roll_number,phone) VALUES (?,?,?,?,'student',?,?,?,?,?)"
+
+    def __init__(self, conn, default_password=None):
+        super().__init__(conn, default_password)
+        self.emails = set(); self.usernames = set()
+        for r in conn.execute("SELECT lower(email), lower(username) FROM users"): self.emails.add(r[0]); self.usernames.add(r[1])
+
+    def check(self, r):
+        email = r['email'].lower(); username = (r.get('username') or email.split('@')[0]).lower()
+        if not re.match(r'^[^@\s]+@[^@\s]+\.[^@\s]+$', email): raise ValueError(f'invalid email {email!r}')
+        if email in self.emails: raise ValueError(f'email {email} already exists')
+        if username in self.usernames: raise ValueError(f'username {username} already exists')
+        pw = r.get('password') or self.default_password
+        if not pw or len(pw) < 6: raise ValueError('password missing or shorter than 6 characters')
+        params = (username, email, pw, r['full_name'], self.dept(r['department']), self.year(r['year']),
+                  r.get('semester',''), r.get('roll_number',''), r.get('phone',''))
+        self.emails.add(email); self.usernames.add(username)
+        return params
+
+    def done(self): public_cache.invalidate('counts', 'departments')
+
+class TimetableImport(BulkImport):
+    required = ('department', 'year', 'semester', 'day', 'period', 'subject')
+    sql = "INSERT INTO timetable (department,year,semester,day,period,subject,teacher_id,teacher_name,room,time_from,time_to,created_by) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)"
+
+    def __init__(self, conn, default_password=None, created_by=None):
+        super().__init__(conn, default_password); self.created_by = created_by
+        self.teachers = {}; self.booked = {}
+        for t in conn.execute("SELECT id, full_name, email FROM users WHERE role='teacher'"):
+            self.teachers[t['email'].lower()] = self.teachers[t['full_name'].lower()] = (t['id'], t['full_name'])
+
+    def check(self, r):
+        day = r['day'].title()
+        if day not in DAYS: raise ValueError(f'unknown day {r["day"]!r}')
+        if not r['period'].isdigit(): raise ValueError('period must be a number')
+        tid, tname = None, r.get('teacher_name') or None
+        who = (r.get('teacher_email') or r.get('teacher') or '').lower()
+        if who:
+            if who not in self.teachers: raise ValueError(f'unknown teacher {who!r}')
+            tid, tname = self.teachers[who]
+        start, end = hhmm(r.get('time_from')), hhmm(r.get('time_to'))
+        if (start is None) != (end is None): raise ValueError('give both time_from and time_to, or neither')
+        if start is not None and end <= start: raise ValueError('time_to must be after time_from')
+        row = {'id': None, 'department': self.dept(r['department']), 'year': self.year(r['year']), 'semester': r['semester'], 'day': day, 'period': int(r['period']),
+               'subject': r['subject'], 'teacher_id': tid, 'teacher_name': tname, 'room': r.get('room') or None,
+               'time_from': r.get('time_from','')[:5], 'time_to': r.get('time_to','')[:5]}
+        # Earlier rows of this file go into a local overlay, not the shared index: until they commit
+        # (or ever, on a dry run) they must not make other requests see a clash.
+        args = (day, row['period'], start, end, row['room'], tid, row['semester'])
+        hit = timetable_cache.clash(self.conn, *args) or TimetableCache.find(self.booked, *args)
+        if hit:
+            kind, o = hit
+            raise ValueError(f"{'room ' + o['room'] if kind == 'room' else o['teacher_name'] or 'teacher'} already booked "
+                             f"{o['day']} {o['time_from'] or 'period ' + str(o['period'])} ({o['subject']}, {o['department']} {o['year']})")
+        TimetableCache.add(self.booked, row)
+        return (row['department'], row['year'], row['semester'], day, row['period'], row['subject'], tid, tname, row['room'],
+                row['time_from'], row['time_to'], self.created_by)
+
+    def done(self): timetable_cache.invalidate()
+
+class AttendanceImport(BulkImport):
+    """Historical attendance: one row per student present; sessions are matched or created closed."""
+    required = ('date', 'subject', 'department', 'year', 'teacher_email')
+
+    def __init__(self, conn, default_password=None):
+        super().__init__(conn, default_password)
+        self.teachers = {t['email'].lower(): t['id'] for t in conn.execute("SELECT id, email FROM users WHERE role='teacher'")}
+        self.students = {}; self.class_size = {}
+        for u in conn.execute("SELECT id, full_name, email, roll_number, department, year FROM users WHERE role='student'"):
+            self.students[u['email'].lower()] = self.students[(u['department'], u['year'], (u['roll_number'] or '').lower())] = dict(u)
+            self.class_size[(u['department'], u['year'])] = self.class_size.get((u['department'], u['year']), 0) + 1
+        self.sessions = {}; self.seen = set()
+
+    def check(self, r):
+        try: day = date.fromisoformat(r['date'][:10]).isoformat()
+        except ValueError: raise ValueError(f'invalid date {r["date"]!r} (use YYYY-MM-DD)')
+        dept, year = self.dept(r['department']), self.year(r['year'])
+        tid = self.teachers.get(r['teacher_email'].lower())
+        if not tid: raise ValueError(f'unknown teacher {r["teacher_email"]!r}')
+        if not (r.get('email') or r.get('roll_number')): raise ValueError('needs an email or roll_number')
+        who = r.get('email','').lower() or (dept, year, r['roll_number'].lower())
+        st = self.students.get(who)
+        if not st: raise ValueError('no student with that email' if r.get('email') else 'no student with that roll_number in this class')
+        key = (tid, dept, year, r['subject'], day, r.get('time_from','')[:5])
+        if (key, st['id']) in self.seen: raise ValueError('duplicate row')
+        self.seen.add((key, st['id']))
+        marked = r.get('marked_at') or f"{day} {r.get('time_from') or '00:00'}:00"[:19]
+        return (key, st['id'], st['full_name'], st['roll_number'], st['department'], st['year'], marked)
+
+    def session_id(self, key):
+        if key not in self.sessions:
+            tid, dept, year, subject, day, tf = key
+            row = self.conn.execute("SELECT id FROM attendance_sessions WHERE teacher_id=? AND department=? AND year=? AND subject=? AND date=? AND IFNULL(time_from,'')=?",
+                                    key).fetchone()
+            self.sessions[key] = row[0] if row else self.conn.execute(
+                "INSERT INTO attendance_sessions (teacher_id,department,year,subject,session_token,date,time_from,is_active,expires_at,total_students) VALUES (?,?,?,?,?,?,?,0,?,?)",
+                (tid, dept, year, subject, 'IMPORT-' + uuid.uuid4().hex, day, tf or None, day, self.class_size.get((dept, year), 0))).lastrowid
+        return self.sessions[key]
+
+    def write(self, batch):
+        return self.conn.executemany("INSERT OR IGNORE INTO attendance_records (session_id,student_id,student_name,roll_number,department,year,marked_at,method) VALUES (?,?,?,?,?,?,?,'import')",
+                                     [(self.session_id(k), *rest) for k, *rest in batch]).rowcount
+
+IMPORTERS = {'students': StudentImport, 'timetable': TimetableImport, 'attendance': AttendanceImport}
+
+def run_import(conn, kind, path, filename, default_password=None, dry_run=False, progress=None, created_by=None):
+    """Validate ``path`` row by row and insert the valid rows IMPORT_CHUNK_SIZE at a time.
+
+    Each chunk is its own transaction, so a large file commits as it goes and a
+    bad row never blocks the good ones. Returns {total, inserted, skipped, failed, errors}
+    where errors lists (line, message) and skipped counts rows already present.
+    """
+    cls = IMPORTERS[kind]
+    imp = cls(conn, default_password, created_by) if cls is TimetableImport else cls(conn, default_password)
+    cols, rows = read_table(path, filename)
+    missing = [c for c in cls.required if c not in cols]
+    if missing: raise ValueError(f"missing column(s): {', '.join(missing)}")
+    res = {'total': 0, 'inserted': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+    size, max_err = app.config['IMPORT_CHUNK_SIZE'], app.config['IMPORT_MAX_ERRORS']
+    pool = ProcessPoolExecutor(app.config['IMPORT_HASH_WORKERS']) if cls.hashes and not dry_run else None
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, size))
+            if not chunk: break
+            batch = []
+            for line, r in chunk:
+                res['total'] += 1
+                try:
+                    blank = [c for c in cls.required if not r.get(c)]
+                    if blank: raise ValueError(f"empty {', '.join(blank)}")
+                    batch.append(imp.check(r))
+                except ValueError as e:
+                    res['failed'] += 1
+                    if len(res['errors']) < max_err: res['errors'].append((line, str(e)))
+            if batch and not dry_run:
+                if pool:  # password is the third parameter of StudentImport rows
+                    hashed = pool.map(generate_password_hash, [b[2] for b in batch], chunksize=max(1, len(batch) // (4 * app.config['IMPORT_HASH_WORKERS'])))
+                    batch = [b[:2] + (h,) + b[3:] for b, h in zip(batch, hashed)]
+                conn.execute("BEGIN IMMEDIATE")
+                try: n = imp.write(batch); conn.commit()
+                except Exception: conn.rollback(); raise
+                res['inserted'] += n; res['skipped'] += len(batch) - n
+            elif dry_run: res['inserted'] += len(batch)
+            if progress: progress(res)
+    finally:
+        if pool: pool.shutdown()
+        rows.close(); imp.done()
+    return res
+
+def import_job(jid, kind, path, filename, default_password, created_by):
+    """Background body of an /admin/import upload; progress and the report go to import_jobs."""
+    with app.app_context():
+        conn = get_db()
+        def progress(res, status='running'):
+            conn.execute("UPDATE import_jobs SET status=?, total=?, inserted=?, skipped=?, failed=?, errors=? WHERE id=?",
+                         (status, res['total'], res['inserted'], res['skipped'], res['failed'], json.dumps(res['errors']), jid))
+            conn.commit()
+        try:
+            progress(run_import(conn, kind, path, filename, default_password, progress=progress, created_by=created_by), 'done')
+        except Exception as e:
+            if conn.in_transaction: conn.rollback()
+            conn.execute("UPDATE import_jobs SET status='failed', errors=? WHERE id=?", (json.dumps([[0, str(e)]]), jid)); conn.commit()
+        finally:
+            conn.execute("UPDATE import_jobs SET finished_at=datetime('now') WHERE id=?", (jid,)); conn.commit()
+            if os.path.exists(path): os.unlink(path)
+
+@app.route('/admin/import', methods=['GET','POST'])
+@login_required
+@role_required('admin')
+def admin_import():
     conn = get_db()
-    depts = conn.execute("SELECT * FROM departments").fetchall()
-    stats = {}
-    for d in depts:
-        stats[d['id']] = {
-            'students': conn.execute("SELECT COUNT(*) FROM users WHERE department=? AND role='student'", (d['name'],)).fetchone()[0],
-            'events': conn.execute("SELECT COUNT(*) FROM events WHERE department=? OR department='All'", (d['name'],)).fetchone()[0],
-        }
+    if request.method == 'POST':
+        f = request.files.get('file'); kind = request.form.get('kind')
+        ext = os.path.splitext(f.filename)[1].lower() if f and f.filename else ''
+        if kind not in IMPORTERS or ext not in ('.csv', '.xlsx'):
+            flash('Choose what to import and a .csv or .xlsx file.','danger'); return redirect(url_for('admin_import'))
+        path = os.path.join(incoming_dir(), f'import-{uuid.uuid4().hex}{ext}'); f.save(path)
+        jid = conn.execute("INSERT INTO import_jobs (kind, filename, created_by) VALUES (?,?,?)", (kind, f.filename, session['user_id'])).lastrowid
+        conn.commit()
+        worker_pool('import').submit(import_job, jid, kind, path, f.filename, request.form.get('default_password') or None, session['user_id'])
+        return redirect(url_for('admin_import_job', jid=jid))
+    jobs = conn.execute("SELECT id, kind, filename, status, total, inserted, failed, created_at FROM import_jobs ORDER BY id DESC LIMIT 20").fetchall()
+    return render_template('admin/import.html', jobs=jobs, importers=IMPORTERS)
+
+@app.route('/admin/import/<int:jid>')
+@login_required
+@role_required('admin')
+def admin_import_job(jid):
+    job = get_db().execute("SELECT * FROM import_jobs WHERE id=?", (jid,)).fetchone()
+    if not job: abort(404)
+    if request.args.get('format') == 'json':
+        return jsonify({k: job[k] for k in ('status', 'total', 'inserted', 'skipped', 'failed')})
+    return render_template('admin/import_job.html', job=job, errors=json.loads(job['errors'] or '[]'))
+
+@app.route('/admin/import/<int:jid>/errors.csv')
+@login_required
+@role_required('admin')
+def admin_import_errors(jid):
+    job = get_db().execute("SELECT errors FROM import_jobs WHERE id=?", (jid,)).fetchone()
+    if not job: abort(404)
+    out = io.StringIO(); w = csv.writer(out); w.writerow(['line', 'error']); w.writerows(json.loads(job['errors'] or '[]'))
+    return Response(out.getvalue(), mimetype='text/csv', headers={'Content-Disposition': f'attachment; filename=import-{jid}-errors.csv'})
+
+# ── Background jobs ───────────────────────────────────────────────────────────
+class Scheduler:
+    """Periodic maintenance jobs run by a daemon thread in every worker process.
+
+    Each job's scheduler_jobs row doubles as its lease: a process only runs a job
+    after an UPDATE claims the row while it is due and unleased, so with several
+    workers every run still happens once. A crashed run's lease lapses after
+    SCHEDULER_LEASE seconds. Intervals come from app.config['SCHEDULE'].
+    """
+    def __init__(self):
+        self.jobs = {}; self._lock = threading.Lock(); self._pid = None; self.owner = None
+
+    def job(self, name):
+        def register(fn): self.jobs[name] = fn; return fn
+        return register
+
+    def start(self):
+        if self._pid == os.getpid(): return
+        with self._lock:
+            if self._pid != os.getpid():  # first request, or first request after a fork
+                self.owner = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+                threading.Thread(target=self._run, name='scheduler', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(app.config['SCHEDULER_TICK'] * random.uniform(0.5, 1.5))  # jitter spreads the workers' claims
+            conn = connect_db()
+            try: self.run_due(conn)
+            except sqlite3.Error as e: app.logger.warning("scheduler tick failed: %s", e)
+            finally: conn.close()
+
+    def run_due(self, conn, force=False, only=None):
+        """Claim and run every due job (all of ``only`` when forced); returns {name: result} for those run here."""
+        owner = self.owner or f'{os.getpid()}-cli'; ran = {}
+        for name, fn in self.jobs.items():
+            every = app.config['SCHEDULE'].get(name)
+            if (only and name not in only) or not (every or force): continue
+            now = time.time()
+            conn.execute("INSERT OR IGNORE INTO scheduler_jobs (name) VALUES (?)", (name,))
+            claimed = conn.execute("UPDATE scheduler_jobs SET lease_owner=?, lease_until=? WHERE name=? AND lease_until<? AND last_run<=?",
+                                   (owner, now + app.config['SCHEDULER_LEASE'], name, now, now - (0 if force else every))).rowcount
+            conn.commit()
+            if not claimed: continue
+            t = time.perf_counter()
+            try: result, status = fn(conn), 'ok'
+            except Exception as e:
+                if conn.in_transaction: conn.rollback()
+                app.logger.exception("job %s failed", name); result, status = f'{type(e).__name__}: {e}', 'error'
+            conn.execute("""UPDATE scheduler_jobs SET last_run=?, lease_until=0, runs=runs+1, last_status=?, last_result=?, last_duration=?
+                WHERE name=? AND lease_owner=?""", (time.time(), status, str(result), round(time.perf_counter() - t, 3), name, owner))
+            conn.commit(); ran[name] = result
+        return ran
+
+scheduler = Scheduler()
+
+@app.before_request
+def start_scheduler():
+    if app.config['SCHEDULER_ENABLED'] and not app.testing: scheduler.start()
+
+@scheduler.job('expire-sessions')
+def expire_sessions(conn):
+    """Close attendance sessions past expires_at instead of waiting for the next scan to notice."""
+    now = datetime.now().isoformat()
+    rows = conn.execute("SELECT id, session_token FROM attendance_sessions WHERE is_active=1 AND expires_at<?", (now,)).fetchall()
+    if rows:
+        conn.executemany("UPDATE attendance_sessions SET is_active=0 WHERE id=? AND is_active=1", [(r['id'],) for r in rows]); conn.commit()
+        for r in rows:
+            _active_sessions.pop(r['session_token'], None); attendance_broker.publish(r['session_token'], {'closed': True})
+    return f'{len(rows)} sessions closed'
+
+@scheduler.job('event-status')
+def complete_events(conn):
+    """Move upcoming events whose date has passed to completed."""
+    n = conn.execute("UPDATE events SET status='completed' WHERE status='upcoming' AND event_date<?", (date.today().isoformat(),)).rowcount
+    conn.commit()
+    if n: public_cache.invalidate('home', 'counts')
+    return f'{n} events completed'
+
+@scheduler.job('prune-uploads')
+def prune_uploads(conn):
+    """Drop abandoned spooled/resumable upload parts, then unreferenced blobs."""
+    grace = app.config['UPLOAD_ORPHAN_GRACE']; cutoff = time.time() - grace; parts = 0
+    for e in os.scandir(incoming_dir()):
+        if e.is_file() and e.stat().st_mtime < cutoff:
+            try: os.unlink(e.path); parts += 1
+            except FileNotFoundError: pass
+    blobs, freed = collect_blobs(conn, grace)
+    return f'{parts} parts, {blobs} blobs ({freed} bytes) removed'
+
+@scheduler.job('optimize')
+def optimize_db(conn):
+    conn.execute("PRAGMA optimize")
+    return 'ok'
+
+@app.route('/api/scheduler')
+@login_required
+@role_required('admin')
+def api_scheduler():
+    rows = get_db().execute("SELECT * FROM scheduler_jobs ORDER BY name").fetchall()
+    return jsonify({r['name']: {**dict(r), 'every': app.config['SCHEDULE'].get(r['name'])} for r in rows})
+
+# ── Serving ───────────────────────────────────────────────────────────────────
+class WorkerRequestHandler(WSGIRequestHandler):
+    """Closes connections idle (keep-alive or a stalled read) for SERVER_TIMEOUT seconds."""
+    def setup(self):
+        self.timeout = app.config['SERVER_TIMEOUT']; super().setup()
+
+    def log_request(self, *args, **kw):
+        if app.config['SERVER_ACCESS_LOG']: super().log_request(*args, **kw)
+
+class WorkerWSGIServer(ThreadedWSGIServer):
+    """One worker process's server: a thread per connection, at most SERVER_THREADS at once.
+
+    The listening socket is shared with the sibling workers and non-blocking, so
+    the worker that loses an accept race just goes back to waiting, and a worker
+    with every slot busy stops accepting and leaves new connections to the others.
+    """
+    multiprocess = True
+    request_queue_size = 1024
+
+    def process_request(self, request, client_address):
+        self.slots.acquire(); super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try: super().process_request_thread(request, client_address)
+        finally: self.slots.release()
+
+def serve(host='0.0.0.0', port=5000, workers=None, threads=None):
+    """Production server: bind once, fork ``workers`` processes sharing the socket, respawn any that die.
+
+    Call init_db() first; it must run once in the parent, not per worker. Every
+    per-process resource (connection pool, write batcher, scheduler, thread pools)
+    is created lazily after the fork. SIGTERM/SIGINT drain in-flight requests.
+    """
+    workers = workers or app.config['SERVER_WORKERS']; threads = threads or app.config['SERVER_THREADS']
+    if app.config['METRICS_ENABLED'] and not app.config['METRICS_DIR']:
+        app.config['METRICS_DIR'] = tempfile.mkdtemp(prefix='cc-metrics-')  # lets /metrics sum up every worker
+    srv = WorkerWSGIServer(host, port, app, handler=WorkerRequestHandler)
+    srv.socket.setblocking(False); srv.slots = threading.BoundedSemaphore(threads)
+    if not hasattr(os, 'fork'):  # Windows: one threaded process
+        srv.multiprocess = False; srv.serve_forever(); return
+
+    def run_worker():
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent turns Ctrl-C into SIGTERM
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=srv.shutdown).start())
+        try: srv.serve_forever(poll_interval=0.5)
+        finally:
+            for _ in range(threads): srv.slots.acquire(timeout=app.config['SERVER_TIMEOUT'])  # let running requests finish
+            like_buffer.close()
+            os._exit(0)
+
+    children, stopping = set(), False
+    def spawn():
+        pid = os.fork()
+        if pid == 0: run_worker()
+        children.add(pid)
+    def stop(*_):
+        nonlocal stopping; stopping = True
+        for pid in children: os.kill(pid, signal.SIGTERM)
+    signal.signal(signal.SIGTERM, stop); signal.signal(signal.SIGINT, stop)
+    for _ in range(workers): spawn()
+    while children:
+        pid, status = os.wait()
+        children.discard(pid)
+        if not stopping:
+            app.logger.warning("worker %d exited (status %d); restarting", pid, status); time.sleep(0.1); spawn()
+    srv.server_close()
+
+# ── CLI ───────────────────────────────────────────────────────────────────────
+@app.cli.command('repair-counters')
+def repair_counters():
+    """Recompute registration, attendance and like counters and the attendance rollup from source rows."""
+    conn = connect_db()
+    conn.executescript(f"BEGIN; {REPAIR_COUNTERS_SQL} {ROLLUP_REBUILD_SQL} COMMIT;")
     conn.close()
-    return render_template('departments.html', depts=depts, stats=stats)
+    print('Counters repaired.')
+
+@app.cli.command('gc-blobs')
+@click.option('--grace', default=3600, show_default=True, help='Seconds an unreferenced blob is kept.')
+@click.option('--dry-run', is_flag=True, help='Report what would be removed without deleting.')
+def gc_blobs(grace, dry_run):
+    """Delete stored blobs that no memory, event, achievement or profile references."""
+    conn = connect_db()
+    removed, freed = collect_blobs(conn, grace, dry_run)
+    conn.close()
+    print(f"{'Would remove' if dry_run else 'Removed'} {removed} blob(s), {freed / 1048576:.1f} MB.")
+
+@app.cli.command('run-jobs')
+@click.argument('names', nargs=-1, type=click.Choice(sorted(scheduler.jobs)))
+@click.option('--force', is_flag=True, help='Run the named (or all) jobs now, even if not due.')
+def run_jobs(names, force):
+    """Run due background jobs once, e.g. from cron when SCHEDULER_ENABLED is off."""
+    conn = connect_db()
+    ran = scheduler.run_due(conn, force, names)
+    conn.close()
+    for name, result in ran.items(): print(f'{name}: {result}')
+    if not ran: print('Nothing due (or leased by a running worker).')
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--default-password', help='Password for student rows without a password column.')
+@click.option('--dry-run', is_flag=True, help='Validate every row without inserting anything.')
+@click.option('--report', type=click.Path(dir_okay=False), help='Write the per-row error report to this CSV.')
+def import_data(kind, path, default_password, dry_run, report):
+    """Bulk-import students, timetable entries or historical attendance from a CSV/XLSX file."""
+    with app.app_context():
+        t = time.perf_counter()
+        progress = lambda r: click.echo(f"\r{r['total']} rows, {r['inserted']} {'valid' if dry_run else 'inserted'}, {r['failed']} failed", nl=False)
+        try: res = run_import(get_db(), kind, path, os.path.basename(path), default_password, dry_run, progress)
+        except ValueError as e: raise click.ClickException(str(e))
+    click.echo(f"\n{res['skipped']} already present, {time.perf_counter() - t:.1f}s.")
+    if report:
+        with open(report, 'w', newline='') as fh: w = csv.writer(fh); w.writerow(['line', 'error']); w.writerows(res['errors'])
+    else:
+        for line, msg in res['errors'][:20]: click.echo(f'  line {line}: {msg}')
+        if res['failed'] > 20: click.echo(f"  ... {res['failed'] - 20} more (use --report)")
+
+@app.cli.command('build-assets')
+@click.option('--from', 'mirror', type=click.Path(exists=True, file_okay=False), help='Take vendor files from this directory (by file name) instead of the CDN.')
+def build_assets_command(mirror):
+    """Vendor, fingerprint and precompress the CSS/JS bundles into static/dist/."""
+    try: manifest = build_assets(mirror)
+    except (OSError, ValueError) as e: raise click.ClickException(f'Asset build failed: {e}')
+    for name, fname in manifest['assets'].items(): click.echo(f'{name:<16} {fname}')
+    click.echo(f"{len(manifest['files'])} file(s) in {app.config['ASSET_DIR']}.")
+
+@app.cli.command('build-variants')
+def build_variants():
+    """Generate missing image variants for existing memories and event banners."""
+    conn = connect_db()
+    jobs = [('memories', r['image_path'], MEMORY_VARIANTS_SQL, r['id']) for r in conn.execute("SELECT id, image_path FROM memories WHERE variants IS NULL")]
+    jobs += [('events', r['banner_image'], BANNER_VARIANTS_SQL, r['id']) for r in conn.execute("SELECT id, banner_image FROM events WHERE banner_image IS NOT NULL AND banner_variants IS NULL")]
+    conn.close()
+    for f in [queue_variants(*j) for j in jobs]: f.result()
+    print(f'{len(jobs)} image(s) processed.')
 
 if __name__ == '__main__':
     for d in ['events','memories','profiles','qr']:
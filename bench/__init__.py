@@ -0,0 +1 @@
+"""Performance benchmarks for CampusConnect. Run modules with ``python -m bench.<name>``."""
@@ -0,0 +1,126 @@
+"""Deterministic synthetic campus for benchmarks.
+
+Fills a freshly initialised database with 6 departments x 4 years x N
+students, M semesters of closed attendance sessions with their records, and
+events, registrations, memories and notices in the thousands. The same seed and
+scale always produce the same rows, so runs on different commits compare.
+
+    python -m bench.datagen DB_PATH [--scale small|campus] [--students N] [--semesters M] ...
+"""
+import argparse, random, sys
+from datetime import date, timedelta
+
+import app as cc
+
+DEPTS = ['Computer Engineering', 'Information Technology', 'Electronics & Telecommunication',
+         'Mechanical Engineering', 'Civil Engineering', 'AIDS (AI & Data Science)']
+YEARS = ['FE', 'SE', 'TE', 'BE']
+SUBJECTS = ['Mathematics', 'Data Structures', 'Operating Systems', 'Networks', 'Databases', 'Thermodynamics',
+            'Surveying', 'Signals', 'Machine Learning', 'Compilers', 'Physics', 'Ethics']
+EVENT_TYPES = ['technical', 'cultural', 'workshop', 'sports', 'seminar']
+ALBUMS = ['Fest', 'Cultural Night', 'Sports Day', 'Workshops', 'Convocation', None]
+# Words titles and descriptions are drawn from; the search scenario queries the same list.
+WORDS = ['hackathon', 'robotics', 'dance', 'music', 'python', 'cloud', 'drama', 'football', 'quiz', 'startup',
+         'design', 'security', 'photography', 'debate', 'chess', 'marathon', 'poetry', 'electronics', 'bridge', 'ai']
+ANCHOR = date(2025, 7, 1)  # first day of the latest generated semester
+WEEKS = 16                 # teaching weeks per semester
+TEACHER_ID, ORGANIZER_ID = 2, 3  # seeded by init_db; the Computer Engineering teacher keeps its id
+PASSWORD = 'bench@123'     # every generated account
+
+SCALES = {
+    'small':  dict(students=20, semesters=1, lectures=1, events=300, registrations=3000, memories=1000, notices=100),
+    'campus': dict(students=60, semesters=2, lectures=2, events=3000, registrations=30000, memories=10000, notices=1000),
+}
+
+
+def generate(conn, students=20, semesters=1, lectures=1, events=300, registrations=3000, memories=1000, notices=100, seed=42):
+    """Insert the synthetic campus into conn (after init_db) and return row counts per table.
+
+    students is per class (department and year); lectures is per subject per week.
+    """
+    rnd = random.Random(seed)
+    # Hash once with few rounds: accounts stay usable for /login without seconds of PBKDF2 per insert.
+    pw = cc.generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+    words = lambda n: ' '.join(rnd.choice(WORDS) for _ in range(n))
+
+    users = [(f'teacher_{d}', f'teacher{d}@bench.in', pw, f'Prof. Bench {d}', 'teacher', DEPTS[d], None, None) for d in range(1, 6)]
+    users += [(f'organizer_{i}', f'organizer{i}@bench.in', pw, f'Organizer {i}', 'organizer', DEPTS[i % 6], None, None) for i in range(4)]
+    users += [(f's{d}{y}{i:04d}', f's{d}{y}{i:04d}@bench.in', pw, f'Student {d}{y}{i:04d}', 'student', DEPTS[d], YEARS[y], f'{d}{y}{i:04d}')
+              for d in range(6) for y in range(4) for i in range(students)]
+    conn.executemany("INSERT INTO users (username,email,password,full_name,role,department,year,roll_number) VALUES (?,?,?,?,?,?,?,?)", users)
+    teachers = {DEPTS[0]: TEACHER_ID, **{dept: uid for uid, dept in conn.execute("SELECT id, department FROM users WHERE email LIKE 'teacher_%@bench.in'")}}
+    organizers = [ORGANIZER_ID] + [r[0] for r in conn.execute("SELECT id FROM users WHERE role='organizer' AND email LIKE '%@bench.in'")]
+    roster = {}
+    for uid, name, roll, dept, year in conn.execute("SELECT id, full_name, roll_number, department, year FROM users WHERE role='student' ORDER BY id"):
+        roster.setdefault((dept, year), []).append((uid, name, roll, rnd.uniform(0.55, 0.98)))  # each student's attendance habit
+
+    # Semesters run back from ANCHOR; every class has six subjects with `lectures` sessions a week each.
+    sessions = []
+    for sem in range(semesters):
+        start = ANCHOR - timedelta(weeks=26 * (semesters - 1 - sem))
+        for (dept, year), members in roster.items():
+            subjects = rnd.sample(SUBJECTS, 6)
+            for week in range(WEEKS):
+                for k, subject in enumerate(subjects):
+                    for lec in range(lectures):
+                        day = start + timedelta(weeks=week, days=(k + 3 * lec) % 6)
+                        sessions.append((teachers[dept], dept, year, subject, f'Room {k + 101}', f'G{len(sessions):07d}', day.isoformat(),
+                                         f'{9 + k}:00', f'{10 + k}:00', 0, len(members)))
+    conn.executemany("INSERT INTO attendance_sessions (teacher_id,department,year,subject,room,session_token,date,time_from,time_to,is_active,total_students) "
+                     "VALUES (?,?,?,?,?,?,?,?,?,?,?)", sessions)
+
+    def records():
+        for sid, dept, year, day, hour in conn.execute("SELECT id, department, year, date, time_from FROM attendance_sessions WHERE session_token LIKE 'G%' ORDER BY id").fetchall():
+            for uid, name, roll, habit in roster[(dept, year)]:
+                if rnd.random() < habit:
+                    yield sid, uid, name, roll, dept, year, f'{day} {int(hour.split(":")[0]):02d}:{rnd.randrange(15):02d}:00'
+    conn.executemany("INSERT INTO attendance_records (session_id,student_id,student_name,roll_number,department,year,marked_at) VALUES (?,?,?,?,?,?,?)", records())
+
+    evs = []
+    for i in range(events):
+        day = ANCHOR + timedelta(days=rnd.randrange(-540, 540)); org = rnd.choice(organizers)
+        evs.append((f'{words(2).title()} {EVENT_TYPES[i % 5].title()} {i}', words(12), rnd.choice(DEPTS + ['All'] * 3), EVENT_TYPES[i % 5],
+                    f'Hall {rnd.randrange(1, 20)}', day.isoformat(), f'{rnd.randrange(9, 19)}:00', (day - timedelta(days=3)).isoformat(),
+                    rnd.choice([50, 100, 300, 1000]), org, 'Bench Organizer', 'upcoming' if day >= ANCHOR else 'completed', ','.join(rnd.sample(WORDS, 3))))
+    conn.executemany("INSERT INTO events (title,description,department,event_type,venue,event_date,event_time,reg_deadline,max_participants,"
+                     "organizer_id,organizer_name,status,tags) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", evs)
+    event_ids = [r[0] for r in conn.execute("SELECT id FROM events ORDER BY id")]
+    student_ids = [m[0] for members in roster.values() for m in members]
+    pairs = {(rnd.choice(event_ids), rnd.choice(student_ids)) for _ in range(registrations)}
+    conn.executemany("INSERT OR IGNORE INTO event_registrations (event_id,user_id,registered_at) VALUES (?,?,'2025-06-01 10:00:00')", sorted(pairs))
+
+    base = ANCHOR - timedelta(days=540)
+    conn.executemany("INSERT INTO memories (event_id,uploader_id,uploader_name,title,description,image_path,album,created_at) VALUES (?,?,?,?,?,?,?,?)",
+                     ((rnd.choice(event_ids), rnd.choice(organizers), 'Bench Organizer', words(3).title(), words(8), f'bench/{i:06d}.jpg',
+                       rnd.choice(ALBUMS), f'{base + timedelta(days=i * 1080 // max(memories, 1))} {rnd.randrange(24):02d}:{rnd.randrange(60):02d}:00')
+                      for i in range(memories)))
+    conn.executemany("INSERT INTO notices (title,content,category,author_id,author_name,author_role,department,year,is_important,created_at) "
+                     "VALUES (?,?,?,?,?,?,?,?,?,?)",
+                     ((words(4).title(), words(30), rnd.choice(['general', 'academic', 'exam', 'event']), TEACHER_ID, 'Dr. Rajesh Kumar', 'teacher',
+                       rnd.choice(DEPTS + ['All'] * 2), rnd.choice(YEARS + ['All'] * 2), int(rnd.random() < 0.1),
+                       f'{ANCHOR - timedelta(days=rnd.randrange(365))} 09:00:00') for _ in range(notices)))
+    conn.commit(); cc.public_cache.invalidate()
+    return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+            for t in ('users', 'attendance_sessions', 'attendance_records', 'events', 'event_registrations', 'memories', 'notices')}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('db', help='database file to create or extend (init_db runs first)')
+    ap.add_argument('--scale', choices=SCALES, default='small')
+    for k in SCALES['small']: ap.add_argument(f'--{k}', type=int, help='override the scale preset')
+    ap.add_argument('--seed', type=int, default=42)
+    args = ap.parse_args(argv)
+    cc.app.config.update(DATABASE=args.db, TESTING=True)
+    cc.init_db()
+    conn = cc.connect_db()
+    try:
+        counts = generate(conn, seed=args.seed, **{k: getattr(args, k) if getattr(args, k) is not None else v for k, v in SCALES[args.scale].items()})
+    finally:
+        conn.close()
+    for t, n in counts.items(): print(f"{t:<22} {n:>9}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Load test for the QR mark_attendance write path.
+
+Seeds one class of N students and an open attendance session, then replays N
+simultaneous scans through the Flask test client (one thread and client per
+student) and reports latency percentiles, throughput and how many group
+commits the writer needed.
+
+    python -m bench.mark_burst [--students 120] [--threads N]
+"""
+import argparse, os, shutil, statistics, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import app as cc
+
+
+def pct(samples, p):
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--students', type=int, default=120)
+    ap.add_argument('--threads', type=int, default=0, help='concurrent scanners (default: one per student)')
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        cc.app.config.update(DATABASE=os.path.join(tmp, 'cc.db'), TESTING=True)
+        cc.init_db()
+        conn = cc.connect_db()
+        conn.executemany("INSERT INTO users (username,email,password,full_name,role,department,year,roll_number) VALUES (?,?,?,?,?,?,?,?)",
+                         ((f's{i}', f's{i}@bench.in', '-', f'Student {i}', 'student', 'Computer Engineering', 'SE', f'R{i:04d}')
+                          for i in range(args.students)))
+        conn.execute("INSERT INTO attendance_sessions (teacher_id,department,year,subject,session_token,date,expires_at) "
+                     "VALUES (2,'Computer Engineering','SE','Bench','BURST',date('now'),?)",
+                     ((cc.datetime.now() + cc.timedelta(hours=1)).isoformat(),))
+        conn.commit()
+        students = conn.execute("SELECT id, full_name, year, roll_number FROM users WHERE role='student'").fetchall()
+        conn.close()
+
+        clients = []
+        for u in students:
+            c = cc.app.test_client()
+            with c.session_transaction() as s:
+                s.update(user_id=u['id'], role='student', full_name=u['full_name'], year=u['year'], roll_number=u['roll_number'])
+            clients.append(c)
+
+        go = threading.Event()
+        def scan(c):
+            go.wait()
+            t = time.perf_counter(); r = c.get('/attendance/mark/BURST')
+            assert r.status_code == 200 and b'marked for' in r.data, r.status_code
+            return (time.perf_counter() - t) * 1000
+
+        clients[0].get('/attendance/mark/WARMUP')  # compile the result template outside the timing
+        b0 = cc.write_batcher.batches
+        with ThreadPoolExecutor(args.threads or len(clients)) as ex:
+            futures = [ex.submit(scan, c) for c in clients]
+            start = time.perf_counter(); go.set()
+            lat = [f.result() for f in futures]
+        wall = time.perf_counter() - start
+
+        conn = cc.connect_db()
+        present = conn.execute("SELECT present_count FROM attendance_sessions WHERE session_token='BURST'").fetchone()[0]
+        conn.close()
+        print(f"scans        {len(lat)}  (present_count {present})")
+        print(f"throughput   {len(lat) / wall:8.1f} scans/s")
+        print(f"latency      p50 {statistics.median(lat):.1f} ms   p99 {pct(lat, 99):.1f} ms   max {max(lat):.1f} ms")
+        print(f"commits      {cc.write_batcher.batches - b0} group commits")
+        return 0 if present == len(lat) else 1
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Throughput of the production server (serve()) against the Werkzeug dev server.
+
+Starts each server on a scratch database in a child process, then drives the
+public pages from keep-alive client threads spread over a few processes for a
+fixed time and reports requests/s and latency percentiles.
+
+    python -m bench.serve_throughput [--seconds 5] [--clients 32] [--workers N] [--threads 16]
+"""
+import argparse, http.client, multiprocessing as mp, os, shutil, socket, statistics, sys, tempfile, threading, time
+
+import app as cc
+
+PAGES = ['/', '/events', '/api/stats', '/login', '/departments', '/memories']
+
+
+def pct(samples, p):
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))] if s else 0.0
+
+
+def dev_server(port):
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 2)  # it logs every request; keep the cost, drop the noise
+    cc.app.run(host='127.0.0.1', port=port, debug=True, use_reloader=False)
+
+
+def prod_server(port, workers, threads):
+    cc.serve('127.0.0.1', port, workers, threads)
+
+
+def wait_for(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try: socket.create_connection(('127.0.0.1', port), 0.2).close(); return
+        except OSError: time.sleep(0.05)
+    raise RuntimeError(f'server on :{port} did not start')
+
+
+def client_proc(port, threads, seconds, out):
+    def run(lat, errors):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30); i = 0
+        end = time.perf_counter() + seconds
+        while (t := time.perf_counter()) < end:
+            try:
+                conn.request('GET', PAGES[i % len(PAGES)]); r = conn.getresponse(); r.read()
+                if r.status != 200: errors.append(r.status)
+                if r.getheader('Connection', '').lower() == 'close': conn.close()
+            except (OSError, http.client.HTTPException):
+                errors.append('conn'); conn.close()
+            lat.append((time.perf_counter() - t) * 1000); i += 1
+        conn.close()
+    lat, errors = [], []
+    ts = [threading.Thread(target=run, args=(lat, errors)) for _ in range(threads)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+    out.put((lat, len(errors)))
+
+
+def measure(port, clients, seconds):
+    ctx = mp.get_context('fork'); out = ctx.Queue()
+    procs = max(1, min(clients, (os.cpu_count() or 2) // 2 or 1))
+    ps = [ctx.Process(target=client_proc, args=(port, clients // procs + (i < clients % procs), seconds, out)) for i in range(procs)]
+    for p in ps: p.start()
+    lat, errors = [], 0
+    for _ in ps: l, e = out.get(); lat += l; errors += e
+    for p in ps: p.join()
+    return len(lat) / seconds, statistics.median(lat) if lat else 0.0, pct(lat, 99), errors
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--seconds', type=float, default=5)
+    ap.add_argument('--clients', type=int, default=32, help='concurrent keep-alive connections')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    ap.add_argument('--threads', type=int, default=16)
+    ap.add_argument('--port', type=int, default=5077)
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        cc.app.config.update(DATABASE=os.path.join(tmp, 'cc.db'), SCHEDULER_ENABLED=False)
+        cc.init_db()
+        ctx = mp.get_context('fork')
+        servers = [('dev server (debug)', dev_server, ()),
+                   (f'serve() {args.workers}w x {args.threads}t', prod_server, (args.workers, args.threads))]
+        print(f"{'server':28} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for name, target, extra in servers:
+            srv = ctx.Process(target=target, args=(args.port, *extra)); srv.start()
+            try:
+                wait_for(args.port)
+                measure(args.port, min(4, args.clients), 0.5)  # warm templates and connection pools
+                rps, p50, p99, errors = measure(args.port, args.clients, args.seconds)
+                print(f"{name:28} {rps:9.1f} {p50:8.1f} {p99:8.1f} {errors:7d}", flush=True)
+            finally:
+                srv.terminate(); srv.join(10)
+                if srv.is_alive(): srv.kill(); srv.join()
+            args.port += 1  # skip TIME_WAIT leftovers on the old port
+        return 0
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
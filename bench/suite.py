@@ -0,0 +1,307 @@
+"""Scripted load scenarios over a synthetic campus, with JSON results and baseline comparison.
+
+Generates a campus with bench.datagen, then runs each scenario with concurrent
+clients, either through the Flask test client in this process (default) or
+against serve() started on a local port (--server):
+
+    qr-burst            every class opens a session at once and every student scans it
+    dashboard-<role>    a storm of /dashboard loads for admin, teacher, organizer and student
+    gallery             /memories followed by infinite-scroll pages and album filters
+    like-storm          students liking the newest photos of one album
+    events-search       /events?q=, /search and /api/search over the generated vocabulary
+
+Each scenario reports throughput, p50/p95/p99 latency and SQL queries per
+request (from the /metrics counters). --out writes the results as JSON;
+--baseline compares against a stored run and exits 1 on a regression.
+Latencies only compare on the same machine: re-record the baseline with
+--save-baseline when the benchmark host changes.
+
+    python -m bench.suite [--scale small|campus] [--server] [--out results.json] [--baseline bench/baseline.json]
+"""
+import argparse, http.client, itertools, json, multiprocessing as mp, os, platform, re, shutil, sqlite3, subprocess, sys, tempfile, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import app as cc
+from bench import datagen
+from bench.serve_throughput import pct, wait_for
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+BURSTS = itertools.count()  # keeps session tokens unique across repeats
+PROM = re.compile(r'^(cc_http_requests_total|cc_http_request_queries_total)\{route="([^"]*)"[^}]*\} (\d+)$', re.M)
+
+
+# ── Clients ──────────────────────────────────────────────────────────────────
+def session_cookie(user):
+    """Signed Flask session cookie for a users row, as /login would set it (skips the password hash)."""
+    return cc.app.session_interface.get_signing_serializer(cc.app).dumps(
+        {k: user[k] for k in ('username', 'role', 'full_name', 'department', 'year', 'roll_number')} | {'user_id': user['id']})
+
+
+class LocalClient:
+    """Flask test client in this process."""
+    def __init__(self, cookie=None):
+        self.c = cc.app.test_client()
+        if cookie: self.c.set_cookie('session', cookie)
+
+    def request(self, method, path, data=None):
+        r = self.c.open(path, method=method, data=data)
+        return r.status_code, r.get_data()  # drains streamed bodies too
+
+
+class HttpClient:
+    """One keep-alive HTTP/1.1 connection to the local server."""
+    def __init__(self, port, cookie=None):
+        self.port = port; self.conn = None
+        self.headers = {'Cookie': f'session={cookie}'} if cookie else {}
+
+    def request(self, method, path, data=None):
+        body = urlencode(data) if data else None
+        headers = {**self.headers, 'Content-Type': 'application/x-www-form-urlencoded'} if body else self.headers
+        for retry in (False, True):  # a keep-alive connection the server already closed is reopened once
+            if self.conn is None: self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            try:
+                self.conn.request(method, path, body, headers); r = self.conn.getresponse(); out = r.read()
+                if r.getheader('Connection', '').lower() == 'close': self.conn.close(); self.conn = None
+                return r.status, out
+            except (OSError, http.client.HTTPException):
+                self.conn.close(); self.conn = None
+                if retry: raise
+
+
+class Target:
+    """Where scenarios send requests: the test client, or serve() on --port."""
+    def __init__(self, port=None):
+        self.port = port
+
+    def client(self, user=None):
+        cookie = session_cookie(user) if user else None
+        return HttpClient(self.port, cookie) if self.port else LocalClient(cookie)
+
+    def counters(self):
+        """(requests, SQL queries) served so far, excluding /metrics itself."""
+        if self.port:
+            time.sleep(3 * cc.app.config['METRICS_FLUSH'])  # let every worker flush its latest snapshot
+            c = self.client(); c.headers = {'Authorization': f"Bearer {cc.app.config['METRICS_TOKEN']}"}
+            _, text = c.request('GET', '/metrics'); totals = [0, 0]
+            for name, route, n in PROM.findall(text.decode()):
+                if route != '/metrics': totals[name == 'cc_http_request_queries_total'] += int(n)
+            return totals
+        routes, _ = cc.metrics.collect()
+        return [sum(sum(r['status'].values()) for k, r in routes.items() if k[0] != '/metrics'),
+                sum(r['queries'] for k, r in routes.items() if k[0] != '/metrics')]
+
+
+# ── Scenarios ────────────────────────────────────────────────────────────────
+class Run:
+    """Latency samples and failures of one scenario."""
+    def __init__(self):
+        self.lat = []; self.errors = 0; self._lock = threading.Lock()
+
+    def hit(self, client, path, method='GET', data=None, check=None):
+        t = time.perf_counter(); status, body = client.request(method, path, data)
+        ms = (time.perf_counter() - t) * 1000; bad = status != 200 or (check is not None and check not in body)
+        with self._lock: self.lat.append(ms); self.errors += bad
+        return body
+
+
+def users(conn, where, params=()):
+    return conn.execute(f"SELECT * FROM users WHERE {where} ORDER BY id", params).fetchall()
+
+
+def qr_burst(conn, target, args):
+    """Every class opens a session at the same moment and all of its students scan the QR code."""
+    expires = (cc.datetime.now() + cc.timedelta(hours=1)).isoformat(); jobs = []; tokens = []
+    for dept, year in ((d, y) for d in datagen.DEPTS for y in datagen.YEARS):
+        token = f'BURST{next(BURSTS)}'; tokens.append(token)
+        conn.execute("INSERT INTO attendance_sessions (teacher_id,department,year,subject,session_token,date,expires_at) VALUES (?,?,?,?,?,date('now'),?)",
+                     (datagen.TEACHER_ID, dept, year, 'Bench', token, expires))
+        jobs += [(target.client(u), token) for u in users(conn, "role='student' AND department=? AND year=?", (dept, year))]
+    conn.commit()
+    jobs[0][0].request('GET', '/attendance/mark/WARMUP')  # compile the result template outside the timing
+    def scan(run, job): run.hit(job[0], f'/attendance/mark/{job[1]}', check='marked for'.encode())
+    def verify(run):
+        marked = conn.execute(f"SELECT SUM(present_count) FROM attendance_sessions WHERE session_token IN ({','.join('?' * len(tokens))})", tokens).fetchone()[0]
+        run.errors += len(jobs) - marked
+        conn.execute(f"UPDATE attendance_sessions SET is_active=0 WHERE session_token IN ({','.join('?' * len(tokens))})", tokens); conn.commit()
+    return [lambda run, j=j: scan(run, j) for j in jobs], verify
+
+
+def dashboard_storm(role):
+    def scenario(conn, target, args):
+        """args.rounds /dashboard loads per client, for args.concurrency clients of one role."""
+        pool = users(conn, "role=?", (role,))
+        if role == 'student':  # spread over every class
+            pool = pool[::max(1, len(pool) // args.concurrency)]
+        clients = [target.client(pool[i % len(pool)]) for i in range(args.concurrency)]
+        clients[0].request('GET', '/dashboard')
+        def storm(run, c):
+            for _ in range(args.rounds): run.hit(c, '/dashboard')
+        return [lambda run, c=c: storm(run, c) for c in clients], None
+    return scenario
+
+
+def gallery(conn, target, args):
+    """Open the gallery (some clients on an album), then scroll args.rounds pages through /api/memories."""
+    students = users(conn, "role='student'")[::7][:args.concurrency]
+    albums = [None] + [a for a in datagen.ALBUMS if a]
+    target.client(students[0]).request('GET', '/memories')
+    def browse(run, i):
+        c = target.client(students[i % len(students)]); album = albums[i % len(albums)]
+        run.hit(c, '/memories' + (f'?{urlencode({"album": album})}' if album else ''))
+        url = '/api/memories' + (f'?{urlencode({"album": album})}' if album else '')
+        for _ in range(args.rounds):
+            nxt = json.loads(run.hit(c, url) or b'{}').get('next')
+            if not nxt: break
+            url = nxt
+    return [lambda run, i=i: browse(run, i) for i in range(args.concurrency)], None
+
+
+def events_search(conn, target, args):
+    """Each client searches args.rounds words through the events list, the search page and the search API."""
+    students = users(conn, "role='student'")[::11][:args.concurrency]
+    target.client(students[0]).request('GET', '/search?q=quiz')
+    def search(run, i):
+        c = target.client(students[i % len(students)])
+        for k in range(args.rounds):
+            word = datagen.WORDS[(i * 7 + k) % len(datagen.WORDS)]
+            path = ['/events?q={}', '/search?q={}', '/api/search?q={}', '/search?type=events&q={}'][k % 4]
+            run.hit(c, path.format(word))
+    return [lambda run, i=i: search(run, i) for i in range(args.concurrency)], None
+
+
+def like_storm(conn, target, args):
+    """Students liking the newest photos of one album as it is released, one POST per click."""
+    mids = [r[0] for r in conn.execute("SELECT id FROM memories WHERE album='Cultural Night' ORDER BY created_at DESC, id DESC LIMIT 24")]
+    students = users(conn, "role='student'")[::3][:args.concurrency]
+    def like(run, i):
+        c = target.client(students[i % len(students)])
+        for k in range(args.rounds): run.hit(c, f'/memories/{mids[(i + k) % len(mids)]}/like', 'POST')
+    return [lambda run, i=i: like(run, i) for i in range(args.concurrency)], None
+
+
+SCENARIOS = {'qr-burst': qr_burst, **{f'dashboard-{r}': dashboard_storm(r) for r in ('admin', 'teacher', 'organizer', 'student')},
+             'gallery': gallery, 'like-storm': like_storm, 'events-search': events_search}
+
+
+def run_scenario(conn, target, setup, args):
+    jobs, verify = setup(conn, target, args)
+    run = Run(); go = threading.Event()
+    requests0, queries0 = target.counters()
+    def job(j): go.wait(); j(run)
+    with ThreadPoolExecutor(args.concurrency) as ex:
+        futures = [ex.submit(job, j) for j in jobs]
+        start = time.perf_counter(); go.set()
+        for f in futures: f.result()
+    wall = time.perf_counter() - start
+    requests1, queries1 = target.counters()
+    if verify: verify(run)
+    n = len(run.lat)
+    return {'requests': n, 'errors': run.errors, 'seconds': round(wall, 3), 'throughput': round(n / wall, 1),
+            'p50': round(pct(run.lat, 50), 2), 'p95': round(pct(run.lat, 95), 2), 'p99': round(pct(run.lat, 99), 2),
+            'queries_per_request': round((queries1 - queries0) / max(requests1 - requests0, 1), 2)}
+
+
+# ── Results ──────────────────────────────────────────────────────────────────
+def compare(results, baseline, tolerance):
+    """Regressions of results against baseline, one message each."""
+    out = []
+    for name, r in results['scenarios'].items():
+        if r['errors']: out.append(f"{name}: {r['errors']} failed requests")
+        b = baseline['scenarios'].get(name)
+        if not b: continue
+        if r['throughput'] < b['throughput'] * (1 - tolerance):
+            out.append(f"{name}: throughput {r['throughput']} req/s, baseline {b['throughput']}")
+        if r['p95'] > b['p95'] * (1 + tolerance) and r['p95'] - b['p95'] > 1:
+            out.append(f"{name}: p95 {r['p95']} ms, baseline {b['p95']}")
+        if r['queries_per_request'] > b['queries_per_request'] + 0.5:  # deterministic data: any real increase is a code change
+            out.append(f"{name}: {r['queries_per_request']} queries/request, baseline {b['queries_per_request']}")
+    return out
+
+
+def report(results, baseline):
+    print(f"{'scenario':20} {'reqs':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'q/req':>6} {'errors':>6}" + ('   vs baseline' if baseline else ''))
+    for name, r in results['scenarios'].items():
+        b = (baseline or {}).get('scenarios', {}).get(name)
+        delta = f"   {r['throughput'] / b['throughput'] - 1:+.0%} req/s, {r['p95'] / b['p95'] - 1:+.0%} p95" if b and b['throughput'] and b['p95'] else ''
+        print(f"{name:20} {r['requests']:6d} {r['throughput']:9.1f} {r['p50']:8.1f} {r['p95']:8.1f} {r['p99']:8.1f} {r['queries_per_request']:6.1f} {r['errors']:6d}{delta}")
+
+
+def git_commit():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(BASELINE)).stdout.strip() or None
+    except OSError: return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--scale', choices=datagen.SCALES, default='small')
+    for k in datagen.SCALES['small']: ap.add_argument(f'--{k}', type=int, help='override the scale preset')
+    ap.add_argument('--seed', type=int, default=42)
+    ap.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset of: ' + ', '.join(SCENARIOS))
+    ap.add_argument('--concurrency', type=int, default=16, help='client threads per scenario')
+    ap.add_argument('--rounds', type=int, default=20, help='requests (or scroll pages) per client')
+    ap.add_argument('--repeat', type=int, default=3, help='timed runs per scenario after a warm-up run; the fastest is reported')
+    ap.add_argument('--server', action='store_true', help='drive serve() over HTTP instead of the in-process test client')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    ap.add_argument('--port', type=int, default=5088)
+    ap.add_argument('--out', help='write the results as JSON here')
+    ap.add_argument('--baseline', default=BASELINE, help='results file to compare against (default: %(default)s)')
+    ap.add_argument('--save-baseline', action='store_true', help='store this run as the baseline instead of comparing')
+    ap.add_argument('--tolerance', type=float, default=0.25, help='allowed throughput/p95 drift before flagging (default: %(default)s)')
+    args = ap.parse_args(argv)
+    scale = {k: getattr(args, k) if getattr(args, k) is not None else v for k, v in datagen.SCALES[args.scale].items()}
+    names = [n for n in args.scenarios.split(',') if n]
+    if unknown := set(names) - set(SCENARIOS): ap.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    tmp = tempfile.mkdtemp(); server = None; uploads = cc.UPLOAD_FOLDER
+    try:
+        # app.py reads the module-level UPLOAD_FOLDER, not the config key; keep spooled parts and blobs out of static/uploads
+        cc.UPLOAD_FOLDER = os.path.join(tmp, 'uploads')
+        cc.app.config.update(DATABASE=os.path.join(tmp, 'cc.db'), UPLOAD_FOLDER=cc.UPLOAD_FOLDER, TESTING=not args.server, SCHEDULER_ENABLED=False,
+                             METRICS_ENABLED=True, METRICS_FLUSH=0.1 if args.server else cc.app.config['METRICS_FLUSH'],
+                             METRICS_TOKEN=cc.app.config['METRICS_TOKEN'] or uuid.uuid4().hex)  # the forked server inherits it
+        cc.init_db()
+        conn = cc.connect_db()
+        t = time.perf_counter(); counts = datagen.generate(conn, seed=args.seed, **scale)
+        print(f"generated {counts['users']} users, {counts['attendance_records']} attendance records, {counts['events']} events, "
+              f"{counts['memories']} memories in {time.perf_counter() - t:.1f}s", flush=True)
+        if args.server:
+            server = mp.get_context('fork').Process(target=cc.serve, args=('127.0.0.1', args.port, args.workers)); server.start()
+            wait_for(args.port)
+        target = Target(args.port if args.server else None)
+
+        results = {'meta': {'scale': scale, 'seed': args.seed, 'transport': f'serve({args.workers})' if args.server else 'test-client',
+                            'concurrency': args.concurrency, 'rounds': args.rounds, 'repeat': args.repeat, 'commit': git_commit(),
+                            'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'cpus': os.cpu_count(),
+                            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}, 'scenarios': {}}
+        for name in names:  # one warm-up run (caches, templates), then the best of --repeat: interference only ever slows a run down
+            runs = [run_scenario(conn, target, SCENARIOS[name], args) for _ in range(args.repeat + 1)][1:]
+            results['scenarios'][name] = max(runs, key=lambda r: (r['errors'] == 0, r['throughput']))
+        conn.close()
+    finally:
+        if server:
+            server.terminate(); server.join(10)
+        cc.UPLOAD_FOLDER = uploads; cc.app.config['UPLOAD_FOLDER'] = uploads
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, 'w') as fh: json.dump(results, fh, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fh: json.dump(results, fh, indent=2); fh.write('\n')
+        report(results, None); print(f"baseline saved to {args.baseline}")
+        return 0
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh: baseline = json.load(fh)
+        same = {k: baseline['meta'].get(k) for k in ('scale', 'seed', 'transport', 'concurrency', 'rounds', 'repeat')} == \
+               {k: results['meta'][k] for k in ('scale', 'seed', 'transport', 'concurrency', 'rounds', 'repeat')}
+        if not same:
+            print(f"note: {args.baseline} was recorded with different settings; not comparing"); baseline = None
+    report(results, baseline)
+    regressions = compare(results, baseline or {'scenarios': {}}, args.tolerance)
+    for r in regressions: print('REGRESSION ' + r)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Regression benchmark for the teacher dashboard() and attendance() views.
+
+Seeds 10k students and 100k attendance records into a scratch database, then
+times both pages through the Flask test client and fails if the median
+latency of either one exceeds the ceiling.
+
+    python -m bench.teacher_pages [--students 10000] [--records 100000] [--ceiling-ms 250]
+"""
+import argparse, os, random, shutil, statistics, sys, tempfile, time
+
+import app as cc
+
+DEPTS = ['Computer Engineering', 'Information Technology', 'Electronics & Telecommunication',
+         'Mechanical Engineering', 'Civil Engineering', 'AIDS (AI & Data Science)']
+YEARS = ['FE', 'SE', 'TE', 'BE']
+TEACHER_ID = 2  # seeded by init_db, department Computer Engineering
+
+
+def seed(conn, students, records, seed=42):
+    rnd = random.Random(seed)
+    pw = cc.generate_password_hash('bench')
+    conn.executemany("INSERT INTO users (username,email,password,full_name,role,department,year,roll_number) VALUES (?,?,?,?,?,?,?,?)",
+                     ((f's{i}', f's{i}@bench.in', pw, f'Student {i:05d}', 'student', DEPTS[i % 6], YEARS[i // 6 % 4], f'R{i:05d}')
+                      for i in range(students)))
+    by_class = {}
+    for uid, dept, year in conn.execute("SELECT id, department, year FROM users WHERE role='student'"):
+        by_class.setdefault((dept, year), []).append(uid)
+    per_session = 100
+    sessions = []
+    for n in range(records // per_session):
+        dept, year = rnd.choice(list(by_class)) if n % 4 else (DEPTS[0], rnd.choice(YEARS))
+        teacher = TEACHER_ID if dept == DEPTS[0] else 1
+        sessions.append((teacher, dept, year, f'Subject {n % 12}', f'BENCH{n:06d}', f'2025-{n % 12 + 1:02d}-{n % 28 + 1:02d}', 0))
+    conn.executemany("INSERT INTO attendance_sessions (teacher_id,department,year,subject,session_token,date,is_active) VALUES (?,?,?,?,?,?,?)", sessions)
+    rows = []
+    for sid, dept, year in conn.execute("SELECT id, department, year FROM attendance_sessions"):
+        pool = by_class[(dept, year)]
+        for uid in rnd.sample(pool, min(per_session, len(pool))):
+            rows.append((sid, uid, dept, year))
+    conn.executemany("INSERT INTO attendance_records (session_id,student_id,department,year) VALUES (?,?,?,?)", rows)
+    conn.commit()
+    return len(rows)
+
+
+def timed(client, path, runs):
+    client.get(path)  # warm the pool and template cache
+    samples = []
+    for _ in range(runs):
+        t = time.perf_counter(); r = client.get(path); samples.append((time.perf_counter() - t) * 1000)
+        assert r.status_code == 200, (path, r.status_code)
+    return statistics.median(samples)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--students', type=int, default=10000)
+    ap.add_argument('--records', type=int, default=100000)
+    ap.add_argument('--runs', type=int, default=5)
+    ap.add_argument('--ceiling-ms', type=float, default=250)
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        cc.app.config.update(DATABASE=os.path.join(tmp, 'cc.db'), TESTING=True)
+        cc.init_db()
+        conn = cc.connect_db()
+        n = seed(conn, args.students, args.records); conn.close()
+        print(f"seeded {args.students} students, {n} attendance records")
+        client = cc.app.test_client()
+        client.post('/login', data={'email': 'teacher@isbm.edu.in', 'password': 'teacher@123'})
+        failed = False
+        for path in ('/dashboard', '/attendance'):
+            ms = timed(client, path, args.runs)
+            over = ms > args.ceiling_ms; failed |= over
+            print(f"{path:<12} median {ms:8.1f} ms  (ceiling {args.ceiling_ms:.0f} ms){'  FAIL' if over else ''}")
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,17 +1,50 @@
 #!/usr/bin/env python3
-"""CampusConnect v2.0 – Quick Start"""
-import os, sys
-for d in ['instance','static/uploads/events','static/uploads/memories','static/uploads/profiles','static/uploads/qr']:
-    os.makedirs(d, exist_ok=True)
+"""CampusConnect v2.0 – Quick Start
 
-from app import app, init_db
+    python run.py                 development server (debug, auto-reload)
+    python run.py --serve         production: pre-forked workers, threaded, no debugger
+
+Production tuning (flags override the SERVER_* defaults in app.config):
+    --workers N   SERVER_WORKERS  processes; start at one per CPU core. Each keeps
+                                  its own DB pool, caches and attendance writer.
+    --threads N   SERVER_THREADS  connections served at once per worker. SQLite
+                                  allows one writer at a time, so more threads mainly
+                                  help pages that wait on reads; keep DB_POOL_SIZE near it.
+    SERVER_TIMEOUT                idle keep-alive seconds before a thread is freed
+    SERVER_ACCESS_LOG             per-request log lines (off; the proxy logs instead)
+    SCHEDULER_ENABLED             background jobs; every worker runs the scheduler
+                                  but the lease rows let only one claim each job.
+Put nginx (or any proxy) in front for TLS and static files, e.g. with
+MEDIA_SENDFILE='x-accel'. `python -m bench.serve_throughput` compares both servers.
+"""
+import os, sys, argparse
+
+ap = argparse.ArgumentParser(description='CampusConnect server')
+ap.add_argument('--serve', action='store_true', help='run the production multi-process server')
+ap.add_argument('--host', default='0.0.0.0')
+ap.add_argument('--port', type=int, default=5000)
+ap.add_argument('--workers', type=int, help='worker processes (default: SERVER_WORKERS)')
+ap.add_argument('--threads', type=int, help='threads per worker (default: SERVER_THREADS)')
+args = ap.parse_args()
+
+from app import app, init_db, serve, UPLOAD_FOLDER, DB_PATH
+# Once, in the parent: workers fork from here with the schema already migrated.
+for d in ['events','memories','profiles','qr']:
+    os.makedirs(os.path.join(UPLOAD_FOLDER, d), exist_ok=True)
+os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 init_db()
 
+if args.serve:
+    workers = args.workers or app.config['SERVER_WORKERS']; threads = args.threads or app.config['SERVER_THREADS']
+    print(f"🎓  CampusConnect on http://{args.host}:{args.port}  ({workers} workers × {threads} threads)", flush=True)
+    serve(args.host, args.port, workers, threads)
+    sys.exit(0)
+
 print("\n" + "━"*55)
 print("🎓  CampusConnect v2.0")
 print("    ISBM College of Engineering, Pune")
 print("━"*55)
-print("🌐  Open: http://localhost:5000")
+print(f"🌐  Open: http://localhost:{args.port}")
 print("━"*55)
 print("👤  Admin:     admin@isbm.edu.in      / admin@isbm123")
 print("👩‍🏫  Teacher:   teacher@isbm.edu.in   / teacher@123")
@@ -29,4 +62,4 @@ print("    • Teacher sees student attendance reports")
 print("    • Organizer manages events & memories")
 print("━"*55 + "\n")
 
-app.run(debug=True, host='0.0.0.0', port=5000)
+app.run(debug=True, host=args.host, port=args.port)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Run EXPLAIN QUERY PLAN over every SELECT issued by the hot pages.
+
+Drives dashboard(), attendance(), notices(), memories(), events() and their
+infinite-scroll pages for each role through the Flask test client against a
+scratch database, captures the SQL with sqlite3's trace callback and reports
+any plan that falls back to a full table SCAN.  Exits 1 when one is found; -v also prints passing plans.
+
+    python scripts/explain_queries.py [-v]
+"""
+import os, sys, re, shutil, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app as cc
+
+PAGES = ['/dashboard', '/attendance', '/notices', '/notices?cat=academic', '/memories', '/memories?album=Fest',
+         '/memories?event=1', '/events', '/events?status=upcoming', '/events?dept=Computer+Engineering', '/', '/departments', '/api/stats',
+         '/admin/users', '/events?q=tech', '/search?q=tech', '/search?q=hack&type=notices',
+         '/timetable', '/attendance/session/1/export.csv', '/attendance/export/subjects.csv?from=2000-01-01',
+         '/attendance/export/students.csv', '/attendance/export/students.csv?below=75&subject=DS',
+         '/attendance/analytics', '/attendance/analytics?year=SE&from=2020-01']
+# Later pages of the keyset-paginated lists, resumed from a cursor.
+AFTER = {'/api/memories': ['2099-01-01 00:00:00', 1 << 40], '/api/events': ['2099-01-01', 1 << 40],
+         '/api/notices': [1, '2099-01-01 00:00:00', 1 << 40], '/api/admin/users': ['teacher', 'Z', 1 << 40]}
+# Lookup tables with a handful of rows, where a scan is the right plan.
+SMALL_TABLES = {'departments', 'cache_versions'}
+# Pre-aggregated rollups: an unfiltered (campus-wide) report reads all of them by design.
+ROLLUP_TABLES = {'attendance_rollup'}
+ALIAS = re.compile(r'(?:FROM|JOIN) (\w+) (?:AS )?(\w+)')
+SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)(\w+)(?!\w| USING| VIRTUAL TABLE)')
+
+
+def seed(conn):
+    conn.execute("INSERT INTO users (username,email,password,full_name,role,department,year,roll_number) VALUES "
+                 "('stu','stu@x.in',?,'Stu Dent','student','Computer Engineering','SE','R1')",
+                 (cc.generate_password_hash('secret1'),))
+    conn.execute("INSERT INTO attendance_sessions (teacher_id,department,year,subject,session_token,date,is_active) "
+                 "VALUES (2,'Computer Engineering','SE','DS','TOK',date('now'),0)")
+    conn.execute("INSERT INTO attendance_records (session_id,student_id,student_name) VALUES (1,4,'Stu Dent')")
+    conn.execute("INSERT INTO memories (event_id,uploader_id,image_path,album) VALUES (1,3,'x.png','Fest')")
+    conn.execute("INSERT INTO event_registrations (event_id,user_id) VALUES (1,4)")
+    conn.commit()
+
+
+def main(verbose=False):
+    tmp = tempfile.mkdtemp()
+    cc.app.config.update(DATABASE=os.path.join(tmp, 'cc.db'), TESTING=True)
+    cc.init_db()
+    conn = cc.connect_db(); seed(conn)
+
+    captured = []
+    connect = cc.connect_db
+    def traced(path=None):
+        c = connect(path); c.set_trace_callback(captured.append); return c
+    cc.connect_db = traced
+
+    for email, pw in [('admin@isbm.edu.in', 'admin@isbm123'), ('teacher@isbm.edu.in', 'teacher@123'),
+                      ('organizer@isbm.edu.in', 'organizer@123'), ('stu@x.in', 'secret1')]:
+        client = cc.app.test_client()
+        client.post('/login', data={'email': email, 'password': pw})
+        for page in PAGES:
+            client.get(page).get_data()  # drains streamed bodies, which run their queries lazily
+        for page, key in AFTER.items():
+            client.get(page, query_string={'after': cc.encode_cursor(key)})
+
+    seen, failures = set(), 0
+    for sql in captured:
+        sql = ' '.join(sql.split())
+        # FTS5 reads its own shadow tables ('main'.'x_fts_config' ...) through the same connection.
+        if not sql.upper().startswith('SELECT') or sql in seen or "'main'." in sql: continue
+        seen.add(sql)
+        plan = [r[3] for r in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+        # Scans of CO-ROUTINE / MATERIALIZE subquery results read an already bounded row set.
+        derived = {p.split()[-1] for p in plan if p.startswith(('CO-ROUTINE', 'MATERIALIZE'))}
+        alias = {a: t for t, a in ALIAS.findall(sql)}
+        bad = [p for p in plan if (m := SCAN.search(p)) and alias.get(m.group(1), m.group(1)) not in SMALL_TABLES | ROLLUP_TABLES | derived]
+        failures += bool(bad)
+        if bad or verbose:
+            print(('FAIL ' if bad else 'ok   ') + sql)
+            for p in plan: print('       ' + p)
+    print(f"{len(seen)} distinct queries, {failures} with a full table scan")
+    conn.close(); shutil.rmtree(tmp, ignore_errors=True)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main('-v' in sys.argv))
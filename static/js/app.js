@@ -0,0 +1,23 @@
+function toggleSidebar(){
+  document.getElementById('sidebar').classList.toggle('open');
+}
+// Close sidebar on outside click on mobile
+document.addEventListener('click', function(e){
+  const sb = document.getElementById('sidebar');
+  const btn = document.getElementById('menuBtn');
+  if(window.innerWidth < 900 && sb && !sb.contains(e.target) && btn && !btn.contains(e.target)){
+    sb.classList.remove('open');
+  }
+});
+// Infinite scroll: a .load-more sentinel fetches the next page's HTML into its data-into target
+const moreObserver = 'IntersectionObserver' in window && new IntersectionObserver(entries => entries.forEach(async e => {
+  const el = e.target;
+  if (!e.isIntersecting || el.dataset.busy) return;
+  el.dataset.busy = 1;
+  try {
+    const d = await (await fetch(el.dataset.src, {headers:{'X-Requested-With':'XMLHttpRequest'}})).json();
+    document.querySelector(el.dataset.into).insertAdjacentHTML('beforeend', d.html);
+    if (d.next) { el.dataset.src = d.next; delete el.dataset.busy; } else { moreObserver.unobserve(el); el.remove(); }
+  } catch (err) { moreObserver.unobserve(el); }  // leave the plain "Load more" link
+}), {rootMargin: '600px'});
+if (moreObserver) document.querySelectorAll('.load-more').forEach(el => moreObserver.observe(el));